@@ -0,0 +1,96 @@
+"""
+Бенчмарк накладных расходов на работу с базой данных в расчете на один апдейт.
+
+Сравнивает два режима:
+- без пула: каждое обращение открывает новое соединение aiosqlite (старое поведение);
+- с пулом: обращения берут долгоживущее соединение из пула.
+
+Нагрузка имитирует TrialMiddleware: на каждый апдейт выполняется db.get_user().
+Кэш пользователей по умолчанию выключен, чтобы замер показывал именно работу
+с базой; флаг --cache включает его.
+
+Запуск:
+    python benchmarks/bench_db.py --updates 2000 --concurrency 20
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+async def run_updates(db, user_ids, concurrency: int) -> list:
+    """
+    Прогоняет имитацию апдейтов и возвращает время обработки каждого в секундах.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    timings = []
+
+    async def one_update(user_id: int) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            await db.get_user(user_id)
+            timings.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one_update(user_id) for user_id in user_ids))
+    return timings
+
+
+def report(title: str, timings: list, wall: float) -> None:
+    """
+    Печатает сводку по замерам.
+    """
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(
+        f"{title:<12} апдейтов: {len(timings):>6}  "
+        f"среднее: {statistics.mean(timings) * 1000:8.3f} мс  "
+        f"p95: {p95 * 1000:8.3f} мс  "
+        f"пропускная способность: {len(timings) / wall:10.1f} апд/с"
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    from database import db
+
+    await db.init_db()
+    for user_id in range(1, args.users + 1):
+        await db.add_user(user_id, user_id, f"user{user_id}")
+
+    user_ids = [(i % args.users) + 1 for i in range(args.updates)]
+
+    # Без пула: закрываем пул, db.connection() переходит на одноразовые соединения
+    await db.close_db()
+    started = time.perf_counter()
+    before = await run_updates(db, user_ids, args.concurrency)
+    report("без пула", before, time.perf_counter() - started)
+
+    # С пулом
+    await db.init_db()
+    started = time.perf_counter()
+    after = await run_updates(db, user_ids, args.concurrency)
+    report("с пулом", after, time.perf_counter() - started)
+    await db.close_db()
+
+    print(f"Ускорение по среднему времени: {statistics.mean(before) / statistics.mean(after):.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=500, help="Количество пользователей в базе")
+    parser.add_argument("--updates", type=int, default=2000, help="Количество имитируемых апдейтов")
+    parser.add_argument("--concurrency", type=int, default=20, help="Количество одновременно обрабатываемых апдейтов")
+    parser.add_argument("--cache", action="store_true", help="Включить кэш пользователей перед get_user()")
+    args = parser.parse_args()
+
+    if not args.cache:
+        os.environ["USER_CACHE_SIZE"] = "0"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ["DATABASE_PATH"] = str(Path(tmp_dir) / "bench.db")
+        asyncio.run(main(args))
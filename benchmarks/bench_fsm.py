@@ -0,0 +1,139 @@
+"""
+Бенчмарк хранилищ состояний FSM: MemoryStorage против BoundedMemoryStorage и SQLiteStorage.
+
+Нагрузка имитирует апдейты онбординга: на каждый апдейт выполняются
+get_state (его делает FSMContextMiddleware), get_data, update_data
+и set_state. Сравниваются режимы:
+- memory: MemoryStorage aiogram (все теряется при перезапуске);
+- bounded: BoundedMemoryStorage с ограничением простоя и объема;
+- sqlite: SQLiteStorage с кэшем в памяти и отложенной записью;
+- sqlite-cold: SQLiteStorage без кэша, каждое чтение идет в базу.
+
+Отдельно печатается время сброса накопленных изменений в базу: оно
+не входит во время обработки апдейта.
+
+Запуск:
+    python benchmarks/bench_fsm.py --users 500 --updates 5000
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+async def run_updates(storage, keys, concurrency: int) -> list:
+    """
+    Прогоняет имитацию апдейтов и возвращает время обработки каждого в секундах.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    timings = []
+    # Крупные данные сессии: рекомендация тарифов с описаниями и списками функций
+    tariff_data = {
+        "recommendation": "Бизнес",
+        "explanation": "Подходит для команды до 10 человек с интеграцией CRM. " * 4,
+        "tariffs": [{"name": name, "price": 990 * (i + 1), "features": ["CRM", "Аналитика", "API"]}
+                    for i, name in enumerate(["Старт", "Бизнес", "Про"])]
+    }
+
+    async def one_update(number: int, key) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            await storage.get_state(key)
+            data = await storage.get_data(key)
+            if "tariff_data" not in data:
+                await storage.update_data(key, {"tariff_data": tariff_data})
+            await storage.update_data(key, {"status_message_id": number})
+            await storage.set_state(key, f"OnboardingStates:question_{number % 5}")
+            timings.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one_update(number, key) for number, key in enumerate(keys)))
+    return timings
+
+
+def report(title: str, timings: list, wall: float) -> None:
+    """
+    Печатает сводку по замерам.
+    """
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(
+        f"{title:<12} апдейтов: {len(timings):>6}  "
+        f"среднее: {statistics.mean(timings) * 1e6:8.1f} мкс  "
+        f"p95: {p95 * 1e6:8.1f} мкс  "
+        f"пропускная способность: {len(timings) / wall:10.1f} апд/с"
+    )
+
+
+async def bench_sqlite(title: str, keys, args: argparse.Namespace, cache_size: int) -> list:
+    """
+    Замеряет SQLiteStorage и время сброса его изменений в базу.
+    """
+    from database.fsm_storage import SQLiteStorage
+
+    storage = SQLiteStorage(cache_size=cache_size, flush_interval=args.flush_interval_ms / 1000)
+    started = time.perf_counter()
+    timings = await run_updates(storage, keys, args.concurrency)
+    report(title, timings, time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await storage.close()
+    metrics = storage.get_metrics()
+    print(
+        f"{'':<12} изменений: {metrics['writes']}, слито до записи: {metrics['coalesced']}, "
+        f"записано строк: {metrics['flushed_records']} за {metrics['flushes']} сбросов, "
+        f"чтений из базы: {metrics['db_reads']}, финальный сброс: {(time.perf_counter() - started) * 1000:.1f} мс"
+    )
+    return timings
+
+
+async def main(args: argparse.Namespace) -> None:
+    from aiogram.fsm.storage.base import StorageKey
+    from aiogram.fsm.storage.memory import MemoryStorage
+    from database import db
+    from database.fsm_storage import BoundedMemoryStorage
+
+    await db.init_db()
+    keys = [
+        StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+        for user_id in ((i % args.users) + 1 for i in range(args.updates))
+    ]
+
+    started = time.perf_counter()
+    memory = await run_updates(MemoryStorage(), keys, args.concurrency)
+    report("memory", memory, time.perf_counter() - started)
+
+    bounded_storage = BoundedMemoryStorage()
+    started = time.perf_counter()
+    bounded = await run_updates(bounded_storage, keys, args.concurrency)
+    report("bounded", bounded, time.perf_counter() - started)
+    print(f"{'':<12} сессий: {len(bounded_storage._sessions)}, объем: {bounded_storage.total_bytes / 1024:.0f} КБ")
+
+    hot = await bench_sqlite("sqlite", keys, args, args.cache_size)
+    cold = await bench_sqlite("sqlite-cold", keys, args, 0)
+    await db.close_db()
+
+    print(
+        f"Добавка к апдейту по среднему времени: bounded {(statistics.mean(bounded) - statistics.mean(memory)) * 1e6:.1f} мкс, "
+        f"sqlite {(statistics.mean(hot) - statistics.mean(memory)) * 1e6:.1f} мкс, "
+        f"sqlite-cold {(statistics.mean(cold) - statistics.mean(memory)) * 1e6:.1f} мкс"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=500, help="Количество пользователей (ключей FSM)")
+    parser.add_argument("--updates", type=int, default=5000, help="Количество имитируемых апдейтов")
+    parser.add_argument("--concurrency", type=int, default=1, help="Количество одновременно обрабатываемых апдейтов")
+    parser.add_argument("--cache-size", type=int, default=10000, help="Размер кэша SQLiteStorage")
+    parser.add_argument("--flush-interval-ms", type=int, default=50, help="Задержка записи изменений SQLiteStorage")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ["DATABASE_PATH"] = str(Path(tmp_dir) / "bench.db")
+        asyncio.run(main(args))
@@ -0,0 +1,266 @@
+"""
+Бенчмарк приема апдейтов: поллинг (getUpdates) против webhook-сервера (services/webhook.py).
+
+Telegram заменяется локальным сервером aiohttp с искусственной сетевой
+задержкой --rtt-ms на каждый запрос:
+- polling: aiogram опрашивает getUpdates (до 100 апдейтов за запрос),
+  сервер отвечает, как только появился хотя бы один апдейт;
+- webhook: отправитель, как Telegram, доставляет каждый апдейт отдельным
+  POST-запросом, не более --max-connections одновременно, и повторяет
+  доставку при ответе 503.
+
+Апдейты становятся доступны с частотой --rate в секунду (0 - все сразу,
+то есть разбор накопившейся очереди). Обработчик апдейта только считает
+его и при необходимости ждет --handler-ms, имитируя работу бота. Для
+каждого режима печатается задержка от появления апдейта до начала его
+обработки и пропускная способность.
+
+Запуск:
+    python benchmarks/bench_ingest.py --updates 5000 --rtt-ms 50 --rate 0
+    python benchmarks/bench_ingest.py --updates 3000 --rtt-ms 50 --rate 500
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+from pathlib import Path
+
+from aiohttp import web, ClientSession, TCPConnector
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+TOKEN = "123456:BENCHMARK"
+API_PORT = 18081
+WEBHOOK_PORT = 18082
+
+
+def make_updates(count: int, users: int) -> list:
+    """
+    Создает текстовые сообщения от users пользователей.
+    """
+    updates = []
+    for number in range(count):
+        user_id = number % users + 1
+        updates.append({
+            "update_id": number + 1,
+            "message": {
+                "message_id": number + 1,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+                "text": "Розничная торговля, Excel и 1С"
+            }
+        })
+    return updates
+
+
+class Source:
+    """
+    Апдейты, появляющиеся с заданной частотой, и замеры их обработки.
+    """
+
+    def __init__(self, updates: list, rate: float) -> None:
+        self.updates = updates
+        self.rate = rate
+        self.started = 0.0
+        self.last_handled = 0.0
+        self.latencies = []
+        self.note = ""
+        self.finished = asyncio.Event()
+
+    def start(self) -> None:
+        self.started = time.monotonic()
+
+    def available_at(self, index: int) -> float:
+        return self.started + (index / self.rate if self.rate else 0.0)
+
+    def handled(self, update_id: int) -> None:
+        self.last_handled = time.monotonic()
+        self.latencies.append(self.last_handled - self.available_at(update_id - 1))
+        if len(self.latencies) == len(self.updates):
+            self.finished.set()
+
+
+def create_dispatcher(source: Source, handler_ms: float):
+    """
+    Создает диспетчер с обработчиком, который только считает апдейты.
+    """
+    from aiogram import Dispatcher
+    from aiogram.types import Message
+
+    dp = Dispatcher()
+
+    @dp.message()
+    async def on_message(message: Message, event_update) -> None:
+        source.handled(event_update.update_id)
+        if handler_ms:
+            await asyncio.sleep(handler_ms / 1000)
+
+    return dp
+
+
+def create_api(source: Source, rtt: float) -> web.Application:
+    """
+    Создает имитацию Bot API: getMe, deleteWebhook и getUpdates с долгим опросом.
+    """
+    async def handle(request: web.Request) -> web.Response:
+        form = await request.post()
+        await asyncio.sleep(rtt / 2)
+        method = request.match_info["method"]
+        result = True
+        if method == "getMe":
+            result = {"id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif method == "getUpdates":
+            offset = int(form.get("offset", 1))
+            limit = int(form.get("limit", 100))
+            timeout = float(form.get("timeout", 10))
+            index = max(offset - 1, 0)
+            result = []
+            if index < len(source.updates):
+                # Долгий опрос: ждем появления следующего апдейта, но не дольше timeout
+                wait = source.available_at(index) - time.monotonic()
+                if wait > timeout:
+                    await asyncio.sleep(timeout)
+                else:
+                    await asyncio.sleep(max(wait, 0))
+                    now = time.monotonic()
+                    end = index
+                    while end < min(index + limit, len(source.updates)) and source.available_at(end) <= now:
+                        end += 1
+                    result = source.updates[index:end]
+        await asyncio.sleep(rtt / 2)
+        return web.json_response({"ok": True, "result": result})
+
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", handle)
+    return app
+
+
+async def start_site(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+def create_bot():
+    """
+    Создает бота, который обращается к имитации Bot API.
+    """
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{API_PORT}"))
+    return Bot(token=TOKEN, session=session)
+
+
+async def bench_polling(args: argparse.Namespace, updates: list) -> Source:
+    """
+    Замеряет прием апдейтов поллингом.
+    """
+    source = Source(updates, args.rate)
+    api = await start_site(create_api(source, args.rtt_ms / 1000), API_PORT)
+    bot = create_bot()
+    dp = create_dispatcher(source, args.handler_ms)
+
+    source.start()
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, polling_timeout=10))
+    await source.finished.wait()
+    await dp.stop_polling()
+    await polling
+    await api.cleanup()
+    return source
+
+
+async def bench_webhook(args: argparse.Namespace, updates: list) -> Source:
+    """
+    Замеряет прием апдейтов webhook-сервером.
+    """
+    from services.webhook import WebhookServer, SECRET_HEADER
+
+    source = Source(updates, args.rate)
+    bot = create_bot()
+    dp = create_dispatcher(source, args.handler_ms)
+    server = WebhookServer(
+        lambda update: dp.feed_raw_update(bot, update),
+        path="/webhook", secret="bench", queue_size=args.queue_size, workers=args.workers
+    )
+    await server.start("127.0.0.1", WEBHOOK_PORT)
+
+    url = f"http://127.0.0.1:{WEBHOOK_PORT}/webhook"
+    headers = {SECRET_HEADER: "bench", "Content-Type": "application/json"}
+    connections = asyncio.Semaphore(args.max_connections)
+    retries = 0
+
+    async def deliver(session: ClientSession, index: int, update: dict) -> None:
+        nonlocal retries
+        await asyncio.sleep(max(source.available_at(index) - time.monotonic(), 0))
+        body = json.dumps(update)
+        while True:
+            async with connections:
+                await asyncio.sleep(args.rtt_ms / 2000)
+                async with session.post(url, data=body, headers=headers) as response:
+                    status = response.status
+                await asyncio.sleep(args.rtt_ms / 2000)
+            if status == 200:
+                return
+            retries += 1
+            await asyncio.sleep(1)
+
+    async with ClientSession(connector=TCPConnector(limit=args.max_connections)) as session:
+        source.start()
+        await asyncio.gather(*(deliver(session, index, update) for index, update in enumerate(updates)))
+        await source.finished.wait()
+
+    metrics = server.get_metrics()
+    await server.stop()
+    await bot.session.close()
+    source.note = (
+        f"ответ сервера: {metrics['avg_ack_ms']:.2f} мс, "
+        f"отказов при заполненной очереди: {metrics['overflowed']}, повторных доставок: {retries}"
+    )
+    return source
+
+
+def report(title: str, source: Source) -> None:
+    """
+    Печатает сводку по замерам.
+    """
+    latencies = sorted(source.latencies)
+    wall = source.last_handled - source.started
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(
+        f"{title:<10} апдейтов: {len(latencies):>6}  "
+        f"задержка: среднее {statistics.mean(latencies) * 1000:8.1f} мс  p95 {p95 * 1000:8.1f} мс  "
+        f"пропускная способность: {len(latencies) / wall:8.1f} апд/с"
+    )
+    if source.note:
+        print(f"{'':<10} {source.note}")
+
+
+async def main(args: argparse.Namespace) -> None:
+    import logging
+    logging.basicConfig(level=logging.WARNING)
+
+    updates = make_updates(args.updates, args.users)
+    rate_text = f"{args.rate:.0f} апд/с" if args.rate else "все сразу"
+    print(f"RTT {args.rtt_ms:.0f} мс, поступление: {rate_text}, обработка: {args.handler_ms:.0f} мс")
+
+    report("polling", await bench_polling(args, updates))
+    report("webhook", await bench_webhook(args, updates))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=5000, help="Количество апдейтов")
+    parser.add_argument("--users", type=int, default=500, help="Количество пользователей")
+    parser.add_argument("--rtt-ms", type=float, default=50, help="Сетевая задержка запроса к Telegram и обратно")
+    parser.add_argument("--rate", type=float, default=0, help="Апдейтов в секунду (0 - все сразу)")
+    parser.add_argument("--handler-ms", type=float, default=0, help="Время обработки одного апдейта")
+    parser.add_argument("--max-connections", type=int, default=40, help="Одновременных доставок webhook")
+    parser.add_argument("--workers", type=int, default=16, help="Обработчиков webhook-сервера")
+    parser.add_argument("--queue-size", type=int, default=1000, help="Размер очереди webhook-сервера")
+    asyncio.run(main(parser.parse_args()))
@@ -5,17 +5,21 @@ import logging
 import asyncio
 import sys
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.enums.parse_mode import ParseMode
 from aiogram.client.default import DefaultBotProperties
 
-from config import BOT_TOKEN
-from database.db import init_db
+from config import BOT_TOKEN, BOT_MODE
+from database.db import init_db, close_db
+from database.fsm_storage import create_fsm_storage
 from database.models import init_models
-from handlers.onboarding import onboarding_router
+from handlers.onboarding import onboarding_router, deliver_recommendation, fail_recommendation
 from handlers.trial import trial_router, start_trial_checker
 from handlers.admin import admin_router
 from middlewares.trial_check import TrialMiddleware
+from services.analysis_queue import start_analysis_queue, stop_analysis_queue
+from services.broadcast import resume_broadcasts
+from services.stats_reconciler import start_stats_reconciler
+from services.webhook import run_webhook
 
 # Настройка логирования
 logging.basicConfig(
@@ -30,13 +34,24 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-async def main() -> None:
+def create_bot() -> Bot:
     """
-    Главная функция для запуска бота.
+    Создает экземпляр бота.
+    
+    Returns:
+        Бот с HTML-разметкой по умолчанию
     """
-    # Инициализация бота и диспетчера
-    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    dp = Dispatcher(storage=MemoryStorage())
+    return Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+
+
+def create_dispatcher() -> Dispatcher:
+    """
+    Создает диспетчер с хранилищем состояний, middleware и роутерами.
+    
+    Returns:
+        Диспетчер
+    """
+    dp = Dispatcher(storage=create_fsm_storage())
     
     # Регистрация middleware
     dp.message.middleware(TrialMiddleware())
@@ -46,6 +61,33 @@ async def main() -> None:
     dp.include_router(onboarding_router)
     dp.include_router(trial_router)
     dp.include_router(admin_router)
+    return dp
+
+
+async def start_background_tasks(bot: Bot) -> None:
+    """
+    Запускает фоновые задачи, которые должны работать в одном экземпляре.
+    
+    Args:
+        bot: Экземпляр бота
+    """
+    # Запуск фоновой задачи для проверки триал-периода
+    asyncio.create_task(start_trial_checker(bot))
+    
+    # Запуск фоновой сверки счетчиков статистики админ-панели
+    asyncio.create_task(start_stats_reconciler())
+    
+    # Возобновление рассылок, прерванных остановкой бота
+    await resume_broadcasts(bot)
+
+
+async def main() -> None:
+    """
+    Главная функция для запуска бота.
+    """
+    # Инициализация бота и диспетчера
+    bot = create_bot()
+    dp = create_dispatcher()
     
     # Инициализация базы данных
     try:
@@ -54,14 +96,34 @@ async def main() -> None:
         logger.info("База данных инициализирована успешно")
     except Exception as e:
         logger.error(f"Ошибка при инициализации базы данных: {e}")
+        await close_db()
         return
     
-    # Запуск фоновой задачи для проверки триал-периода
-    asyncio.create_task(start_trial_checker(bot))
+    # Проверка триалов, сверка статистики и возобновление рассылок
+    await start_background_tasks(bot)
+    
+    # Запуск очереди анализа ответов (с задачами, оставшимися после перезапуска)
+    await start_analysis_queue(
+        lambda job: deliver_recommendation(bot, dp.storage, job),
+        on_failure=lambda job: fail_recommendation(bot, dp.storage, job)
+    )
     
-    # Удаление webhook и запуск поллинга
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    # Прием апдейтов: встроенный webhook-сервер или поллинг (с удалением webhook)
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook(bot, dp)
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    finally:
+        # Останавливаем очередь анализа (незавершенные задачи остаются в базе)
+        await stop_analysis_queue()
+        
+        # Записываем изменения состояний FSM, сделанные после остановки приема апдейтов
+        await dp.storage.close()
+        
+        # Дожидаемся записи отложенных запросов и закрываем пул соединений
+        await close_db()
 
 
 if __name__ == "__main__":
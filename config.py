@@ -11,20 +11,131 @@ load_dotenv()
 
 # Базовые настройки
 BASE_DIR = Path(__file__).resolve().parent
-DATABASE_PATH = BASE_DIR / "database" / "bot.db"
+DATABASE_PATH = Path(os.getenv("DATABASE_PATH", BASE_DIR / "database" / "bot.db"))
 
 # Telegram Bot settings
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 ADMIN_IDS = list(map(int, os.getenv("ADMIN_IDS", "").split(","))) if os.getenv("ADMIN_IDS") else []
 
+# Получение апдейтов: поллинг или webhook (services/webhook.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()  # "polling" - getUpdates, "webhook" - встроенный HTTP-сервер
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # Публичный адрес сервера, например https://bot.example.com (пусто - webhook не регистрируется)
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")  # Путь, на который Telegram присылает апдейты
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")  # Адрес, на котором слушает сервер
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))  # Порт сервера
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # Секрет заголовка X-Telegram-Bot-Api-Secret-Token (пусто - случайный при запуске)
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))  # Апдейтов в очереди; при переполнении Telegram получает 503 и повторит
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "16"))  # Параллельных обработчиков апдейтов
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))  # Одновременных соединений от Telegram (1-100)
+
+# Несколько процессов-обработчиков (supervisor.py и services/sharding.py)
+SHARDS = int(os.getenv("SHARDS", str(os.cpu_count() or 1)))  # Процессов-обработчиков; апдейт идет в процесс своего пользователя
+SHARD_QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", "1000"))  # Апдейтов в очереди к одному процессу
+SHARD_CONCURRENCY = int(os.getenv("SHARD_CONCURRENCY", "64"))  # Одновременно обрабатываемых апдейтов в процессе (по одному на пользователя)
+SHARD_HEARTBEAT_INTERVAL = float(os.getenv("SHARD_HEARTBEAT_INTERVAL", "5"))  # Период отчета процесса супервизору, в секундах
+SHARD_HEARTBEAT_TIMEOUT = float(os.getenv("SHARD_HEARTBEAT_TIMEOUT", "30"))  # Процесс без отчета дольше этого считается зависшим и перезапускается
+
 # OpenAI settings
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4.1-nano")
 
+# Устойчивость запросов к OpenAI
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "20"))  # Общий срок на запрос вместе с повторами, в секундах
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))  # Повторов при временных ошибках
+OPENAI_RETRY_BASE_DELAY = float(os.getenv("OPENAI_RETRY_BASE_DELAY", "0.5"))  # Базовая задержка перед повтором
+OPENAI_CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", "8"))  # Одновременных запросов (по лимитам аккаунта)
+OPENAI_BREAKER_THRESHOLD = int(os.getenv("OPENAI_BREAKER_THRESHOLD", "5"))  # Сбоев подряд до размыкания
+OPENAI_BREAKER_RESET = float(os.getenv("OPENAI_BREAKER_RESET", "30"))  # Секунд до пробного запроса
+
+# Выбор модели по времени ответа и хеджирование медленных запросов
+OPENAI_ALT_MODEL = os.getenv("OPENAI_ALT_MODEL", "")  # Альтернативная модель (пусто - только OPENAI_MODEL)
+OPENAI_LATENCY_ROUTING = os.getenv("OPENAI_LATENCY_ROUTING", "true").lower() in ("1", "true", "yes")  # Простые запросы - самой быстрой модели
+OPENAI_SIMPLE_ANSWERS_CHARS = int(os.getenv("OPENAI_SIMPLE_ANSWERS_CHARS", "300"))  # Ответы не длиннее - простой запрос
+OPENAI_LATENCY_WINDOW = int(os.getenv("OPENAI_LATENCY_WINDOW", "200"))  # Последних замеров для перцентилей
+OPENAI_HEDGE_ENABLED = os.getenv("OPENAI_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+OPENAI_HEDGE_PERCENTILE = float(os.getenv("OPENAI_HEDGE_PERCENTILE", "95"))  # Второй запрос после этого перцентиля
+OPENAI_HEDGE_DELAY = float(os.getenv("OPENAI_HEDGE_DELAY", "3"))  # Задержка второго запроса, пока мало замеров
+
+# Учет вызовов OpenAI: цены в долларах за 1 млн токенов (по умолчанию - gpt-4.1-nano)
+OPENAI_PRICE_INPUT = float(os.getenv("OPENAI_PRICE_INPUT", "0.10"))  # Входные токены
+OPENAI_PRICE_CACHED_INPUT = float(os.getenv("OPENAI_PRICE_CACHED_INPUT", "0.025"))  # Входные токены из кэша промптов
+OPENAI_PRICE_OUTPUT = float(os.getenv("OPENAI_PRICE_OUTPUT", "0.40"))  # Выходные токены
+LLM_CALLS_RETENTION_DAYS = int(os.getenv("LLM_CALLS_RETENTION_DAYS", "30"))  # Хранение записей о вызовах (сводки по дням хранятся всегда)
+
+# Потоковая выдача объяснения рекомендации
+OPENAI_STREAMING = os.getenv("OPENAI_STREAMING", "true").lower() in ("1", "true", "yes")
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))  # Минимальный интервал между правками сообщения
+
+# Настройки пула соединений с базой данных
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))  # Количество постоянных соединений
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))  # Ожидание блокировки записи
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "8192"))  # Размер страничного кэша на соединение
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(64 * 1024 * 1024)))  # Размер memory-mapped I/O в байтах
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))  # Кэш подготовленных запросов
+
+# Настройки отложенной записи (write-behind) с групповыми коммитами
+DB_WRITE_BEHIND = os.getenv("DB_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+DB_WRITE_BATCH_SIZE = int(os.getenv("DB_WRITE_BATCH_SIZE", "100"))  # Размер пачки для немедленного сброса
+DB_WRITE_FLUSH_INTERVAL_MS = int(os.getenv("DB_WRITE_FLUSH_INTERVAL_MS", "50"))  # Максимальная задержка записи
+DB_WRITE_MAX_PENDING = int(os.getenv("DB_WRITE_MAX_PENDING", "5000"))  # Предельная глубина очереди
+
+# Настройки кэша записей пользователей перед db.get_user()
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))  # Максимум записей (0 - кэш выключен)
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))  # Время жизни записи в секундах
+
+# Хранилище состояний FSM (database/fsm_storage.py)
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite").lower()  # "sqlite" - в базе данных, "memory" - только в памяти
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))  # Ключей в памяти (0 - каждое чтение идет в базу)
+FSM_FLUSH_INTERVAL_MS = int(os.getenv("FSM_FLUSH_INTERVAL_MS", "50"))  # Задержка записи изменений (0 - сразу)
+FSM_IDLE_TTL = float(os.getenv("FSM_IDLE_TTL", str(3 * 86400)))  # Сессия без обращений дольше этого удаляется (0 - хранится всегда)
+FSM_MEMORY_BUDGET_MB = float(os.getenv("FSM_MEMORY_BUDGET_MB", "64"))  # Объем сессий в режиме memory, лишние вытесняются LRU
+
+# Локальный подбор тарифа по ответам онбординга до обращения к OpenAI
+TARIFF_SCORER_ENABLED = os.getenv("TARIFF_SCORER_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Фоновая очередь анализа ответов онбординга
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "4"))  # Параллельных обработчиков
+ANALYSIS_MAX_ATTEMPTS = int(os.getenv("ANALYSIS_MAX_ATTEMPTS", "3"))  # Попыток на задачу (с учетом перезапусков)
+
+# Настройки кэша рекомендаций тарифов по нормализованным ответам онбординга
+RECOMMENDATION_CACHE_SIZE = int(os.getenv("RECOMMENDATION_CACHE_SIZE", "1000"))  # Записей в памяти (0 - кэш выключен)
+RECOMMENDATION_CACHE_TTL = float(os.getenv("RECOMMENDATION_CACHE_TTL", str(7 * 86400)))  # Время жизни в секундах
+RECOMMENDATION_CACHE_MAX_ROWS = int(os.getenv("RECOMMENDATION_CACHE_MAX_ROWS", "50000"))  # Записей в базе данных
+
+# Локальная модель подбора тарифа, обученная на рекомендациях OpenAI (scripts/train_distilled_model.py)
+DISTILLED_MODEL_PATH = Path(os.getenv("DISTILLED_MODEL_PATH", BASE_DIR / "database" / "distilled_model.npz"))
+DISTILLED_MODEL_THRESHOLD = float(os.getenv("DISTILLED_MODEL_THRESHOLD", "0.9"))  # Минимальная уверенность (больше 1 - выключена)
+
+# Кэш рекомендаций по похожим свободным ответам
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.8"))  # Минимальная похожесть (больше 1 - выключен)
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "20000"))  # Наборов ответов в индексе
+
 # Настройки приложения
 TRIAL_PERIOD_DAYS = 14  # Длительность триального периода в днях
 REMINDER_DAYS_BEFORE = 1  # За сколько дней до окончания триала отправлять напоминание
 
+# Настройки планировщика событий триала
+TRIAL_SCHEDULER_HORIZON_HOURS = float(os.getenv("TRIAL_SCHEDULER_HORIZON_HOURS", "6"))  # Окно подгрузки сроков
+TRIAL_SCHEDULER_PAGE_SIZE = int(os.getenv("TRIAL_SCHEDULER_PAGE_SIZE", "1000"))  # Размер страницы при подгрузке
+TRIAL_SCHEDULER_BATCH_SIZE = int(os.getenv("TRIAL_SCHEDULER_BATCH_SIZE", "500"))  # Максимум событий за одно срабатывание
+
+# Сверка счетчиков статистики админ-панели с таблицей users
+STATS_RECONCILE_INTERVAL_HOURS = float(os.getenv("STATS_RECONCILE_INTERVAL_HOURS", "24"))  # Период сверки, 0 - выключить
+
+# Ограничения Telegram на отправку сообщений
+TELEGRAM_RATE_LIMIT = float(os.getenv("TELEGRAM_RATE_LIMIT", "28"))  # Сообщений в секунду на весь бот
+TELEGRAM_CHAT_INTERVAL = float(os.getenv("TELEGRAM_CHAT_INTERVAL", "1.0"))  # Минимальный интервал между сообщениями в один чат
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))  # Повторы отправки при временных ошибках
+SEND_RETRY_BASE_DELAY = float(os.getenv("SEND_RETRY_BASE_DELAY", "1.0"))  # Базовая задержка экспоненциального повтора
+
+# Настройки уведомлений о триале
+NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", "10"))  # Параллельных отправителей уведомлений
+
+# Настройки рассылки /broadcast
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "10"))  # Количество параллельных отправителей
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", "200"))  # Получателей на страницу (шаг сохранения прогресса)
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))  # Период отчета админу в секундах
+
 # Тексты сообщений
 WELCOME_MESSAGE = """
 Привет! Я бот-нейропродажник, который поможет подобрать оптимальный тариф для вашего бизнеса.
@@ -64,11 +175,10 @@ ONBOARDING_QUESTIONS = [
 ]
 
 # Шаблон запроса к OpenAI для анализа ответов
+# Промпт не зависит от пользователя: ответы передаются отдельным последним сообщением,
+# чтобы неизменное начало запроса попадало в кэш промптов OpenAI
 OPENAI_TARIFF_PROMPT = """
-Проанализируй ответы пользователя на вопросы и порекомендуй оптимальный тариф из трех вариантов:
-
-Ответы пользователя:
-{answers}
+Проанализируй ответы пользователя на вопросы (они в следующем сообщении) и порекомендуй оптимальный тариф из трех вариантов.
 
 Предложи три тарифа с разными ценами и функциональностью, учитывая ответы пользователя.
 Рекомендуй один из них как наиболее подходящий и объясни почему.
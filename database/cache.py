@@ -0,0 +1,125 @@
+"""
+Модуль с ограниченным LRU-кэшем с временем жизни записей.
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Tuple
+
+# Маркер отсутствующего значения (None тоже может быть закэширован)
+MISSING = object()
+
+
+class LRUCache:
+    """
+    LRU-кэш ограниченного размера с временем жизни (TTL) записей.
+
+    При переполнении вытесняется давно не использовавшаяся запись,
+    запись старше ttl секунд считается устаревшей и удаляется при обращении.
+    Кэш ведет счетчики попаданий, промахов, вытеснений и устареваний.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0) -> None:
+        """
+        Args:
+            max_size: Максимальное количество записей
+            ttl: Время жизни записи в секундах (0 - без ограничения)
+        """
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+        # Счетчики
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Any:
+        """
+        Возвращает значение по ключу.
+
+        Args:
+            key: Ключ записи
+
+        Returns:
+            Закэшированное значение или MISSING, если записи нет или она устарела
+        """
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return MISSING
+
+        stored_at, value = item
+        if self.ttl and time.monotonic() - stored_at > self.ttl:
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return MISSING
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """
+        Сохраняет значение, при переполнении вытесняет самую старую запись.
+
+        Args:
+            key: Ключ записи
+            value: Значение
+        """
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def peek(self, key: Hashable) -> Any:
+        """
+        Возвращает значение без обновления порядка и счетчиков.
+
+        Args:
+            key: Ключ записи
+
+        Returns:
+            Значение или MISSING
+        """
+        item = self._data.get(key)
+        return item[1] if item is not None else MISSING
+
+    def invalidate(self, key: Hashable) -> None:
+        """
+        Удаляет запись из кэша.
+
+        Args:
+            key: Ключ записи
+        """
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """
+        Очищает кэш (счетчики сохраняются).
+        """
+        self._data.clear()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Возвращает метрики кэша.
+
+        Returns:
+            Словарь с размером кэша, счетчиками и долей попаданий
+        """
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
@@ -6,62 +6,41 @@ import logging
 import asyncio
 import aiosqlite
 import datetime
-from typing import Dict, List, Any, Optional, Union, Tuple
+import time
+import json
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Any, Optional, Union, Tuple
 
-from config import DATABASE_PATH, TRIAL_PERIOD_DAYS
+from config import (
+    DATABASE_PATH, TRIAL_PERIOD_DAYS, DB_POOL_SIZE, DB_BUSY_TIMEOUT_MS,
+    DB_CACHE_SIZE_KB, DB_MMAP_SIZE, DB_STATEMENT_CACHE_SIZE, DB_WRITE_BEHIND,
+    DB_WRITE_BATCH_SIZE, DB_WRITE_FLUSH_INTERVAL_MS, DB_WRITE_MAX_PENDING,
+    USER_CACHE_SIZE, USER_CACHE_TTL
+)
+from database.cache import LRUCache, MISSING
+from database.migrations import apply_migrations
+from database.pool import ConnectionPool
+from database.write_behind import WriteBehindQueue
 
 # Инициализация логгера
 logger = logging.getLogger(__name__)
 
-# SQL-запросы для создания таблиц
-CREATE_USERS_TABLE = """
-CREATE TABLE IF NOT EXISTS users (
-    user_id INTEGER PRIMARY KEY,
-    chat_id INTEGER NOT NULL,
-    username TEXT,
-    first_name TEXT,
-    last_name TEXT,
-    registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    trial_end_date TIMESTAMP,
-    is_active BOOLEAN DEFAULT TRUE,
-    tariff_id INTEGER,
-    FOREIGN KEY (tariff_id) REFERENCES tariffs(id)
-);
-"""
-
-CREATE_ONBOARDING_QUESTIONS_TABLE = """
-CREATE TABLE IF NOT EXISTS onboarding_questions (
-    id INTEGER PRIMARY KEY,
-    question_text TEXT NOT NULL,
-    question_type TEXT NOT NULL
-);
-"""
-
-CREATE_ONBOARDING_ANSWERS_TABLE = """
-CREATE TABLE IF NOT EXISTS onboarding_answers (
-    id INTEGER PRIMARY KEY,
-    user_id INTEGER NOT NULL,
-    question_id INTEGER NOT NULL,
-    answer TEXT NOT NULL,
-    answer_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(user_id),
-    FOREIGN KEY (question_id) REFERENCES onboarding_questions(id)
-);
-"""
-
-CREATE_TARIFFS_TABLE = """
-CREATE TABLE IF NOT EXISTS tariffs (
-    id INTEGER PRIMARY KEY,
-    name TEXT NOT NULL,
-    description TEXT NOT NULL,
-    price REAL NOT NULL
-);
-"""
-
 # Запросы для работы с пользователями
+# Upsert вместо INSERT OR REPLACE: замена через REPLACE удаляет строку без срабатывания
+# DELETE-триггеров, и счетчики статистики разошлись бы. Поля сбрасываются так же, как при замене.
 INSERT_USER = """
-INSERT OR REPLACE INTO users (user_id, chat_id, username, first_name, last_name, trial_end_date, is_active) 
-VALUES (?, ?, ?, ?, ?, ?, ?);
+INSERT INTO users (user_id, chat_id, username, first_name, last_name, trial_end_date, trial_end_ts, is_active) 
+VALUES (?, ?, ?, ?, ?, ?, ?, ?) 
+ON CONFLICT (user_id) DO UPDATE SET 
+    chat_id = excluded.chat_id, 
+    username = excluded.username, 
+    first_name = excluded.first_name, 
+    last_name = excluded.last_name, 
+    registration_date = CURRENT_TIMESTAMP, 
+    trial_end_date = excluded.trial_end_date, 
+    trial_end_ts = excluded.trial_end_ts, 
+    is_active = excluded.is_active, 
+    tariff_id = NULL;
 """
 
 GET_USER = """
@@ -69,7 +48,7 @@ SELECT * FROM users WHERE user_id = ?;
 """
 
 UPDATE_TRIAL_END_DATE = """
-UPDATE users SET trial_end_date = ? WHERE user_id = ?;
+UPDATE users SET trial_end_date = ?, trial_end_ts = ? WHERE user_id = ?;
 """
 
 UPDATE_USER_STATUS = """
@@ -80,18 +59,81 @@ UPDATE_USER_TARIFF = """
 UPDATE users SET tariff_id = ? WHERE user_id = ?;
 """
 
+# Запросы по триалу - диапазонные сканирования индекса idx_users_active_trial_end
 GET_USERS_WITH_ENDING_TRIAL = """
 SELECT * FROM users 
-WHERE trial_end_date IS NOT NULL 
-AND date(trial_end_date) = date('now', '+' || ? || ' days')
-AND is_active = TRUE;
+WHERE is_active = TRUE 
+AND trial_end_ts >= ? 
+AND trial_end_ts < ?;
 """
 
-GET_USERS_WITH_ENDED_TRIAL = """
-SELECT * FROM users 
-WHERE trial_end_date IS NOT NULL 
-AND date(trial_end_date) < date('now')
-AND is_active = TRUE;
+# Массовое завершение триалов одним запросом; повторный запуск не затрагивает уже завершенные
+EXPIRE_ENDED_TRIALS = """
+UPDATE users SET is_active = FALSE 
+WHERE is_active = TRUE 
+AND trial_end_ts <= ? 
+AND tariff_id IS NULL 
+RETURNING user_id, chat_id;
+"""
+
+EXPIRE_ENDED_TRIALS_FOR_USERS = """
+UPDATE users SET is_active = FALSE 
+WHERE is_active = TRUE 
+AND trial_end_ts <= ? 
+AND tariff_id IS NULL 
+AND user_id IN (SELECT value FROM json_each(?)) 
+RETURNING user_id, chat_id;
+"""
+
+# Запросы для планировщика триалов
+GET_TRIAL_DEADLINES = """
+SELECT u.user_id, u.chat_id, u.trial_end_ts,
+    EXISTS (
+        SELECT 1 FROM trial_notifications n
+        WHERE n.user_id = u.user_id AND n.kind = 'reminder' AND n.trial_end_ts = u.trial_end_ts
+    ) AS reminder_sent
+FROM users u
+WHERE u.is_active = TRUE 
+AND u.trial_end_ts >= ? 
+AND u.trial_end_ts < ?
+AND (u.trial_end_ts, u.user_id) > (?, ?)
+AND u.tariff_id IS NULL
+ORDER BY u.trial_end_ts, u.user_id
+LIMIT ?;
+"""
+
+INSERT_TRIAL_NOTIFICATION = """
+INSERT OR IGNORE INTO trial_notifications (user_id, kind, trial_end_ts, fired_at) 
+VALUES (?, ?, ?, ?);
+"""
+
+# Запросы для рассылок
+GET_USERS_COUNT = """
+SELECT COUNT(*) FROM users;
+"""
+
+GET_BROADCAST_RECIPIENTS = """
+SELECT user_id, chat_id FROM users 
+WHERE user_id > ? 
+ORDER BY user_id 
+LIMIT ?;
+"""
+
+INSERT_BROADCAST = """
+INSERT INTO broadcasts (text, admin_chat_id, total) 
+VALUES (?, ?, ?);
+"""
+
+UPDATE_BROADCAST_PROGRESS = """
+UPDATE broadcasts SET last_user_id = ?, sent = ?, failed = ?, blocked = ? WHERE id = ?;
+"""
+
+FINISH_BROADCAST = """
+UPDATE broadcasts SET status = 'finished', finished_at = CURRENT_TIMESTAMP WHERE id = ?;
+"""
+
+GET_UNFINISHED_BROADCASTS = """
+SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id;
 """
 
 # Запросы для онбординга
@@ -105,7 +147,7 @@ SELECT q.id, q.question_text, a.answer
 FROM onboarding_answers a
 JOIN onboarding_questions q ON a.question_id = q.id
 WHERE a.user_id = ?
-ORDER BY q.id;
+ORDER BY a.question_id;
 """
 
 # Запросы для работы с тарифами
@@ -122,43 +164,424 @@ GET_ALL_TARIFFS = """
 SELECT * FROM tariffs;
 """
 
-# Запросы для админ-панели
-GET_ACTIVE_USERS_COUNT = """
-SELECT COUNT(*) FROM users WHERE is_active = TRUE;
+# Запросы для рекомендаций тарифов (миграция 11): тарифы из ответа OpenAI сопоставляются
+# с каноническими строками tariffs по названию и цене
+FIND_TARIFF = """
+SELECT id FROM tariffs WHERE name = ? AND price = ? ORDER BY id LIMIT 1;
 """
 
-GET_CONVERSION_RATE = """
-SELECT 
-    (SELECT COUNT(*) FROM users WHERE tariff_id IS NOT NULL) * 100.0 / 
-    (SELECT COUNT(*) FROM users) AS conversion_rate;
+INSERT_TARIFF_WITH_FEATURES = """
+INSERT INTO tariffs (name, description, price, features) 
+VALUES (?, ?, ?, ?);
+"""
+
+INSERT_RECOMMENDATION = """
+INSERT INTO recommendations (user_id, recommendation, explanation, recommended_tariff_id, created_at) 
+VALUES (?, ?, ?, ?, ?);
+"""
+
+INSERT_RECOMMENDATION_TARIFF = """
+INSERT INTO recommendation_tariffs (recommendation_id, position, tariff_id) 
+VALUES (?, ?, ?);
+"""
+
+GET_RECOMMENDATION = """
+SELECT id, user_id, recommendation, explanation, recommended_tariff_id, selected_tariff_id 
+FROM recommendations WHERE id = ?;
+"""
+
+GET_RECOMMENDATION_TARIFFS = """
+SELECT t.id, t.name, t.description, t.price, t.features 
+FROM recommendation_tariffs rt 
+JOIN tariffs t ON t.id = rt.tariff_id 
+WHERE rt.recommendation_id = ? 
+ORDER BY rt.position;
+"""
+
+SELECT_RECOMMENDED_TARIFF = """
+UPDATE recommendations SET selected_tariff_id = ?, selected_at = ? WHERE id = ?;
+"""
+
+# Запросы для очереди анализа ответов; у пользователя не больше одной задачи в очереди
+INSERT_ANALYSIS_JOB = """
+INSERT OR IGNORE INTO analysis_jobs (user_id, chat_id, bot_id, created_at) 
+VALUES (?, ?, ?, ?) 
+RETURNING id;
+"""
+
+GET_PENDING_ANALYSIS_JOBS = """
+SELECT * FROM analysis_jobs ORDER BY id;
+"""
+
+START_ANALYSIS_JOB = """
+UPDATE analysis_jobs SET attempts = attempts + 1 WHERE id = ? RETURNING attempts;
+"""
+
+DELETE_ANALYSIS_JOB = """
+DELETE FROM analysis_jobs WHERE id = ?;
+"""
+
+# Запросы для кэша рекомендаций
+GET_CACHED_RECOMMENDATION = """
+SELECT result FROM recommendation_cache 
+WHERE cache_key = ? AND created_at >= ?;
+"""
+
+SAVE_CACHED_RECOMMENDATION = """
+INSERT OR REPLACE INTO recommendation_cache (cache_key, fingerprint, answers, result, created_at) 
+VALUES (?, ?, ?, ?, ?);
+"""
+
+# Удаляет записи другой версии промпта/модели и устаревшие по TTL
+DELETE_STALE_RECOMMENDATIONS = """
+DELETE FROM recommendation_cache WHERE fingerprint != ? OR created_at < ?;
+"""
+
+# Оставляет только max_rows самых новых записей
+TRIM_RECOMMENDATION_CACHE = """
+DELETE FROM recommendation_cache 
+WHERE created_at < (
+    SELECT created_at FROM recommendation_cache 
+    ORDER BY created_at DESC 
+    LIMIT 1 OFFSET ?
+);
+"""
+
+COUNT_CACHED_RECOMMENDATIONS = """
+SELECT COUNT(*) FROM recommendation_cache;
+"""
+
+# Последние рекомендации версии промпта в порядке создания (для индекса похожих ответов)
+GET_CACHED_RECOMMENDATIONS = """
+SELECT answers, result, created_at FROM (
+    SELECT answers, result, created_at FROM recommendation_cache 
+    WHERE fingerprint = ? AND created_at >= ? 
+    ORDER BY created_at DESC 
+    LIMIT ?
+) ORDER BY created_at;
+"""
+
+# Запросы для хранилища состояний FSM (database/fsm_storage.py)
+GET_FSM_RECORD = """
+SELECT state, data FROM fsm_storage WHERE key = ?;
+"""
+
+SAVE_FSM_RECORD = """
+INSERT INTO fsm_storage (key, state, data, updated_at) VALUES (?, ?, ?, ?) 
+ON CONFLICT (key) DO UPDATE SET 
+    state = excluded.state, 
+    data = excluded.data, 
+    updated_at = excluded.updated_at;
+"""
+
+DELETE_FSM_RECORD = """
+DELETE FROM fsm_storage WHERE key = ?;
+"""
+
+DELETE_IDLE_FSM_RECORDS = """
+DELETE FROM fsm_storage WHERE updated_at < ?;
+"""
+
+GET_FSM_STATE_STATS = """
+SELECT state, COUNT(*) AS sessions, 
+       SUM(LENGTH(key) + COALESCE(LENGTH(state), 0) + COALESCE(LENGTH(data), 0)) AS bytes 
+FROM fsm_storage 
+GROUP BY state 
+ORDER BY bytes DESC;
+"""
+
+# Запросы для учета вызовов OpenAI (сводку llm_daily_usage обновляет триггер, миграция 9)
+INSERT_LLM_CALL = """
+INSERT INTO llm_calls (ts, model, prompt_tokens, completion_tokens, cached_tokens, latency_ms, outcome) 
+VALUES (?, ?, ?, ?, ?, ?, ?);
 """
 
+DELETE_OLD_LLM_CALLS = """
+DELETE FROM llm_calls WHERE ts < ?;
+"""
+
+GET_LLM_LATENCIES = """
+SELECT latency_ms FROM llm_calls 
+WHERE ts >= ? AND outcome = 'success' 
+ORDER BY latency_ms;
+"""
+
+GET_LLM_OUTCOMES = """
+SELECT outcome, COUNT(*) AS calls FROM llm_calls 
+WHERE ts >= ? 
+GROUP BY outcome 
+ORDER BY calls DESC;
+"""
+
+GET_LLM_DAILY_USAGE = """
+SELECT day, model, calls, failed, prompt_tokens, completion_tokens, cached_tokens, latency_ms 
+FROM llm_daily_usage 
+WHERE day >= ? 
+ORDER BY day DESC, model;
+"""
+
+# Статистика админ-панели читается из счетчиков, которые поддерживают триггеры (миграция 6)
+GET_USER_COUNTERS = """
+SELECT name, value FROM user_counters;
+"""
+
+# Популярные тарифы читаются из счетчиков, которые поддерживают триггеры на рекомендациях (миграция 11)
 GET_POPULAR_TARIFFS = """
-SELECT t.name, COUNT(*) as user_count 
-FROM users u
-JOIN tariffs t ON u.tariff_id = t.id
-GROUP BY t.id
-ORDER BY user_count DESC;
+SELECT t.name, t.price, c.user_count, c.offered 
+FROM tariff_recommendation_counts c 
+JOIN tariffs t ON t.id = c.tariff_id 
+WHERE c.user_count > 0 
+ORDER BY c.user_count DESC 
+LIMIT 10;
+"""
+
+GET_TARIFF_USER_COUNTS = """
+SELECT tariff_id, user_count FROM tariff_user_counts WHERE user_count != 0;
+"""
+
+# Полный пересчет счетчиков по таблицам users и рекомендаций для сверки
+RECOUNT_USER_COUNTERS = """
+SELECT 
+    COUNT(*) AS total, 
+    IFNULL(SUM(is_active = TRUE), 0) AS active, 
+    COUNT(tariff_id) AS with_tariff 
+FROM users;
 """
 
+RECOUNT_TARIFF_USER_COUNTS = """
+SELECT tariff_id, COUNT(*) AS user_count 
+FROM users 
+WHERE tariff_id IS NOT NULL 
+GROUP BY tariff_id;
+"""
+
+RECOUNT_RECOMMENDATION_COUNTERS = """
+SELECT 
+    (SELECT COUNT(DISTINCT user_id) FROM recommendations) AS recommended_users, 
+    (SELECT COUNT(DISTINCT user_id) FROM recommendations WHERE selected_tariff_id IS NOT NULL) AS selected_users, 
+    (SELECT COUNT(*) FROM recommendations WHERE selected_tariff_id = recommended_tariff_id) AS accepted;
+"""
+
+GET_TARIFF_RECOMMENDATION_COUNTS = """
+SELECT tariff_id, user_count, offered FROM tariff_recommendation_counts 
+WHERE user_count != 0 OR offered != 0;
+"""
+
+RECOUNT_TARIFF_RECOMMENDATION_COUNTS = """
+SELECT tariff_id, SUM(user_count) AS user_count, SUM(offered) AS offered 
+FROM (
+    SELECT selected_tariff_id AS tariff_id, COUNT(DISTINCT user_id) AS user_count, 0 AS offered 
+    FROM recommendations 
+    WHERE selected_tariff_id IS NOT NULL 
+    GROUP BY selected_tariff_id 
+    UNION ALL 
+    SELECT tariff_id, 0, COUNT(*) FROM recommendation_tariffs GROUP BY tariff_id
+) 
+GROUP BY tariff_id;
+"""
+
+SET_USER_COUNTER = """
+INSERT OR REPLACE INTO user_counters (name, value) VALUES (?, ?);
+"""
+
+CLEAR_TARIFF_USER_COUNTS = """
+DELETE FROM tariff_user_counts;
+"""
+
+SET_TARIFF_USER_COUNT = """
+INSERT INTO tariff_user_counts (tariff_id, user_count) VALUES (?, ?);
+"""
+
+CLEAR_TARIFF_RECOMMENDATION_COUNTS = """
+DELETE FROM tariff_recommendation_counts;
+"""
+
+SET_TARIFF_RECOMMENDATION_COUNT = """
+INSERT INTO tariff_recommendation_counts (tariff_id, user_count, offered) VALUES (?, ?, ?);
+"""
+
+
+# Пул долгоживущих соединений, открывается в init_db() и закрывается в close_db()
+_pool: Optional[ConnectionPool] = None
+
+# Очередь отложенной записи, создается в init_db() при включенном DB_WRITE_BEHIND
+_write_queue: Optional[WriteBehindQueue] = None
+
+# Кэш записей пользователей перед get_user() (None - кэш выключен)
+_user_cache: Optional[LRUCache] = (
+    LRUCache(max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL) if USER_CACHE_SIZE > 0 else None
+)
+
+# Счетчик изменений пользователей: чтение, начатое до записи, не кладет в кэш устаревшую строку
+_user_cache_version = 0
+
+# Слушатели изменений записей пользователей (например, планировщик триалов)
+_user_listeners: List[Callable[[int, Dict[str, Any]], None]] = []
+
+
+@asynccontextmanager
+async def connection() -> AsyncIterator[aiosqlite.Connection]:
+    """
+    Выдает соединение с базой данных из пула.
+    
+    Если пул еще не открыт (например, в отдельных скриптах), открывается
+    одноразовое соединение, как это делалось до появления пула.
+    """
+    if _pool is not None and _pool.is_open:
+        async with _pool.acquire() as db:
+            yield db
+        return
+    
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        db.row_factory = sqlite3.Row
+        yield db
+
 
 async def init_db() -> None:
     """
-    Инициализирует базу данных, создает таблицы если они не существуют.
+    Инициализирует базу данных: открывает пул соединений и применяет
+    миграции схемы.
     """
+    global _pool, _write_queue
+    
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            await db.execute(CREATE_USERS_TABLE)
-            await db.execute(CREATE_ONBOARDING_QUESTIONS_TABLE)
-            await db.execute(CREATE_ONBOARDING_ANSWERS_TABLE)
-            await db.execute(CREATE_TARIFFS_TABLE)
-            await db.commit()
-            logger.info("База данных инициализирована успешно.")
+        if _pool is None or not _pool.is_open:
+            _pool = ConnectionPool(
+                DATABASE_PATH,
+                size=DB_POOL_SIZE,
+                busy_timeout_ms=DB_BUSY_TIMEOUT_MS,
+                cache_size_kb=DB_CACHE_SIZE_KB,
+                mmap_size=DB_MMAP_SIZE,
+                statement_cache_size=DB_STATEMENT_CACHE_SIZE
+            )
+            await _pool.open()
+        
+        async with connection() as db:
+            version = await apply_migrations(db)
+            logger.info(f"База данных инициализирована успешно (версия схемы {version}).")
+        
+        if DB_WRITE_BEHIND and _write_queue is None:
+            _write_queue = WriteBehindQueue(
+                connection,
+                batch_size=DB_WRITE_BATCH_SIZE,
+                flush_interval=DB_WRITE_FLUSH_INTERVAL_MS / 1000,
+                max_pending=DB_WRITE_MAX_PENDING
+            )
+            _write_queue.start()
+            logger.info("Включена отложенная запись с групповыми коммитами.")
     except Exception as e:
         logger.error(f"Ошибка при инициализации базы данных: {e}")
         raise
 
 
+async def close_db() -> None:
+    """
+    Сбрасывает очередь отложенной записи и закрывает пул соединений
+    с базой данных при остановке бота.
+    """
+    global _pool, _write_queue
+    
+    if _write_queue is not None:
+        await _write_queue.drain()
+        _write_queue = None
+    
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+async def flush_pending_writes(table: Optional[str] = None) -> None:
+    """
+    Записывает накопленные отложенные запросы, чтобы чтение увидело свежие данные.
+    
+    Args:
+        table: Таблица, свежесть которой нужна чтению (None - любая)
+    """
+    if _write_queue is not None and _write_queue.has_pending(table):
+        await _write_queue.flush()
+
+
+def register_user_listener(listener: Callable[[int, Dict[str, Any]], None]) -> None:
+    """
+    Регистрирует слушателя изменений записей пользователей.
+    
+    Слушатель вызывается синхронно после каждой записи в таблицу users
+    через функции этого модуля и получает ID пользователя и измененные поля.
+    
+    Args:
+        listener: Функция listener(user_id, fields)
+    """
+    _user_listeners.append(listener)
+
+
+def _user_changed(user_id: int, fields: Dict[str, Any], replaced: bool = False) -> None:
+    """
+    Обновляет кэш и оповещает слушателей после записи пользователя в базу.
+    
+    Args:
+        user_id: ID пользователя
+        fields: Измененные поля
+        replaced: True, если запись пользователя была создана или заменена целиком
+    """
+    global _user_cache_version
+    
+    _user_cache_version += 1
+    if _user_cache is not None:
+        cached = _user_cache.peek(user_id)
+        # В кэше может не быть записи (MISSING) или закэширован отсутствующий пользователь (None)
+        if replaced or not isinstance(cached, dict):
+            _user_cache.invalidate(user_id)
+        else:
+            _user_cache.set(user_id, {**cached, **fields})
+    
+    for listener in _user_listeners:
+        try:
+            listener(user_id, fields)
+        except Exception as e:
+            logger.error(f"Ошибка в слушателе изменений пользователя {user_id}: {e}")
+
+
+def invalidate_cached_users(user_ids: List[int]) -> None:
+    """
+    Сбрасывает записи пользователей, измененные другим процессом, из кэша.
+    
+    Слушатели не вызываются: изменение уже обработано в процессе, который его записал.
+    
+    Args:
+        user_ids: ID пользователей
+    """
+    global _user_cache_version
+    
+    _user_cache_version += 1
+    if _user_cache is not None:
+        for user_id in user_ids:
+            _user_cache.invalidate(user_id)
+
+
+def get_user_cache_metrics() -> Optional[Dict[str, Any]]:
+    """
+    Возвращает метрики кэша записей пользователей.
+    
+    Returns:
+        Словарь с метриками или None, если кэш выключен
+    """
+    if _user_cache is None:
+        return None
+    return _user_cache.get_metrics()
+
+
+def get_write_queue_metrics() -> Optional[Dict[str, Any]]:
+    """
+    Возвращает метрики очереди отложенной записи.
+    
+    Returns:
+        Словарь с метриками или None, если отложенная запись выключена
+    """
+    if _write_queue is None:
+        return None
+    return _write_queue.get_metrics()
+
+
 async def add_user(user_id: int, chat_id: int, username: str = None, 
                   first_name: str = None, last_name: str = None) -> None:
     """
@@ -172,16 +595,24 @@ async def add_user(user_id: int, chat_id: int, username: str = None,
         last_name: Фамилия пользователя
     """
     # Рассчитываем дату окончания триала
-    trial_end_date = (datetime.datetime.now() + 
-                     datetime.timedelta(days=TRIAL_PERIOD_DAYS)).isoformat()
+    trial_end = datetime.datetime.now() + datetime.timedelta(days=TRIAL_PERIOD_DAYS)
+    trial_end_date = trial_end.isoformat()
+    trial_end_ts = int(trial_end.timestamp())
     
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        await flush_pending_writes("users")
+        
+        async with connection() as db:
             await db.execute(
                 INSERT_USER,
-                (user_id, chat_id, username, first_name, last_name, trial_end_date, True)
+                (user_id, chat_id, username, first_name, last_name, trial_end_date, trial_end_ts, True)
             )
             await db.commit()
+            _user_changed(
+                user_id,
+                {"chat_id": chat_id, "trial_end_ts": trial_end_ts, "is_active": 1, "tariff_id": None},
+                replaced=True
+            )
             logger.info(f"Пользователь {user_id} добавлен/обновлен в базе данных.")
     except Exception as e:
         logger.error(f"Ошибка при добавлении пользователя {user_id}: {e}")
@@ -199,13 +630,23 @@ async def get_user(user_id: int) -> Optional[Dict[str, Any]]:
         Dict с информацией о пользователе или None, если пользователь не найден
     """
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            db.row_factory = sqlite3.Row
+        if _user_cache is not None:
+            cached = _user_cache.get(user_id)
+            if cached is not MISSING:
+                return dict(cached) if cached else None
+        
+        await flush_pending_writes("users")
+        
+        version = _user_cache_version
+        async with connection() as db:
             async with db.execute(GET_USER, (user_id,)) as cursor:
                 row = await cursor.fetchone()
-                if row:
-                    return dict(row)
-                return None
+                user = dict(row) if row else None
+        
+        # Кэшируем и отсутствие пользователя: add_user() сбросит такую запись
+        if _user_cache is not None and version == _user_cache_version:
+            _user_cache.set(user_id, user)
+        return dict(user) if user else None
     except Exception as e:
         logger.error(f"Ошибка при получении пользователя {user_id}: {e}")
         return None
@@ -221,7 +662,11 @@ async def save_onboarding_answer(user_id: int, question_id: int, answer: str) ->
         answer: Ответ пользователя
     """
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        if _write_queue is not None:
+            await _write_queue.put(INSERT_ONBOARDING_ANSWER, (user_id, question_id, answer), "onboarding_answers")
+            return
+        
+        async with connection() as db:
             await db.execute(
                 INSERT_ONBOARDING_ANSWER,
                 (user_id, question_id, answer)
@@ -244,8 +689,9 @@ async def get_user_answers(user_id: int) -> List[Dict[str, Any]]:
         Список словарей с ответами пользователя
     """
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            db.row_factory = sqlite3.Row
+        await flush_pending_writes("onboarding_answers")
+        
+        async with connection() as db:
             async with db.execute(GET_USER_ANSWERS, (user_id,)) as cursor:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
@@ -263,9 +709,15 @@ async def update_trial_status(user_id: int, is_active: bool) -> None:
         is_active: Статус активности (True - активен, False - не активен)
     """
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        if _write_queue is not None:
+            await _write_queue.put(UPDATE_USER_STATUS, (is_active, user_id), "users")
+            _user_changed(user_id, {"is_active": int(is_active)})
+            return
+        
+        async with connection() as db:
             await db.execute(UPDATE_USER_STATUS, (is_active, user_id))
             await db.commit()
+            _user_changed(user_id, {"is_active": int(is_active)})
             logger.info(f"Статус пользователя {user_id} обновлен на {is_active}.")
     except Exception as e:
         logger.error(f"Ошибка при обновлении статуса пользователя {user_id}: {e}")
@@ -281,9 +733,15 @@ async def update_user_tariff(user_id: int, tariff_id: int) -> None:
         tariff_id: ID тарифа
     """
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        if _write_queue is not None:
+            await _write_queue.put(UPDATE_USER_TARIFF, (tariff_id, user_id), "users")
+            _user_changed(user_id, {"tariff_id": tariff_id})
+            return
+        
+        async with connection() as db:
             await db.execute(UPDATE_USER_TARIFF, (tariff_id, user_id))
             await db.commit()
+            _user_changed(user_id, {"tariff_id": tariff_id})
             logger.info(f"Тариф пользователя {user_id} обновлен на {tariff_id}.")
     except Exception as e:
         logger.error(f"Ошибка при обновлении тарифа пользователя {user_id}: {e}")
@@ -301,9 +759,20 @@ async def get_users_with_ending_trial(days_before: int = 1) -> List[Dict[str, An
         Список словарей с информацией о пользователях
     """
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            db.row_factory = sqlite3.Row
-            async with db.execute(GET_USERS_WITH_ENDING_TRIAL, (days_before,)) as cursor:
+        await flush_pending_writes("users")
+        
+        # Границы локальных суток, на которые приходится окончание триала
+        day_start = datetime.datetime.combine(
+            datetime.date.today() + datetime.timedelta(days=days_before),
+            datetime.time.min
+        )
+        day_end = day_start + datetime.timedelta(days=1)
+        
+        async with connection() as db:
+            async with db.execute(
+                GET_USERS_WITH_ENDING_TRIAL,
+                (int(day_start.timestamp()), int(day_end.timestamp()))
+            ) as cursor:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
     except Exception as e:
@@ -311,58 +780,799 @@ async def get_users_with_ending_trial(days_before: int = 1) -> List[Dict[str, An
         return []
 
 
-async def get_users_with_ended_trial() -> List[Dict[str, Any]]:
+async def expire_ended_trials(user_ids: Optional[List[int]] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Завершает все истекшие триалы без тарифа одним запросом в одной транзакции.
+    
+    Операция идемпотентна: затрагиваются только активные пользователи, поэтому
+    повторный запуск не вернет уже обработанных и не приведет к повторным
+    уведомлениям. Затронутые пользователи отдаются потоком после коммита,
+    чтобы блокировка записи не удерживалась на время отправки уведомлений.
+    
+    Args:
+        user_ids: Ограничить завершение этими пользователями (None - все истекшие)
+        
+    Yields:
+        Словари с user_id и chat_id пользователей, у которых триал завершен сейчас
+    """
+    await flush_pending_writes("users")
+    
+    now_ts = int(time.time())
+    try:
+        async with connection() as db:
+            if user_ids is None:
+                cursor = await db.execute(EXPIRE_ENDED_TRIALS, (now_ts,))
+            else:
+                cursor = await db.execute(EXPIRE_ENDED_TRIALS_FOR_USERS, (now_ts, json.dumps(user_ids)))
+            rows = await cursor.fetchall()
+            await db.commit()
+    except Exception as e:
+        logger.error(f"Ошибка при массовом завершении триалов: {e}")
+        raise
+    
+    logger.info(f"Завершены триалы {len(rows)} пользователей.")
+    for row in rows:
+        _user_changed(row["user_id"], {"is_active": 0})
+    
+    for row in rows:
+        yield dict(row)
+
+
+async def get_trial_deadlines(start_ts: int, end_ts: int, after: Tuple[int, int],
+                              limit: int = 1000) -> List[Dict[str, Any]]:
     """
-    Получает список пользователей, у которых триал-период уже закончился.
+    Получает страницу активных триалов без тарифа, заканчивающихся в заданном интервале.
+    
+    Страницы выбираются по ключу (trial_end_ts, user_id) диапазонным
+    сканированием индекса idx_users_active_trial_end.
     
+    Args:
+        start_ts: Начало интервала (epoch, включительно)
+        end_ts: Конец интервала (epoch, не включительно)
+        after: Ключ (trial_end_ts, user_id) последней строки предыдущей страницы
+        limit: Размер страницы
+        
     Returns:
-        Список словарей с информацией о пользователях
+        Список словарей с user_id, chat_id, trial_end_ts и признаком reminder_sent
+        
+    Raises:
+        Exception: Ошибка чтения (планировщик не должен принять ее за пустое окно)
     """
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            db.row_factory = sqlite3.Row
-            async with db.execute(GET_USERS_WITH_ENDED_TRIAL) as cursor:
+        await flush_pending_writes("users")
+        
+        async with connection() as db:
+            async with db.execute(
+                GET_TRIAL_DEADLINES,
+                (start_ts, end_ts, after[0], after[1], limit)
+            ) as cursor:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
     except Exception as e:
-        logger.error(f"Ошибка при получении пользователей с закончившимся триалом: {e}")
-        return []
+        logger.error(f"Ошибка при получении сроков окончания триалов: {e}")
+        raise
 
 
-async def get_admin_stats() -> Dict[str, Any]:
+async def claim_trial_notification(user_id: int, kind: str, trial_end_ts: int) -> bool:
     """
-    Получает статистику для админ-панели.
+    Сохраняет отметку о срабатывании события триала, если ее еще нет.
+    
+    Args:
+        user_id: ID пользователя
+        kind: Тип события ("reminder" или "expiry")
+        trial_end_ts: Время окончания триала, к которому относится событие
+        
+    Returns:
+        True, если отметка создана сейчас (событие еще не срабатывало)
+    """
+    try:
+        async with connection() as db:
+            cursor = await db.execute(
+                INSERT_TRIAL_NOTIFICATION,
+                (user_id, kind, trial_end_ts, int(time.time()))
+            )
+            await db.commit()
+            return cursor.rowcount == 1
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении отметки {kind} для пользователя {user_id}: {e}")
+        raise
+
+
+async def create_broadcast(text: str, admin_chat_id: int) -> Dict[str, Any]:
+    """
+    Создает запись о рассылке.
     
+    Args:
+        text: Текст рассылки
+        admin_chat_id: ID чата администратора для отчетов о прогрессе
+        
     Returns:
-        Словарь со статистикой
+        Словарь с данными созданной рассылки
     """
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            # Активные пользователи
-            async with db.execute(GET_ACTIVE_USERS_COUNT) as cursor:
-                active_users = await cursor.fetchone()
-                active_users_count = active_users[0] if active_users else 0
-            
-            # Конверсия в оплату
-            async with db.execute(GET_CONVERSION_RATE) as cursor:
-                conversion = await cursor.fetchone()
-                conversion_rate = conversion[0] if conversion else 0
-            
-            # Популярные тарифы
-            db.row_factory = sqlite3.Row
-            async with db.execute(GET_POPULAR_TARIFFS) as cursor:
-                tariff_rows = await cursor.fetchall()
-                popular_tariffs = [dict(row) for row in tariff_rows]
+        await flush_pending_writes("users")
+        
+        async with connection() as db:
+            async with db.execute(GET_USERS_COUNT) as cursor:
+                row = await cursor.fetchone()
+                total = row[0] if row else 0
             
+            cursor = await db.execute(INSERT_BROADCAST, (text, admin_chat_id, total))
+            await db.commit()
+            broadcast_id = cursor.lastrowid
+            logger.info(f"Создана рассылка {broadcast_id} на {total} получателей.")
             return {
-                "active_users_count": active_users_count,
-                "conversion_rate": conversion_rate,
-                "popular_tariffs": popular_tariffs
+                "id": broadcast_id,
+                "text": text,
+                "admin_chat_id": admin_chat_id,
+                "total": total,
+                "last_user_id": 0,
+                "sent": 0,
+                "failed": 0,
+                "blocked": 0
             }
     except Exception as e:
-        logger.error(f"Ошибка при получении статистики для админ-панели: {e}")
-        return {
-            "active_users_count": 0,
-            "conversion_rate": 0,
-            "popular_tariffs": []
-        } 
\ No newline at end of file
+        logger.error(f"Ошибка при создании рассылки: {e}")
+        raise
+
+
+async def get_broadcast_recipients(after_user_id: int, limit: int) -> List[Dict[str, Any]]:
+    """
+    Получает страницу получателей рассылки (пагинация по ключу user_id).
+    
+    Args:
+        after_user_id: user_id последнего получателя предыдущей страницы
+        limit: Размер страницы
+        
+    Returns:
+        Список словарей с user_id и chat_id
+    """
+    try:
+        async with connection() as db:
+            async with db.execute(GET_BROADCAST_RECIPIENTS, (after_user_id, limit)) as cursor:
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
+    except Exception as e:
+        logger.error(f"Ошибка при получении получателей рассылки: {e}")
+        raise
+
+
+async def update_broadcast_progress(broadcast_id: int, last_user_id: int,
+                                    sent: int, failed: int, blocked: int) -> None:
+    """
+    Сохраняет прогресс рассылки после обработки страницы получателей.
+    
+    Args:
+        broadcast_id: ID рассылки
+        last_user_id: user_id последнего обработанного получателя
+        sent: Количество отправленных сообщений
+        failed: Количество ошибок отправки
+        blocked: Количество пользователей, заблокировавших бота
+    """
+    try:
+        async with connection() as db:
+            await db.execute(
+                UPDATE_BROADCAST_PROGRESS,
+                (last_user_id, sent, failed, blocked, broadcast_id)
+            )
+            await db.commit()
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении прогресса рассылки {broadcast_id}: {e}")
+        raise
+
+
+async def finish_broadcast(broadcast_id: int) -> None:
+    """
+    Отмечает рассылку завершенной.
+    
+    Args:
+        broadcast_id: ID рассылки
+    """
+    try:
+        async with connection() as db:
+            await db.execute(FINISH_BROADCAST, (broadcast_id,))
+            await db.commit()
+            logger.info(f"Рассылка {broadcast_id} завершена.")
+    except Exception as e:
+        logger.error(f"Ошибка при завершении рассылки {broadcast_id}: {e}")
+        raise
+
+
+async def get_unfinished_broadcasts() -> List[Dict[str, Any]]:
+    """
+    Получает рассылки, прерванные остановкой бота.
+    
+    Returns:
+        Список словарей с данными рассылок
+    """
+    try:
+        async with connection() as db:
+            async with db.execute(GET_UNFINISHED_BROADCASTS) as cursor:
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
+    except Exception as e:
+        logger.error(f"Ошибка при получении незавершенных рассылок: {e}")
+        return []
+
+
+async def enqueue_analysis_job(user_id: int, chat_id: int, bot_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Добавляет задачу анализа ответов пользователя в очередь.
+    
+    Args:
+        user_id: ID пользователя
+        chat_id: ID чата с пользователем
+        bot_id: ID бота (для ключа хранилища FSM)
+        
+    Returns:
+        Словарь с данными задачи или None, если задача пользователя уже в очереди
+    """
+    created_at = int(time.time())
+    try:
+        async with connection() as db:
+            async with db.execute(INSERT_ANALYSIS_JOB, (user_id, chat_id, bot_id, created_at)) as cursor:
+                row = await cursor.fetchone()
+            await db.commit()
+    except Exception as e:
+        logger.error(f"Ошибка при добавлении задачи анализа для пользователя {user_id}: {e}")
+        raise
+    
+    if row is None:
+        return None
+    return {
+        "id": row["id"],
+        "user_id": user_id,
+        "chat_id": chat_id,
+        "bot_id": bot_id,
+        "attempts": 0,
+        "created_at": created_at
+    }
+
+
+async def get_pending_analysis_jobs() -> List[Dict[str, Any]]:
+    """
+    Получает задачи анализа, оставшиеся в очереди (например, после перезапуска).
+    
+    Returns:
+        Список словарей с данными задач
+    """
+    try:
+        async with connection() as db:
+            async with db.execute(GET_PENDING_ANALYSIS_JOBS) as cursor:
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
+    except Exception as e:
+        logger.error(f"Ошибка при получении задач анализа: {e}")
+        return []
+
+
+async def start_analysis_job(job_id: int) -> int:
+    """
+    Отмечает начало очередной попытки выполнения задачи анализа.
+    
+    Args:
+        job_id: ID задачи
+        
+    Returns:
+        Номер попытки (0, если задачи уже нет)
+    """
+    try:
+        async with connection() as db:
+            async with db.execute(START_ANALYSIS_JOB, (job_id,)) as cursor:
+                row = await cursor.fetchone()
+            await db.commit()
+            return row["attempts"] if row else 0
+    except Exception as e:
+        logger.error(f"Ошибка при запуске задачи анализа {job_id}: {e}")
+        raise
+
+
+async def delete_analysis_job(job_id: int) -> None:
+    """
+    Удаляет выполненную задачу анализа из очереди.
+    
+    Args:
+        job_id: ID задачи
+    """
+    try:
+        async with connection() as db:
+            await db.execute(DELETE_ANALYSIS_JOB, (job_id,))
+            await db.commit()
+    except Exception as e:
+        logger.error(f"Ошибка при удалении задачи анализа {job_id}: {e}")
+        raise
+
+
+async def save_recommendation(user_id: int, tariff_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Сохраняет рекомендацию тарифов пользователю.
+    
+    Каждый предложенный тариф сопоставляется с канонической строкой tariffs
+    по названию и цене; тариф, которого еще нет, добавляется. Все записи
+    делаются одной транзакцией.
+    
+    Полнота полей не проверяется: analyze_onboarding_answers возвращает
+    только рекомендации, прошедшие проверку схемы (ответ OpenAI проверяет
+    _validate_tariff_data в services/openai_api.py до записи в кэши).
+    
+    Args:
+        user_id: ID пользователя
+        tariff_data: Рекомендация в формате analyze_onboarding_answers
+        
+    Returns:
+        Рекомендация в формате get_recommendation
+        
+    Raises:
+        Exception: Рекомендация неверного формата или ошибка записи в базу данных
+    """
+    try:
+        tariffs = [
+            {
+                "name": str(tariff["name"]).strip(),
+                "description": tariff["description"],
+                "price": float(tariff["price"]),
+                "features": list(tariff["features"])
+            }
+            for tariff in tariff_data["tariffs"]
+        ]
+        recommendation = str(tariff_data["recommendation"]).strip()
+        
+        async with connection() as db:
+            # Сразу берем блокировку записи, чтобы одновременные рекомендации не создали дубли тарифов
+            await db.execute("BEGIN IMMEDIATE")
+            for tariff in tariffs:
+                async with db.execute(FIND_TARIFF, (tariff["name"], tariff["price"])) as cursor:
+                    row = await cursor.fetchone()
+                if row:
+                    tariff["id"] = row["id"]
+                else:
+                    cursor = await db.execute(INSERT_TARIFF_WITH_FEATURES, (
+                        tariff["name"], tariff["description"], tariff["price"],
+                        json.dumps(tariff["features"], ensure_ascii=False)
+                    ))
+                    tariff["id"] = cursor.lastrowid
+            
+            recommended_tariff_id = next(
+                (tariff["id"] for tariff in tariffs if tariff["name"].lower() == recommendation.lower()), None
+            )
+            cursor = await db.execute(INSERT_RECOMMENDATION, (
+                user_id, recommendation, tariff_data["explanation"], recommended_tariff_id, int(time.time())
+            ))
+            recommendation_id = cursor.lastrowid
+            await db.executemany(INSERT_RECOMMENDATION_TARIFF, [
+                (recommendation_id, position, tariff["id"]) for position, tariff in enumerate(tariffs)
+            ])
+            await db.commit()
+        
+        return {
+            "id": recommendation_id,
+            "user_id": user_id,
+            "recommendation": recommendation,
+            "explanation": tariff_data["explanation"],
+            "recommended_tariff_id": recommended_tariff_id,
+            "selected_tariff_id": None,
+            "tariffs": tariffs
+        }
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении рекомендации пользователю {user_id}: {e}")
+        raise
+
+
+async def get_recommendation(recommendation_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Получает рекомендацию с предложенными тарифами.
+    
+    Args:
+        recommendation_id: ID рекомендации
+        
+    Returns:
+        Словарь с полями рекомендации и списком tariffs (id, name, description,
+        price, features) в порядке предложения или None, если рекомендации нет
+    """
+    try:
+        async with connection() as db:
+            async with db.execute(GET_RECOMMENDATION, (recommendation_id,)) as cursor:
+                row = await cursor.fetchone()
+            if not row:
+                return None
+            recommendation = dict(row)
+            
+            async with db.execute(GET_RECOMMENDATION_TARIFFS, (recommendation_id,)) as cursor:
+                recommendation["tariffs"] = [
+                    {**dict(tariff), "features": json.loads(tariff["features"])}
+                    for tariff in await cursor.fetchall()
+                ]
+        return recommendation
+    except Exception as e:
+        logger.error(f"Ошибка при получении рекомендации {recommendation_id}: {e}")
+        return None
+
+
+async def select_recommended_tariff(recommendation_id: int, tariff_id: int) -> None:
+    """
+    Отмечает тариф, выбранный пользователем из рекомендации.
+    
+    Args:
+        recommendation_id: ID рекомендации
+        tariff_id: ID выбранного тарифа
+    """
+    try:
+        async with connection() as db:
+            await db.execute(SELECT_RECOMMENDED_TARIFF, (tariff_id, int(time.time()), recommendation_id))
+            await db.commit()
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении выбора тарифа в рекомендации {recommendation_id}: {e}")
+        raise
+
+
+async def get_cached_recommendation(cache_key: str, min_created_at: int) -> Optional[Dict[str, Any]]:
+    """
+    Получает закэшированную рекомендацию тарифов.
+    
+    Args:
+        cache_key: Ключ кэша (хэш версии промпта и нормализованных ответов)
+        min_created_at: Записи, созданные раньше этого времени (epoch), считаются устаревшими
+        
+    Returns:
+        Рекомендация или None, если в кэше ее нет
+    """
+    try:
+        async with connection() as db:
+            async with db.execute(GET_CACHED_RECOMMENDATION, (cache_key, min_created_at)) as cursor:
+                row = await cursor.fetchone()
+                return json.loads(row["result"]) if row else None
+    except Exception as e:
+        logger.error(f"Ошибка при чтении кэша рекомендаций: {e}")
+        return None
+
+
+async def save_cached_recommendation(cache_key: str, fingerprint: str, answers: str, 
+                                     result: Dict[str, Any]) -> None:
+    """
+    Сохраняет рекомендацию тарифов в кэш.
+    
+    Args:
+        cache_key: Ключ кэша
+        fingerprint: Версия промпта и модели, для которой получена рекомендация
+        answers: Нормализованные ответы в виде JSON
+        result: Рекомендация тарифов
+    """
+    try:
+        async with connection() as db:
+            await db.execute(
+                SAVE_CACHED_RECOMMENDATION,
+                (cache_key, fingerprint, answers, json.dumps(result, ensure_ascii=False), int(time.time()))
+            )
+            await db.commit()
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении рекомендации в кэш: {e}")
+
+
+async def get_cached_recommendations(fingerprint: str, min_created_at: int, limit: int) -> List[Dict[str, Any]]:
+    """
+    Получает последние закэшированные рекомендации версии промпта.
+    
+    Args:
+        fingerprint: Версия промпта и модели
+        min_created_at: Записи, созданные раньше этого времени (epoch), не возвращаются
+        limit: Максимальное количество записей
+        
+    Returns:
+        Список записей (answers, result, created_at) от старых к новым
+        
+    Raises:
+        Exception: Ошибка чтения (индекс не должен считаться построенным по пустому списку)
+    """
+    try:
+        async with connection() as db:
+            async with db.execute(GET_CACHED_RECOMMENDATIONS, (fingerprint, min_created_at, limit)) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+    except Exception as e:
+        logger.error(f"Ошибка при чтении кэша рекомендаций: {e}")
+        raise
+
+
+async def prune_recommendation_cache(fingerprint: str, min_created_at: int, max_rows: int) -> int:
+    """
+    Удаляет из кэша рекомендаций записи старой версии промпта, устаревшие
+    записи и самые старые записи сверх max_rows.
+    
+    Args:
+        fingerprint: Текущая версия промпта и модели
+        min_created_at: Записи, созданные раньше этого времени (epoch), удаляются
+        max_rows: Максимальное количество записей
+        
+    Returns:
+        Количество оставшихся записей
+    """
+    try:
+        async with connection() as db:
+            await db.execute(DELETE_STALE_RECOMMENDATIONS, (fingerprint, min_created_at))
+            await db.execute(TRIM_RECOMMENDATION_CACHE, (max_rows,))
+            await db.commit()
+            async with db.execute(COUNT_CACHED_RECOMMENDATIONS) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else 0
+    except Exception as e:
+        logger.error(f"Ошибка при очистке кэша рекомендаций: {e}")
+        return 0
+
+
+async def save_llm_call(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int,
+                        latency_ms: int, outcome: str) -> None:
+    """
+    Сохраняет запись о вызове OpenAI.
+    
+    Args:
+        model: Модель
+        prompt_tokens: Входные токены
+        completion_tokens: Выходные токены
+        cached_tokens: Входные токены, взятые из кэша промптов
+        latency_ms: Время вызова в миллисекундах
+        outcome: Исход вызова ("success" или вид ошибки)
+    """
+    params = (int(time.time()), model, prompt_tokens, completion_tokens, cached_tokens, latency_ms, outcome)
+    try:
+        if _write_queue is not None:
+            await _write_queue.put(INSERT_LLM_CALL, params, "llm_calls")
+            return
+        
+        async with connection() as db:
+            await db.execute(INSERT_LLM_CALL, params)
+            await db.commit()
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении записи о вызове OpenAI: {e}")
+
+
+async def prune_llm_calls(min_ts: int) -> None:
+    """
+    Удаляет записи о вызовах OpenAI старше min_ts; сводка по дням сохраняется.
+    
+    Args:
+        min_ts: Граница хранения (epoch)
+    """
+    try:
+        await flush_pending_writes("llm_calls")
+        async with connection() as db:
+            await db.execute(DELETE_OLD_LLM_CALLS, (min_ts,))
+            await db.commit()
+    except Exception as e:
+        logger.error(f"Ошибка при очистке записей о вызовах OpenAI: {e}")
+
+
+async def get_llm_call_stats(since_ts: int) -> Dict[str, Any]:
+    """
+    Получает время ответа успешных вызовов OpenAI и количество вызовов по исходам.
+    
+    Args:
+        since_ts: Начало периода (epoch)
+        
+    Returns:
+        Словарь с отсортированным списком latencies (мс) и словарем outcomes
+    """
+    try:
+        await flush_pending_writes("llm_calls")
+        async with connection() as db:
+            async with db.execute(GET_LLM_LATENCIES, (since_ts,)) as cursor:
+                latencies = [row[0] for row in await cursor.fetchall()]
+            async with db.execute(GET_LLM_OUTCOMES, (since_ts,)) as cursor:
+                outcomes = {row["outcome"]: row["calls"] for row in await cursor.fetchall()}
+        return {"latencies": latencies, "outcomes": outcomes}
+    except Exception as e:
+        logger.error(f"Ошибка при получении статистики вызовов OpenAI: {e}")
+        return {"latencies": [], "outcomes": {}}
+
+
+async def get_llm_daily_usage(since_day: str) -> List[Dict[str, Any]]:
+    """
+    Получает сводку вызовов OpenAI по дням и моделям.
+    
+    Args:
+        since_day: Первый день периода в формате YYYY-MM-DD (UTC)
+        
+    Returns:
+        Список сводок, начиная с последнего дня
+    """
+    try:
+        await flush_pending_writes("llm_calls")
+        async with connection() as db:
+            async with db.execute(GET_LLM_DAILY_USAGE, (since_day,)) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+    except Exception as e:
+        logger.error(f"Ошибка при получении сводки вызовов OpenAI: {e}")
+        return []
+
+
+async def get_fsm_record(key: str) -> Optional[Tuple[Optional[str], Optional[bytes]]]:
+    """
+    Получает состояние и сериализованные данные FSM по ключу.
+    
+    Args:
+        key: Ключ хранилища
+        
+    Returns:
+        Пара (состояние, данные) или None, если записи нет
+        
+    Raises:
+        Exception: Ошибка чтения (хранилище не должно подменять состояние пустым)
+    """
+    try:
+        async with connection() as db:
+            async with db.execute(GET_FSM_RECORD, (key,)) as cursor:
+                row = await cursor.fetchone()
+        return (row["state"], row["data"]) if row else None
+    except Exception as e:
+        logger.error(f"Ошибка при получении состояния FSM {key}: {e}")
+        raise
+
+
+async def save_fsm_records(records: List[Tuple[str, Optional[str], Optional[bytes]]]) -> None:
+    """
+    Сохраняет пачку состояний FSM одной транзакцией.
+    
+    Записи без состояния и данных удаляются.
+    
+    Args:
+        records: Тройки (ключ, состояние, сериализованные данные)
+        
+    Raises:
+        Exception: Ошибка записи (хранилище повторит ее при следующем сбросе)
+    """
+    now = int(time.time())
+    upserts = [(key, state, data, now) for key, state, data in records if state is not None or data is not None]
+    deletes = [(key,) for key, state, data in records if state is None and data is None]
+    try:
+        async with connection() as db:
+            if upserts:
+                await db.executemany(SAVE_FSM_RECORD, upserts)
+            if deletes:
+                await db.executemany(DELETE_FSM_RECORD, deletes)
+            await db.commit()
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении {len(records)} состояний FSM: {e}")
+        raise
+
+
+async def prune_fsm_records(min_updated_at: int) -> int:
+    """
+    Удаляет состояния FSM, которые не менялись с min_updated_at.
+    
+    Args:
+        min_updated_at: Граница простоя (epoch)
+        
+    Returns:
+        Количество удаленных состояний
+    """
+    try:
+        async with connection() as db:
+            cursor = await db.execute(DELETE_IDLE_FSM_RECORDS, (min_updated_at,))
+            await db.commit()
+            return cursor.rowcount
+    except Exception as e:
+        logger.error(f"Ошибка при удалении неактивных состояний FSM: {e}")
+        return 0
+
+
+async def get_fsm_state_stats() -> List[Dict[str, Any]]:
+    """
+    Получает количество сессий FSM и их объем в базе по состояниям.
+    
+    Returns:
+        Список словарей с полями state, sessions и bytes, начиная с самого объемного состояния
+    """
+    try:
+        async with connection() as db:
+            async with db.execute(GET_FSM_STATE_STATS) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+    except Exception as e:
+        logger.error(f"Ошибка при получении статистики состояний FSM: {e}")
+        return []
+
+
+async def get_admin_stats() -> Dict[str, Any]:
+    """
+    Получает статистику для админ-панели.
+    
+    Количество активных пользователей и конверсия рекомендаций читаются из
+    счетчиков user_counters, популярные тарифы - из tariff_recommendation_counts.
+    
+    Returns:
+        Словарь со статистикой
+    """
+    try:
+        await flush_pending_writes("users")
+        
+        async with connection() as db:
+            async with db.execute(GET_USER_COUNTERS) as cursor:
+                counters = {row["name"]: row["value"] for row in await cursor.fetchall()}
+            
+            # Популярные тарифы
+            async with db.execute(GET_POPULAR_TARIFFS) as cursor:
+                tariff_rows = await cursor.fetchall()
+                popular_tariffs = [dict(row) for row in tariff_rows]
+        
+        recommended_users = counters.get("recommended_users", 0)
+        selected_users = counters.get("selected_users", 0)
+        # Конверсия рекомендаций в выбор тарифа (без рекомендаций считается нулевой)
+        conversion_rate = selected_users * 100.0 / recommended_users if recommended_users else 0.0
+        
+        return {
+            "active_users_count": counters.get("active", 0),
+            "recommended_users": recommended_users,
+            "selected_users": selected_users,
+            "accepted_recommendations": counters.get("accepted", 0),
+            "conversion_rate": conversion_rate,
+            "popular_tariffs": popular_tariffs
+        }
+    except Exception as e:
+        logger.error(f"Ошибка при получении статистики для админ-панели: {e}")
+        return {
+            "active_users_count": 0,
+            "recommended_users": 0,
+            "selected_users": 0,
+            "accepted_recommendations": 0,
+            "conversion_rate": 0,
+            "popular_tariffs": []
+        }
+
+
+async def reconcile_admin_stats() -> List[Dict[str, Any]]:
+    """
+    Пересчитывает счетчики статистики с нуля по таблицам users и рекомендаций и исправляет расхождения.
+    
+    Пересчет выполняется в транзакции BEGIN IMMEDIATE, поэтому записи
+    пользователей и рекомендаций на это время ждут и не искажают сверку.
+    
+    Returns:
+        Список расхождений: словари с именем счетчика, сохраненным и фактическим значением
+    """
+    await flush_pending_writes("users")
+    
+    try:
+        async with connection() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            
+            async with db.execute(GET_USER_COUNTERS) as cursor:
+                stored = {row["name"]: row["value"] for row in await cursor.fetchall()}
+            async with db.execute(GET_TARIFF_USER_COUNTS) as cursor:
+                stored.update({f"tariff:{row['tariff_id']}": row["user_count"] for row in await cursor.fetchall()})
+            async with db.execute(GET_TARIFF_RECOMMENDATION_COUNTS) as cursor:
+                for row in await cursor.fetchall():
+                    stored[f"selected:{row['tariff_id']}"] = row["user_count"]
+                    stored[f"offered:{row['tariff_id']}"] = row["offered"]
+            
+            async with db.execute(RECOUNT_USER_COUNTERS) as cursor:
+                actual = dict(await cursor.fetchone())
+            async with db.execute(RECOUNT_TARIFF_USER_COUNTS) as cursor:
+                tariff_counts = [tuple(row) for row in await cursor.fetchall()]
+            async with db.execute(RECOUNT_RECOMMENDATION_COUNTERS) as cursor:
+                actual.update(dict(await cursor.fetchone()))
+            async with db.execute(RECOUNT_TARIFF_RECOMMENDATION_COUNTS) as cursor:
+                recommendation_counts = [tuple(row) for row in await cursor.fetchall()]
+            
+            for name in ("total", "active", "with_tariff", "recommended_users", "selected_users", "accepted"):
+                await db.execute(SET_USER_COUNTER, (name, actual[name]))
+            await db.execute(CLEAR_TARIFF_USER_COUNTS)
+            await db.executemany(SET_TARIFF_USER_COUNT, tariff_counts)
+            await db.execute(CLEAR_TARIFF_RECOMMENDATION_COUNTS)
+            await db.executemany(SET_TARIFF_RECOMMENDATION_COUNT, recommendation_counts)
+            await db.commit()
+    except Exception as e:
+        logger.error(f"Ошибка при сверке счетчиков статистики: {e}")
+        raise
+    
+    actual.update({f"tariff:{tariff_id}": user_count for tariff_id, user_count in tariff_counts})
+    for tariff_id, user_count, offered in recommendation_counts:
+        actual[f"selected:{tariff_id}"] = user_count
+        actual[f"offered:{tariff_id}"] = offered
+    drift = [
+        {"counter": name, "stored": stored.get(name, 0), "actual": actual.get(name, 0)}
+        for name in sorted(set(stored) | set(actual))
+        if stored.get(name, 0) != actual.get(name, 0)
+    ]
+    
+    if drift:
+        logger.warning(f"Счетчики статистики расходились с таблицами users и рекомендаций и исправлены: {drift}")
+    else:
+        logger.info("Счетчики статистики совпадают с таблицами users и рекомендаций.")
+    return drift
@@ -0,0 +1,563 @@
+"""
+Хранилище состояний FSM aiogram в базе данных SQLite.
+"""
+import sys
+import json
+import time
+import zlib
+import asyncio
+import logging
+from collections import OrderedDict
+from copy import copy
+from typing import Any, Dict, Optional, Set, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from config import FSM_STORAGE, FSM_CACHE_SIZE, FSM_FLUSH_INTERVAL_MS, FSM_IDLE_TTL, FSM_MEMORY_BUDGET_MB
+from database import db
+from database.cache import LRUCache, MISSING
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+
+# Данные FSM длиннее этого размера (в байтах JSON) сжимаются zlib
+COMPRESS_MIN_BYTES = 512
+
+# Неактивные состояния удаляются из базы не чаще раза в столько секунд
+PRUNE_INTERVAL = 3600
+
+# Заголовки сериализованных данных
+_RAW_JSON = b"j"
+_ZLIB_JSON = b"z"
+
+# Состояние и данные одного ключа; данные в записи не изменяются, изменение создает новую запись
+Record = Tuple[Optional[str], Dict[str, Any]]
+
+_EMPTY: Record = (None, {})
+
+
+def make_key(key: StorageKey) -> str:
+    """
+    Превращает ключ aiogram в строковый ключ таблицы fsm_storage.
+
+    Args:
+        key: Ключ хранилища aiogram
+
+    Returns:
+        Строка вида "бот:чат:пользователь:тема:бизнес-подключение:назначение"
+    """
+    return (
+        f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:"
+        f"{key.business_connection_id or ''}:{key.destiny}"
+    )
+
+
+def encode_data(data: Dict[str, Any]) -> Optional[bytes]:
+    """
+    Сериализует данные FSM: компактный JSON, сжатый zlib, если он длинный.
+
+    Args:
+        data: Данные FSM
+
+    Returns:
+        Байты с однобайтовым заголовком формата или None для пустых данных
+    """
+    if not data:
+        return None
+    raw = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if len(raw) >= COMPRESS_MIN_BYTES:
+        # Уровень 1 сжимает данные FSM почти так же, как уровень по умолчанию, но вдвое быстрее
+        return _ZLIB_JSON + zlib.compress(raw, 1)
+    return _RAW_JSON + raw
+
+
+def decode_data(payload: Optional[bytes]) -> Dict[str, Any]:
+    """
+    Восстанавливает данные FSM, сериализованные encode_data.
+
+    Args:
+        payload: Байты из базы данных или None
+
+    Returns:
+        Данные FSM
+    """
+    if not payload:
+        return {}
+    header, body = payload[:1], payload[1:]
+    if header == _ZLIB_JSON:
+        body = zlib.decompress(body)
+    return json.loads(body)
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище FSM в таблице fsm_storage с кэшем в памяти и отложенной записью.
+
+    Прочитанные и измененные ключи держатся в LRU-кэше, поэтому обработка
+    апдейта обычно не обращается к базе. Изменения (set_state, set_data,
+    update_data) копятся в памяти и записываются одной транзакцией не позже
+    чем через flush_interval: серия изменений одного ключа за это время дает
+    одну запись в базу. Кэш принадлежит процессу, поэтому один ключ должен
+    обрабатываться одним процессом бота. Состояния, которые не менялись
+    дольше idle_ttl, удаляются из базы.
+    """
+
+    def __init__(self, cache_size: int = FSM_CACHE_SIZE,
+                 flush_interval: float = FSM_FLUSH_INTERVAL_MS / 1000,
+                 idle_ttl: float = FSM_IDLE_TTL) -> None:
+        """
+        Args:
+            cache_size: Максимум ключей в кэше (0 - каждое чтение идет в базу)
+            flush_interval: Максимальная задержка записи изменений в секундах (0 - запись сразу)
+            idle_ttl: Время хранения состояния без изменений в секундах (0 - хранится всегда)
+        """
+        self.cache: Optional[LRUCache] = LRUCache(max_size=cache_size, ttl=idle_ttl) if cache_size > 0 else None
+        self.flush_interval = flush_interval
+        self.idle_ttl = idle_ttl
+        self._last_prune = time.monotonic()
+
+        # Изменения, еще не записанные в базу, и изменения, которые записываются сейчас
+        self._dirty: Dict[str, Record] = {}
+        self._flushing: Dict[str, Record] = {}
+        self._flush_lock = asyncio.Lock()
+        self._has_dirty: Optional[asyncio.Event] = None
+        self._timer_task: Optional[asyncio.Task] = None
+
+        # Ключи, читаемые из базы, и те из них, что изменились во время чтения
+        self._loading: Dict[str, int] = {}
+        self._changed_while_loading: Set[str] = set()
+
+        # Счетчики
+        self.writes = 0
+        self.coalesced = 0
+        self.db_reads = 0
+        self.flushes = 0
+        self.flushed_records = 0
+        self.failed_flushes = 0
+        self.expired = 0
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k = make_key(key)
+        _, data = await self._get(k)
+        await self._put(k, (state.state if isinstance(state, State) else state, data))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._get(make_key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        k = make_key(key)
+        state, _ = await self._get(k)
+        await self._put(k, (state, data.copy()))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._get(make_key(key))
+        return data.copy()
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        k = make_key(key)
+        state, current = await self._get(k)
+        updated = {**current, **data}
+        await self._put(k, (state, updated))
+        return updated.copy()
+
+    async def get_value(self, storage_key: StorageKey, dict_key: str, default: Optional[Any] = None) -> Optional[Any]:
+        _, data = await self._get(make_key(storage_key))
+        return copy(data.get(dict_key, default))
+
+    async def close(self) -> None:
+        """
+        Останавливает таймер и записывает накопленные изменения (при остановке бота).
+        """
+        if self._timer_task is not None:
+            # Под блокировкой таймер не может быть посреди сброса: отмена не потеряет изменения
+            async with self._flush_lock:
+                self._timer_task.cancel()
+                try:
+                    await self._timer_task
+                except asyncio.CancelledError:
+                    pass
+            self._timer_task = None
+
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Не удалось записать {len(self._dirty)} состояний FSM при остановке: {e}")
+
+    async def flush(self) -> None:
+        """
+        Записывает накопленные изменения одной транзакцией.
+
+        Raises:
+            Exception: Ошибка записи; изменения остаются в очереди до следующего сброса
+        """
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            self._flushing, self._dirty = self._dirty, {}
+            if self._has_dirty is not None:
+                self._has_dirty.clear()
+
+            records = []
+            for k, (state, data) in self._flushing.items():
+                try:
+                    records.append((k, state, encode_data(data)))
+                except (TypeError, ValueError) as e:
+                    # Несериализуемые данные остаются только в памяти, иначе сброс не прошел бы никогда
+                    logger.error(f"Данные FSM {k} не сериализуются в JSON и не будут сохранены: {e}")
+
+            try:
+                await db.save_fsm_records(records)
+            except BaseException as e:
+                # При отмене (CancelledError) пачка тоже возвращается в очередь
+                if isinstance(e, Exception):
+                    self.failed_flushes += 1
+                # Возвращаем в очередь записи, которые не изменились заново за время сброса
+                for k, record in self._flushing.items():
+                    self._dirty.setdefault(k, record)
+                self._signal_dirty()
+                raise
+            finally:
+                self._flushing = {}
+
+            self.flushes += 1
+            self.flushed_records += len(records)
+
+            if self.idle_ttl and time.monotonic() - self._last_prune >= PRUNE_INTERVAL:
+                self._last_prune = time.monotonic()
+                self.expired += await db.prune_fsm_records(int(time.time() - self.idle_ttl))
+
+    async def get_sessions_report(self) -> Dict[str, Any]:
+        """
+        Собирает отчет о сессиях в базе по состояниям.
+
+        Returns:
+            Словарь с количеством сессий и байт всего и по состояниям
+        """
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Ошибка при записи состояний FSM перед отчетом: {e}")
+        states = await db.get_fsm_state_stats()
+        return {
+            "storage": "sqlite",
+            "sessions": sum(row["sessions"] for row in states),
+            "bytes": sum(row["bytes"] or 0 for row in states),
+            "budget_bytes": None,
+            "idle_ttl": self.idle_ttl,
+            "expired": self.expired,
+            "evicted": self.cache.evictions if self.cache is not None else 0,
+            "states": [
+                {"state": row["state"], "sessions": row["sessions"], "bytes": row["bytes"] or 0}
+                for row in states
+            ]
+        }
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Возвращает метрики хранилища.
+
+        Returns:
+            Словарь с метриками кэша, количеством изменений, слитых изменений,
+            чтений из базы, сбросов и очередью незаписанных изменений
+        """
+        return {
+            "cache": self.cache.get_metrics() if self.cache is not None else None,
+            "writes": self.writes,
+            "coalesced": self.coalesced,
+            "db_reads": self.db_reads,
+            "flushes": self.flushes,
+            "flushed_records": self.flushed_records,
+            "failed_flushes": self.failed_flushes,
+            "pending": len(self._dirty)
+        }
+
+    async def _get(self, k: str) -> Record:
+        """
+        Возвращает запись ключа: из незаписанных изменений, кэша или базы.
+        """
+        while True:
+            record = self._lookup(k)
+            if record is not None:
+                return record
+
+            self._loading[k] = self._loading.get(k, 0) + 1
+            try:
+                row = await db.get_fsm_record(k)
+                self.db_reads += 1
+                changed = k in self._changed_while_loading
+            finally:
+                self._loading[k] -= 1
+                if not self._loading[k]:
+                    del self._loading[k]
+                    self._changed_while_loading.discard(k)
+
+            if changed:
+                # Ключ изменили, пока шло чтение: прочитанная строка могла устареть
+                continue
+
+            record = (row[0], decode_data(row[1])) if row is not None else _EMPTY
+            if self.cache is not None:
+                self.cache.set(k, record)
+            return record
+
+    def _lookup(self, k: str) -> Optional[Record]:
+        """
+        Ищет запись ключа в памяти без обращения к базе.
+        """
+        record = self._dirty.get(k) or self._flushing.get(k)
+        if record is not None:
+            return record
+        if self.cache is not None:
+            cached = self.cache.get(k)
+            if cached is not MISSING:
+                return cached
+        return None
+
+    async def _put(self, k: str, record: Record) -> None:
+        """
+        Сохраняет изменение ключа в памяти и планирует запись в базу.
+        """
+        self.writes += 1
+        if k in self._dirty:
+            self.coalesced += 1
+        self._dirty[k] = record
+        if self.cache is not None:
+            self.cache.set(k, record)
+        if k in self._loading:
+            self._changed_while_loading.add(k)
+
+        if self.flush_interval <= 0:
+            await self.flush()
+            return
+        if self._timer_task is None or self._timer_task.done():
+            self._has_dirty = asyncio.Event()
+            self._timer_task = asyncio.create_task(self._timer_loop())
+        self._signal_dirty()
+
+    def _signal_dirty(self) -> None:
+        """
+        Будит таймер сброса, если есть незаписанные изменения.
+        """
+        if self._dirty and self._has_dirty is not None:
+            self._has_dirty.set()
+
+    async def _timer_loop(self) -> None:
+        """
+        Записывает изменения не позже чем через flush_interval после первого из них.
+        """
+        while True:
+            await self._has_dirty.wait()
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка при записи состояний FSM: {e}")
+                # Повторяем не чаще раза в секунду, пока база недоступна
+                await asyncio.sleep(1)
+
+
+def estimate_size(value: Any) -> int:
+    """
+    Оценивает объем памяти, занятый значением вместе с вложенными объектами.
+
+    Args:
+        value: Значение из данных FSM
+
+    Returns:
+        Объем в байтах (разделяемые объекты учитываются повторно)
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(key) + estimate_size(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item) for item in value)
+    return size
+
+
+class _Session:
+    """
+    Состояние и данные одного ключа в BoundedMemoryStorage.
+    """
+
+    __slots__ = ("state", "data", "data_size", "size", "touched_at")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any], data_size: int, size: int,
+                 touched_at: float) -> None:
+        self.state = state
+        self.data = data
+        self.data_size = data_size
+        self.size = size
+        self.touched_at = touched_at
+
+
+class BoundedMemoryStorage(BaseStorage):
+    """
+    Хранилище FSM в памяти с ограничением времени простоя и общего объема.
+
+    В отличие от MemoryStorage aiogram, сессия, к которой не обращались
+    дольше idle_ttl, удаляется, а при превышении budget_bytes вытесняются
+    сессии, к которым дольше всего не обращались. Пустые сессии (без
+    состояния и данных) не хранятся. Поэтому брошенные на середине
+    онбординги не накапливаются, и объем памяти не растет
+    со временем работы бота. Данные теряются при перезапуске.
+    """
+
+    def __init__(self, budget_bytes: int = int(FSM_MEMORY_BUDGET_MB * 1024 * 1024),
+                 idle_ttl: float = FSM_IDLE_TTL) -> None:
+        """
+        Args:
+            budget_bytes: Предельный объем сессий в байтах (оценка estimate_size)
+            idle_ttl: Время хранения сессии без обращений в секундах (0 - без ограничения)
+        """
+        self.budget_bytes = budget_bytes
+        self.idle_ttl = idle_ttl
+        # Сессии в порядке последнего обращения: первыми идут самые давние
+        self._sessions: "OrderedDict[StorageKey, _Session]" = OrderedDict()
+        self.total_bytes = 0
+
+        # Счетчики
+        self.expired = 0
+        self.evicted = 0
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        session = self._touch(key)
+        state = state.state if isinstance(state, State) else state
+        if session is not None:
+            self._put(key, state, session.data, session.data_size)
+        else:
+            self._put(key, state, {})
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        session = self._touch(key)
+        return session.state if session else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        session = self._touch(key)
+        self._put(key, session.state if session else None, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        session = self._touch(key)
+        return session.data.copy() if session else {}
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        session = self._touch(key)
+        if session is None:
+            await self.set_data(key, data)
+            return data.copy()
+
+        # Объем пересчитывается только для измененных ключей
+        updated = {**session.data, **data}
+        data_size = session.data_size - sys.getsizeof(session.data) + sys.getsizeof(updated)
+        for name, value in data.items():
+            if name in session.data:
+                data_size -= estimate_size(name) + estimate_size(session.data[name])
+            data_size += estimate_size(name) + estimate_size(value)
+        self._put(key, session.state, updated, data_size)
+        return updated.copy()
+
+    async def get_value(self, storage_key: StorageKey, dict_key: str, default: Optional[Any] = None) -> Optional[Any]:
+        session = self._touch(storage_key)
+        return copy(session.data.get(dict_key, default)) if session else default
+
+    async def close(self) -> None:
+        pass
+
+    async def get_sessions_report(self) -> Dict[str, Any]:
+        """
+        Собирает отчет о сессиях в памяти по состояниям.
+
+        Returns:
+            Словарь с количеством сессий и байт всего и по состояниям
+        """
+        self._expire(time.monotonic())
+        states: Dict[Optional[str], Dict[str, Any]] = {}
+        for session in self._sessions.values():
+            item = states.setdefault(session.state, {"state": session.state, "sessions": 0, "bytes": 0})
+            item["sessions"] += 1
+            item["bytes"] += session.size
+        return {
+            "storage": "memory",
+            "sessions": len(self._sessions),
+            "bytes": self.total_bytes,
+            "budget_bytes": self.budget_bytes,
+            "idle_ttl": self.idle_ttl,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "states": sorted(states.values(), key=lambda item: item["bytes"], reverse=True)
+        }
+
+    def _touch(self, key: StorageKey) -> Optional[_Session]:
+        """
+        Возвращает сессию ключа и отмечает обращение к ней.
+        """
+        now = time.monotonic()
+        self._expire(now)
+        session = self._sessions.get(key)
+        if session is not None:
+            session.touched_at = now
+            self._sessions.move_to_end(key)
+        return session
+
+    def _put(self, key: StorageKey, state: Optional[str], data: Dict[str, Any],
+             data_size: Optional[int] = None) -> None:
+        """
+        Сохраняет сессию и вытесняет давние сессии сверх бюджета.
+
+        Args:
+            key: Ключ хранилища
+            state: Состояние
+            data: Данные (хранятся без копирования)
+            data_size: Известный объем данных (None - оценить заново)
+        """
+        old = self._sessions.pop(key, None)
+        if old is not None:
+            self.total_bytes -= old.size
+        if state is None and not data:
+            return
+
+        if data_size is None:
+            data_size = estimate_size(data)
+        size = sys.getsizeof(key) + estimate_size(state) + data_size
+        self._sessions[key] = _Session(state, data, data_size, size, time.monotonic())
+        self.total_bytes += size
+
+        # Последнюю (текущую) сессию не вытесняем, даже если она одна больше бюджета
+        while self.total_bytes > self.budget_bytes and len(self._sessions) > 1:
+            _, evicted = self._sessions.popitem(last=False)
+            self.total_bytes -= evicted.size
+            self.evicted += 1
+
+    def _expire(self, now: float) -> None:
+        """
+        Удаляет сессии, к которым не обращались дольше idle_ttl.
+        """
+        if not self.idle_ttl:
+            return
+        # Сессии упорядочены по времени обращения, поэтому устаревшие - в начале
+        while self._sessions:
+            key, session = next(iter(self._sessions.items()))
+            if now - session.touched_at <= self.idle_ttl:
+                break
+            del self._sessions[key]
+            self.total_bytes -= session.size
+            self.expired += 1
+
+
+def create_fsm_storage(kind: str = FSM_STORAGE) -> BaseStorage:
+    """
+    Создает хранилище FSM, выбранное в настройках.
+
+    Args:
+        kind: "sqlite" - SQLiteStorage, "memory" - BoundedMemoryStorage
+
+    Returns:
+        Хранилище состояний
+    """
+    if kind == "memory":
+        logger.info("Состояния FSM хранятся в памяти и теряются при перезапуске.")
+        return BoundedMemoryStorage()
+    if kind != "sqlite":
+        logger.warning(f"Неизвестное хранилище FSM_STORAGE={kind}, используется sqlite.")
+    return SQLiteStorage()
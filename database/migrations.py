@@ -0,0 +1,516 @@
+"""
+Модуль версионированных миграций схемы базы данных.
+
+Текущая версия схемы хранится в PRAGMA user_version. Каждая миграция
+применяется в отдельной транзакции вместе с обновлением версии, поэтому
+прерванная миграция не оставляет базу в промежуточном состоянии.
+"""
+import logging
+from typing import List, Tuple
+
+import aiosqlite
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+
+# SQL-запросы для создания таблиц
+CREATE_USERS_TABLE = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    trial_end_date TIMESTAMP,
+    is_active BOOLEAN DEFAULT TRUE,
+    tariff_id INTEGER,
+    FOREIGN KEY (tariff_id) REFERENCES tariffs(id)
+);
+"""
+
+CREATE_ONBOARDING_QUESTIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS onboarding_questions (
+    id INTEGER PRIMARY KEY,
+    question_text TEXT NOT NULL,
+    question_type TEXT NOT NULL
+);
+"""
+
+CREATE_ONBOARDING_ANSWERS_TABLE = """
+CREATE TABLE IF NOT EXISTS onboarding_answers (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    question_id INTEGER NOT NULL,
+    answer TEXT NOT NULL,
+    answer_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(user_id),
+    FOREIGN KEY (question_id) REFERENCES onboarding_questions(id)
+);
+"""
+
+CREATE_TARIFFS_TABLE = """
+CREATE TABLE IF NOT EXISTS tariffs (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    description TEXT NOT NULL,
+    price REAL NOT NULL
+);
+"""
+
+# Триггеры счетчиков статистики: выполняются в той же транзакции, что и запись в users,
+# поэтому счетчики обновляются любым путем записи (в том числе отложенной и массовой)
+CREATE_USERS_STATS_INSERT_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS users_stats_insert AFTER INSERT ON users
+BEGIN
+    UPDATE user_counters SET value = value + 1 WHERE name = 'total';
+    UPDATE user_counters SET value = value + 1 WHERE name = 'active' AND NEW.is_active = TRUE;
+    UPDATE user_counters SET value = value + 1 WHERE name = 'with_tariff' AND NEW.tariff_id IS NOT NULL;
+    INSERT OR IGNORE INTO tariff_user_counts (tariff_id, user_count)
+    SELECT NEW.tariff_id, 0 WHERE NEW.tariff_id IS NOT NULL;
+    UPDATE tariff_user_counts SET user_count = user_count + 1 WHERE tariff_id = NEW.tariff_id;
+END;
+"""
+
+CREATE_USERS_STATS_DELETE_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS users_stats_delete AFTER DELETE ON users
+BEGIN
+    UPDATE user_counters SET value = value - 1 WHERE name = 'total';
+    UPDATE user_counters SET value = value - 1 WHERE name = 'active' AND OLD.is_active = TRUE;
+    UPDATE user_counters SET value = value - 1 WHERE name = 'with_tariff' AND OLD.tariff_id IS NOT NULL;
+    UPDATE tariff_user_counts SET user_count = user_count - 1 WHERE tariff_id = OLD.tariff_id;
+END;
+"""
+
+CREATE_USERS_STATS_UPDATE_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS users_stats_update AFTER UPDATE OF is_active, tariff_id ON users
+WHEN OLD.is_active IS NOT NEW.is_active OR OLD.tariff_id IS NOT NEW.tariff_id
+BEGIN
+    UPDATE user_counters
+    SET value = value + (NEW.is_active = TRUE IS TRUE) - (OLD.is_active = TRUE IS TRUE)
+    WHERE name = 'active';
+    UPDATE user_counters
+    SET value = value + (NEW.tariff_id IS NOT NULL) - (OLD.tariff_id IS NOT NULL)
+    WHERE name = 'with_tariff';
+    UPDATE tariff_user_counts SET user_count = user_count - 1
+    WHERE tariff_id = OLD.tariff_id AND OLD.tariff_id IS NOT NEW.tariff_id;
+    INSERT OR IGNORE INTO tariff_user_counts (tariff_id, user_count)
+    SELECT NEW.tariff_id, 0 WHERE NEW.tariff_id IS NOT NULL;
+    UPDATE tariff_user_counts SET user_count = user_count + 1
+    WHERE tariff_id = NEW.tariff_id AND OLD.tariff_id IS NOT NEW.tariff_id;
+END;
+"""
+
+# Триггеры счетчиков конверсии рекомендаций: пользователь учитывается один раз,
+# поэтому его другие рекомендации проверяются по индексам пользователя и выбранного тарифа
+CREATE_RECOMMENDATIONS_STATS_INSERT_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS recommendations_stats_insert AFTER INSERT ON recommendations
+BEGIN
+    UPDATE user_counters SET value = value + 1
+    WHERE name = 'recommended_users'
+      AND NOT EXISTS (SELECT 1 FROM recommendations WHERE user_id = NEW.user_id AND id != NEW.id);
+    UPDATE user_counters SET value = value + 1
+    WHERE name = 'selected_users' AND NEW.selected_tariff_id IS NOT NULL
+      AND NOT EXISTS (
+          SELECT 1 FROM recommendations
+          WHERE user_id = NEW.user_id AND selected_tariff_id IS NOT NULL AND id != NEW.id
+      );
+    UPDATE user_counters SET value = value + 1
+    WHERE name = 'accepted' AND NEW.selected_tariff_id = NEW.recommended_tariff_id;
+    INSERT OR IGNORE INTO tariff_recommendation_counts (tariff_id, user_count, offered)
+    SELECT NEW.selected_tariff_id, 0, 0 WHERE NEW.selected_tariff_id IS NOT NULL;
+    UPDATE tariff_recommendation_counts SET user_count = user_count + 1
+    WHERE tariff_id = NEW.selected_tariff_id
+      AND NOT EXISTS (
+          SELECT 1 FROM recommendations
+          WHERE selected_tariff_id = NEW.selected_tariff_id AND user_id = NEW.user_id AND id != NEW.id
+      );
+END;
+"""
+
+CREATE_RECOMMENDATIONS_STATS_DELETE_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS recommendations_stats_delete AFTER DELETE ON recommendations
+BEGIN
+    UPDATE user_counters SET value = value - 1
+    WHERE name = 'recommended_users'
+      AND NOT EXISTS (SELECT 1 FROM recommendations WHERE user_id = OLD.user_id);
+    UPDATE user_counters SET value = value - 1
+    WHERE name = 'selected_users' AND OLD.selected_tariff_id IS NOT NULL
+      AND NOT EXISTS (
+          SELECT 1 FROM recommendations WHERE user_id = OLD.user_id AND selected_tariff_id IS NOT NULL
+      );
+    UPDATE user_counters SET value = value - 1
+    WHERE name = 'accepted' AND OLD.selected_tariff_id = OLD.recommended_tariff_id;
+    UPDATE tariff_recommendation_counts SET user_count = user_count - 1
+    WHERE tariff_id = OLD.selected_tariff_id
+      AND NOT EXISTS (
+          SELECT 1 FROM recommendations
+          WHERE selected_tariff_id = OLD.selected_tariff_id AND user_id = OLD.user_id
+      );
+END;
+"""
+
+CREATE_RECOMMENDATIONS_STATS_UPDATE_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS recommendations_stats_update
+AFTER UPDATE OF selected_tariff_id, recommended_tariff_id ON recommendations
+WHEN OLD.selected_tariff_id IS NOT NEW.selected_tariff_id
+  OR OLD.recommended_tariff_id IS NOT NEW.recommended_tariff_id
+BEGIN
+    UPDATE user_counters
+    SET value = value + (NEW.selected_tariff_id IS NOT NULL) - (OLD.selected_tariff_id IS NOT NULL)
+    WHERE name = 'selected_users'
+      AND NOT EXISTS (
+          SELECT 1 FROM recommendations
+          WHERE user_id = NEW.user_id AND selected_tariff_id IS NOT NULL AND id != NEW.id
+      );
+    UPDATE user_counters
+    SET value = value + (NEW.selected_tariff_id = NEW.recommended_tariff_id IS TRUE)
+                      - (OLD.selected_tariff_id = OLD.recommended_tariff_id IS TRUE)
+    WHERE name = 'accepted';
+    UPDATE tariff_recommendation_counts SET user_count = user_count - 1
+    WHERE tariff_id = OLD.selected_tariff_id AND OLD.selected_tariff_id IS NOT NEW.selected_tariff_id
+      AND NOT EXISTS (
+          SELECT 1 FROM recommendations
+          WHERE selected_tariff_id = OLD.selected_tariff_id AND user_id = NEW.user_id AND id != NEW.id
+      );
+    INSERT OR IGNORE INTO tariff_recommendation_counts (tariff_id, user_count, offered)
+    SELECT NEW.selected_tariff_id, 0, 0 WHERE NEW.selected_tariff_id IS NOT NULL;
+    UPDATE tariff_recommendation_counts SET user_count = user_count + 1
+    WHERE tariff_id = NEW.selected_tariff_id AND OLD.selected_tariff_id IS NOT NEW.selected_tariff_id
+      AND NOT EXISTS (
+          SELECT 1 FROM recommendations
+          WHERE selected_tariff_id = NEW.selected_tariff_id AND user_id = NEW.user_id AND id != NEW.id
+      );
+END;
+"""
+
+CREATE_RECOMMENDATION_TARIFFS_STATS_INSERT_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS recommendation_tariffs_stats_insert AFTER INSERT ON recommendation_tariffs
+BEGIN
+    INSERT OR IGNORE INTO tariff_recommendation_counts (tariff_id, user_count, offered)
+    VALUES (NEW.tariff_id, 0, 0);
+    UPDATE tariff_recommendation_counts SET offered = offered + 1 WHERE tariff_id = NEW.tariff_id;
+END;
+"""
+
+CREATE_RECOMMENDATION_TARIFFS_STATS_DELETE_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS recommendation_tariffs_stats_delete AFTER DELETE ON recommendation_tariffs
+BEGIN
+    UPDATE tariff_recommendation_counts SET offered = offered - 1 WHERE tariff_id = OLD.tariff_id;
+END;
+"""
+
+# Сводка вызовов OpenAI по дням и моделям обновляется в той же транзакции, что и запись о вызове
+CREATE_LLM_CALLS_ROLLUP_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS llm_calls_rollup AFTER INSERT ON llm_calls
+BEGIN
+    INSERT INTO llm_daily_usage (
+        day, model, calls, failed, prompt_tokens, completion_tokens, cached_tokens, latency_ms
+    )
+    VALUES (
+        date(NEW.ts, 'unixepoch'), NEW.model, 1, NEW.outcome != 'success',
+        NEW.prompt_tokens, NEW.completion_tokens, NEW.cached_tokens, NEW.latency_ms
+    )
+    ON CONFLICT (day, model) DO UPDATE SET
+        calls = calls + 1,
+        failed = failed + excluded.failed,
+        prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+        completion_tokens = completion_tokens + excluded.completion_tokens,
+        cached_tokens = cached_tokens + excluded.cached_tokens,
+        latency_ms = latency_ms + excluded.latency_ms;
+END;
+"""
+
+# Список миграций: (версия, описание, SQL-запросы).
+# Новые миграции добавляются только в конец списка с очередным номером версии.
+MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (
+        1,
+        "Исходная схема: пользователи, вопросы и ответы онбординга, тарифы",
+        [
+            CREATE_USERS_TABLE,
+            CREATE_ONBOARDING_QUESTIONS_TABLE,
+            CREATE_ONBOARDING_ANSWERS_TABLE,
+            CREATE_TARIFFS_TABLE,
+        ]
+    ),
+    (
+        2,
+        "Окончание триала в виде целочисленного epoch с индексом по (is_active, trial_end_ts)",
+        [
+            "ALTER TABLE users ADD COLUMN trial_end_ts INTEGER;",
+            # trial_end_date хранится в локальном времени, модификатор 'utc' переводит его в UTC
+            """
+            UPDATE users
+            SET trial_end_ts = CAST(strftime('%s', trial_end_date, 'utc') AS INTEGER)
+            WHERE trial_end_date IS NOT NULL;
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_users_active_trial_end ON users (is_active, trial_end_ts);",
+        ]
+    ),
+    (
+        3,
+        "Индекс ответов онбординга по (user_id, question_id)",
+        [
+            "CREATE INDEX IF NOT EXISTS idx_onboarding_answers_user_question "
+            "ON onboarding_answers (user_id, question_id);",
+        ]
+    ),
+    (
+        4,
+        "Отметки о сработавших событиях триала для планировщика",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS trial_notifications (
+                user_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                trial_end_ts INTEGER NOT NULL,
+                fired_at INTEGER NOT NULL,
+                PRIMARY KEY (user_id, kind, trial_end_ts)
+            ) WITHOUT ROWID;
+            """,
+        ]
+    ),
+    (
+        5,
+        "Рассылки с сохранением прогресса",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id INTEGER PRIMARY KEY,
+                text TEXT NOT NULL,
+                admin_chat_id INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'running',
+                total INTEGER NOT NULL DEFAULT 0,
+                last_user_id INTEGER NOT NULL DEFAULT 0,
+                sent INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                blocked INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP
+            );
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts (status);",
+        ]
+    ),
+    (
+        6,
+        "Счетчики статистики админ-панели, которые поддерживаются триггерами на users",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS user_counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID;
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS tariff_user_counts (
+                tariff_id INTEGER PRIMARY KEY,
+                user_count INTEGER NOT NULL DEFAULT 0
+            );
+            """,
+            # Начальные значения считаются по текущему содержимому users
+            """
+            INSERT OR REPLACE INTO user_counters (name, value)
+            SELECT 'total', COUNT(*) FROM users
+            UNION ALL SELECT 'active', COUNT(*) FROM users WHERE is_active = TRUE
+            UNION ALL SELECT 'with_tariff', COUNT(*) FROM users WHERE tariff_id IS NOT NULL;
+            """,
+            """
+            INSERT OR REPLACE INTO tariff_user_counts (tariff_id, user_count)
+            SELECT tariff_id, COUNT(*) FROM users WHERE tariff_id IS NOT NULL GROUP BY tariff_id;
+            """,
+            CREATE_USERS_STATS_INSERT_TRIGGER,
+            CREATE_USERS_STATS_DELETE_TRIGGER,
+            CREATE_USERS_STATS_UPDATE_TRIGGER,
+        ]
+    ),
+    (
+        7,
+        "Кэш рекомендаций тарифов по нормализованным ответам онбординга",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS recommendation_cache (
+                cache_key TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                answers TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created_at INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_recommendation_cache_created ON recommendation_cache (created_at);",
+        ]
+    ),
+    (
+        8,
+        "Очередь фоновых задач анализа ответов онбординга",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS analysis_jobs (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL UNIQUE,
+                chat_id INTEGER NOT NULL,
+                bot_id INTEGER NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at INTEGER NOT NULL
+            );
+            """,
+        ]
+    ),
+    (
+        9,
+        "Учет вызовов OpenAI: токены, время ответа, исход и сводка по дням",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS llm_calls (
+                id INTEGER PRIMARY KEY,
+                ts INTEGER NOT NULL,
+                model TEXT NOT NULL,
+                prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                completion_tokens INTEGER NOT NULL DEFAULT 0,
+                cached_tokens INTEGER NOT NULL DEFAULT 0,
+                latency_ms INTEGER NOT NULL,
+                outcome TEXT NOT NULL
+            );
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_llm_calls_ts ON llm_calls (ts);",
+            """
+            CREATE TABLE IF NOT EXISTS llm_daily_usage (
+                day TEXT NOT NULL,
+                model TEXT NOT NULL,
+                calls INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                completion_tokens INTEGER NOT NULL DEFAULT 0,
+                cached_tokens INTEGER NOT NULL DEFAULT 0,
+                latency_ms INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, model)
+            ) WITHOUT ROWID;
+            """,
+            CREATE_LLM_CALLS_ROLLUP_TRIGGER,
+        ]
+    ),
+    (
+        10,
+        "Хранилище состояний FSM aiogram",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS fsm_storage (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data BLOB,
+                updated_at INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            """,
+        ]
+    ),
+    (
+        11,
+        "Рекомендации тарифов пользователям со ссылками на таблицу tariffs и счетчики их конверсии",
+        [
+            "ALTER TABLE tariffs ADD COLUMN features TEXT NOT NULL DEFAULT '[]';",
+            "CREATE INDEX IF NOT EXISTS idx_tariffs_name_price ON tariffs (name, price);",
+            """
+            CREATE TABLE IF NOT EXISTS recommendations (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                recommendation TEXT NOT NULL,
+                explanation TEXT NOT NULL,
+                recommended_tariff_id INTEGER,
+                selected_tariff_id INTEGER,
+                created_at INTEGER NOT NULL,
+                selected_at INTEGER,
+                FOREIGN KEY (user_id) REFERENCES users(user_id),
+                FOREIGN KEY (recommended_tariff_id) REFERENCES tariffs(id),
+                FOREIGN KEY (selected_tariff_id) REFERENCES tariffs(id)
+            );
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_recommendations_user ON recommendations (user_id);",
+            """
+            CREATE INDEX IF NOT EXISTS idx_recommendations_selected 
+            ON recommendations (selected_tariff_id, user_id) WHERE selected_tariff_id IS NOT NULL;
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS recommendation_tariffs (
+                recommendation_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                tariff_id INTEGER NOT NULL,
+                PRIMARY KEY (recommendation_id, position),
+                FOREIGN KEY (recommendation_id) REFERENCES recommendations(id),
+                FOREIGN KEY (tariff_id) REFERENCES tariffs(id)
+            ) WITHOUT ROWID;
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_recommendation_tariffs_tariff ON recommendation_tariffs (tariff_id);",
+            # Конверсия и популярность тарифов хранятся в счетчиках, как и статистика пользователей
+            """
+            CREATE TABLE IF NOT EXISTS tariff_recommendation_counts (
+                tariff_id INTEGER PRIMARY KEY,
+                user_count INTEGER NOT NULL DEFAULT 0,
+                offered INTEGER NOT NULL DEFAULT 0
+            );
+            """,
+            """
+            INSERT OR REPLACE INTO user_counters (name, value)
+            SELECT 'recommended_users', COUNT(DISTINCT user_id) FROM recommendations
+            UNION ALL SELECT 'selected_users', COUNT(DISTINCT user_id) FROM recommendations
+                WHERE selected_tariff_id IS NOT NULL
+            UNION ALL SELECT 'accepted', COUNT(*) FROM recommendations
+                WHERE selected_tariff_id = recommended_tariff_id;
+            """,
+            CREATE_RECOMMENDATIONS_STATS_INSERT_TRIGGER,
+            CREATE_RECOMMENDATIONS_STATS_DELETE_TRIGGER,
+            CREATE_RECOMMENDATIONS_STATS_UPDATE_TRIGGER,
+            CREATE_RECOMMENDATION_TARIFFS_STATS_INSERT_TRIGGER,
+            CREATE_RECOMMENDATION_TARIFFS_STATS_DELETE_TRIGGER,
+        ]
+    ),
+]
+
+
+async def get_schema_version(db: aiosqlite.Connection) -> int:
+    """
+    Возвращает текущую версию схемы базы данных.
+
+    Args:
+        db: Соединение с базой данных
+
+    Returns:
+        Номер последней примененной миграции (0 для новой базы)
+    """
+    async with db.execute("PRAGMA user_version") as cursor:
+        row = await cursor.fetchone()
+        return row[0] if row else 0
+
+
+async def apply_migrations(db: aiosqlite.Connection) -> int:
+    """
+    Применяет к базе данных все еще не примененные миграции.
+
+    Args:
+        db: Соединение с базой данных
+
+    Returns:
+        Версия схемы после применения миграций
+    """
+    current_version = await get_schema_version(db)
+
+    for version, description, statements in MIGRATIONS:
+        if version <= current_version:
+            continue
+
+        try:
+            await db.execute("BEGIN")
+            for statement in statements:
+                await db.execute(statement)
+            # PRAGMA не поддерживает параметры, версия - целое число из списка миграций
+            await db.execute(f"PRAGMA user_version = {int(version)}")
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"Ошибка при применении миграции {version} ({description}): {e}")
+            raise
+
+        current_version = version
+        logger.info(f"Применена миграция {version}: {description}")
+
+    return current_version
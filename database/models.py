@@ -1,10 +1,11 @@
 """
 Модуль для инициализации моделей базы данных и загрузки начальных данных.
 """
+import json
 import asyncio
 import logging
-import aiosqlite
-from config import DATABASE_PATH, ONBOARDING_QUESTIONS
+from config import ONBOARDING_QUESTIONS
+from database.db import connection
 
 logger = logging.getLogger(__name__)
 
@@ -13,17 +14,37 @@ DEFAULT_TARIFFS = [
     {
         "name": "Базовый",
         "description": "Тариф для небольших компаний и индивидуальных предпринимателей. Включает основной функционал без дополнительных опций.",
-        "price": 1990.0
+        "price": 1990.0,
+        "features": [
+            "До 100 запросов в день",
+            "До 3 пользователей",
+            "Базовая аналитика",
+            "Поддержка по email"
+        ]
     },
     {
         "name": "Стандарт",
         "description": "Оптимальный выбор для среднего бизнеса. Включает расширенный функционал и приоритетную поддержку.",
-        "price": 4990.0
+        "price": 4990.0,
+        "features": [
+            "До 500 запросов в день",
+            "До 10 пользователей",
+            "Расширенная аналитика",
+            "Интеграция с CRM",
+            "Приоритетная поддержка"
+        ]
     },
     {
         "name": "Премиум",
         "description": "Полный набор функций для крупного бизнеса. Включает все возможности системы, персонального менеджера и круглосуточную поддержку.",
-        "price": 9990.0
+        "price": 9990.0,
+        "features": [
+            "Без ограничения запросов",
+            "Неограниченное количество пользователей",
+            "Все возможности системы и доступ к API",
+            "Персональный менеджер",
+            "Круглосуточная поддержка"
+        ]
     }
 ]
 
@@ -33,7 +54,7 @@ async def load_onboarding_questions() -> None:
     Загружает вопросы для онбординга из конфигурации в базу данных.
     """
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with connection() as db:
             # Сначала удаляем все существующие вопросы
             await db.execute("DELETE FROM onboarding_questions")
             
@@ -56,19 +77,27 @@ async def load_default_tariffs() -> None:
     Загружает предустановленные тарифы в базу данных, если они еще не существуют.
     """
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with connection() as db:
             # Проверяем, есть ли уже тарифы в базе
             async with db.execute("SELECT COUNT(*) FROM tariffs") as cursor:
                 count = await cursor.fetchone()
                 if count and count[0] > 0:
+                    # Тарифы, загруженные до появления колонки features (миграция 11), получают функции
+                    for tariff in DEFAULT_TARIFFS:
+                        await db.execute(
+                            "UPDATE tariffs SET features = ? WHERE name = ? AND price = ? AND features = '[]'",
+                            (json.dumps(tariff["features"], ensure_ascii=False), tariff["name"], tariff["price"])
+                        )
+                    await db.commit()
                     logger.info("Тарифы уже существуют в базе данных.")
                     return
             
             # Добавляем предустановленные тарифы
             for tariff in DEFAULT_TARIFFS:
                 await db.execute(
-                    "INSERT INTO tariffs (name, description, price) VALUES (?, ?, ?)",
-                    (tariff["name"], tariff["description"], tariff["price"])
+                    "INSERT INTO tariffs (name, description, price, features) VALUES (?, ?, ?, ?)",
+                    (tariff["name"], tariff["description"], tariff["price"],
+                     json.dumps(tariff["features"], ensure_ascii=False))
                 )
             
             await db.commit()
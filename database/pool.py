@@ -0,0 +1,148 @@
+"""
+Модуль с пулом долгоживущих соединений к базе данных SQLite.
+"""
+import sqlite3
+import logging
+import asyncio
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, List, Optional, Union
+
+import aiosqlite
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """
+    Пул постоянных соединений aiosqlite.
+
+    Каждое соединение открывается один раз (вместе со своим рабочим потоком),
+    переводится в режим WAL и настраивается PRAGMA-параметрами. Подготовленные
+    запросы переиспользуются за счет кэша выражений sqlite3 на каждом соединении.
+    """
+
+    def __init__(
+        self,
+        database: Union[str, Path],
+        size: int = 4,
+        busy_timeout_ms: int = 5000,
+        cache_size_kb: int = 8192,
+        mmap_size: int = 0,
+        statement_cache_size: int = 256
+    ) -> None:
+        """
+        Args:
+            database: Путь к файлу базы данных
+            size: Количество соединений в пуле
+            busy_timeout_ms: Время ожидания снятия блокировки в миллисекундах
+            cache_size_kb: Размер страничного кэша SQLite на соединение в килобайтах
+            mmap_size: Размер memory-mapped I/O в байтах (0 - отключено)
+            statement_cache_size: Размер кэша подготовленных запросов на соединение
+        """
+        self.database = database
+        self.size = max(1, size)
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.statement_cache_size = statement_cache_size
+
+        self._connections: List[aiosqlite.Connection] = []
+        self._idle: Optional[asyncio.Queue] = None
+        self._closed = True
+
+    @property
+    def is_open(self) -> bool:
+        """
+        Возвращает True, если пул открыт и готов выдавать соединения.
+        """
+        return not self._closed
+
+    async def open(self) -> None:
+        """
+        Открывает все соединения пула и применяет к ним PRAGMA-настройки.
+        """
+        if not self._closed:
+            return
+
+        self._idle = asyncio.Queue()
+        try:
+            for _ in range(self.size):
+                connection = await self._connect()
+                self._connections.append(connection)
+                self._idle.put_nowait(connection)
+        except Exception:
+            await self._close_connections()
+            raise
+
+        self._closed = False
+        logger.info(f"Пул соединений с базой данных открыт ({self.size} соединений).")
+
+    async def close(self) -> None:
+        """
+        Дожидается возврата всех соединений в пул и закрывает их.
+        """
+        if self._closed:
+            return
+
+        self._closed = True
+        # Забираем все соединения, чтобы не закрыть занятое посреди запроса
+        for _ in range(len(self._connections)):
+            await self._idle.get()
+
+        await self._close_connections()
+        logger.info("Пул соединений с базой данных закрыт.")
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[aiosqlite.Connection]:
+        """
+        Выдает свободное соединение из пула на время блока async with.
+
+        Если блок завершился исключением посреди транзакции, транзакция
+        откатывается, чтобы соединение вернулось в пул в чистом состоянии.
+        """
+        if self._closed:
+            raise RuntimeError("Пул соединений с базой данных не открыт")
+
+        connection = await self._idle.get()
+        try:
+            yield connection
+        except BaseException:
+            if connection.in_transaction:
+                await connection.rollback()
+            raise
+        finally:
+            self._idle.put_nowait(connection)
+
+    async def _connect(self) -> aiosqlite.Connection:
+        """
+        Открывает и настраивает одно соединение.
+
+        Returns:
+            Настроенное соединение aiosqlite
+        """
+        connection = await aiosqlite.connect(
+            self.database,
+            cached_statements=self.statement_cache_size
+        )
+        connection.row_factory = sqlite3.Row
+        await connection.execute("PRAGMA journal_mode = WAL")
+        await connection.execute("PRAGMA synchronous = NORMAL")
+        await connection.execute("PRAGMA temp_store = MEMORY")
+        await connection.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        # Отрицательное значение cache_size задает размер кэша в килобайтах
+        await connection.execute(f"PRAGMA cache_size = -{int(self.cache_size_kb)}")
+        await connection.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        return connection
+
+    async def _close_connections(self) -> None:
+        """
+        Закрывает все открытые соединения пула.
+        """
+        for connection in self._connections:
+            try:
+                await connection.close()
+            except Exception as e:
+                logger.error(f"Ошибка при закрытии соединения с базой данных: {e}")
+        self._connections.clear()
@@ -0,0 +1,217 @@
+"""
+Модуль отложенной записи (write-behind) с групповыми коммитами.
+"""
+import time
+import logging
+import asyncio
+from collections import Counter
+from itertools import groupby
+from typing import Any, AsyncContextManager, Callable, Dict, List, Optional, Sequence, Tuple
+
+import aiosqlite
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+
+# Отложенная операция записи: SQL-запрос, его параметры и изменяемая таблица
+PendingWrite = Tuple[str, Sequence[Any], str]
+
+
+class WriteBehindQueue:
+    """
+    Очередь отложенной записи.
+
+    Запросы на запись накапливаются в памяти и сбрасываются в базу одной
+    транзакцией (один коммит и один fsync на пачку), когда:
+    - в очереди набралось batch_size запросов;
+    - с момента появления первого запроса прошло flush_interval секунд;
+    - чтению нужны свежие данные (вызов flush()).
+    """
+
+    def __init__(
+        self,
+        connection_factory: Callable[[], AsyncContextManager[aiosqlite.Connection]],
+        batch_size: int = 100,
+        flush_interval: float = 0.05,
+        max_pending: int = 5000
+    ) -> None:
+        """
+        Args:
+            connection_factory: Функция, выдающая соединение с базой данных
+            batch_size: Размер пачки, при котором сброс запускается немедленно
+            flush_interval: Максимальное время ожидания запроса в очереди в секундах
+            max_pending: Предельная глубина очереди, после которой запись ждет сброса
+        """
+        self._connection_factory = connection_factory
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_pending = max(self.batch_size, max_pending)
+
+        self._pending: List[PendingWrite] = []
+        self._pending_tables: Counter = Counter()
+        # Таблицы пачки, которая пишется прямо сейчас: до коммита чтение должно ее дождаться
+        self._flushing_tables: Counter = Counter()
+        self._flush_lock = asyncio.Lock()
+        self._has_pending = asyncio.Event()
+        self._timer_task: Optional[asyncio.Task] = None
+        self._flush_tasks: set = set()
+
+        # Метрики
+        self._enqueued = 0
+        self._written = 0
+        self._failed = 0
+        self._flushes = 0
+        self._max_depth = 0
+        self._last_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    @property
+    def depth(self) -> int:
+        """
+        Текущее количество запросов, ожидающих записи.
+        """
+        return len(self._pending)
+
+    def has_pending(self, table: Optional[str] = None) -> bool:
+        """
+        Проверяет, есть ли незаписанные запросы (к указанной таблице или к любой).
+
+        Пачка, которая уже забрана из очереди, но еще не закоммичена, тоже
+        считается незаписанной: flush() дождется окончания ее записи.
+
+        Args:
+            table: Имя таблицы или None для проверки всей очереди
+        """
+        if table is None:
+            return bool(self._pending) or bool(self._flushing_tables)
+        return self._pending_tables[table] > 0 or self._flushing_tables[table] > 0
+
+    def start(self) -> None:
+        """
+        Запускает фоновую задачу сброса очереди по таймеру.
+        """
+        if self._timer_task is None or self._timer_task.done():
+            self._timer_task = asyncio.create_task(self._timer_loop())
+
+    async def put(self, sql: str, params: Sequence[Any], table: str) -> None:
+        """
+        Ставит запрос на запись в очередь.
+
+        Args:
+            sql: SQL-запрос на изменение данных
+            params: Параметры запроса
+            table: Таблица, которую изменяет запрос
+        """
+        # Защита от неограниченного роста очереди: ждем сброса
+        if len(self._pending) >= self.max_pending:
+            await self.flush()
+
+        self._pending.append((sql, params, table))
+        self._pending_tables[table] += 1
+        self._enqueued += 1
+        self._max_depth = max(self._max_depth, len(self._pending))
+        self._has_pending.set()
+
+        if len(self._pending) >= self.batch_size:
+            task = asyncio.create_task(self.flush())
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._flush_tasks.discard)
+
+    async def flush(self) -> None:
+        """
+        Записывает все накопленные запросы одной транзакцией.
+        """
+        async with self._flush_lock:
+            batch, self._pending = self._pending, []
+            self._flushing_tables, self._pending_tables = self._pending_tables, Counter()
+            self._has_pending.clear()
+            if not batch:
+                return
+
+            started = time.perf_counter()
+            try:
+                async with self._connection_factory() as db:
+                    # Подряд идущие одинаковые запросы отправляем через executemany
+                    for sql, group in groupby(batch, key=lambda item: item[0]):
+                        await db.executemany(sql, [params for _, params, _ in group])
+                    await db.commit()
+                self._written += len(batch)
+            except Exception as e:
+                logger.error(f"Ошибка группового коммита из {len(batch)} запросов, пишем по одному: {e}")
+                await self._write_one_by_one(batch)
+            finally:
+                self._flushing_tables = Counter()
+
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self._flushes += 1
+            self._last_flush_ms = elapsed_ms
+            self._max_flush_ms = max(self._max_flush_ms, elapsed_ms)
+            self._total_flush_ms += elapsed_ms
+            logger.debug(f"Сброшено {len(batch)} отложенных запросов за {elapsed_ms:.2f} мс.")
+
+    async def drain(self) -> None:
+        """
+        Останавливает таймер и записывает все оставшиеся запросы (при остановке бота).
+        """
+        if self._timer_task is not None:
+            # Под блокировкой таймер не может быть посреди записи: отмена не потеряет пачку
+            async with self._flush_lock:
+                self._timer_task.cancel()
+                try:
+                    await self._timer_task
+                except asyncio.CancelledError:
+                    pass
+            self._timer_task = None
+
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+        await self.flush()
+        logger.info("Очередь отложенной записи сброшена.")
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Возвращает метрики очереди.
+
+        Returns:
+            Словарь с глубиной очереди, количеством запросов и задержками сброса
+        """
+        return {
+            "depth": len(self._pending),
+            "max_depth": self._max_depth,
+            "enqueued": self._enqueued,
+            "written": self._written,
+            "failed": self._failed,
+            "flushes": self._flushes,
+            "avg_batch_size": self._written / self._flushes if self._flushes else 0.0,
+            "last_flush_ms": self._last_flush_ms,
+            "avg_flush_ms": self._total_flush_ms / self._flushes if self._flushes else 0.0,
+            "max_flush_ms": self._max_flush_ms
+        }
+
+    async def _timer_loop(self) -> None:
+        """
+        Сбрасывает очередь не позже чем через flush_interval после появления запроса.
+        """
+        while True:
+            await self._has_pending.wait()
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка при сбросе очереди отложенной записи: {e}")
+
+    async def _write_one_by_one(self, batch: List[PendingWrite]) -> None:
+        """
+        Записывает пачку по одному запросу, чтобы изолировать ошибочный запрос.
+        """
+        async with self._connection_factory() as db:
+            for sql, params, _ in batch:
+                try:
+                    await db.execute(sql, params)
+                    await db.commit()
+                    self._written += 1
+                except Exception as e:
+                    await db.rollback()
+                    self._failed += 1
+                    logger.error(f"Ошибка при записи отложенного запроса: {e}")
@@ -9,6 +9,15 @@ from aiogram.fsm.context import FSMContext
 
 from config import ADMIN_IDS
 from database import db
+from services.analysis_queue import get_analysis_queue_metrics
+from services.broadcast import start_broadcast
+from services.llm_usage import get_llm_usage_report
+from services.openai_api import get_llm_metrics, get_recommendation_cache_metrics
+from services.sender import get_last_runs
+from services.tariff_scorer import get_scorer_metrics
+from services.stats_reconciler import reconcile_stats
+from services.sharding import get_shard_report
+from services.webhook import get_webhook_metrics
 
 # Инициализация логгера
 logger = logging.getLogger(__name__)
@@ -52,7 +61,10 @@ async def cmd_admin(message: Message) -> None:
     popular_tariffs_text = ""
     if stats["popular_tariffs"]:
         for tariff in stats["popular_tariffs"]:
-            popular_tariffs_text += f"- {tariff['name']}: {tariff['user_count']} пользователей\n"
+            popular_tariffs_text += (
+                f"- {tariff['name']} ({tariff['price']:.0f} руб.): {tariff['user_count']} пользователей, "
+                f"предложен {tariff['offered']} раз\n"
+            )
     else:
         popular_tariffs_text = "Нет данных о выбранных тарифах."
     
@@ -60,7 +72,9 @@ async def cmd_admin(message: Message) -> None:
     admin_panel_text = (
         "📊 Статистика бота «Нейропродажник»\n\n"
         f"👥 Активных пользователей: {stats['active_users_count']}\n"
-        f"💰 Конверсия в оплату: {stats['conversion_rate']:.2f}%\n\n"
+        f"💰 Конверсия рекомендаций в выбор тарифа: {stats['conversion_rate']:.2f}% "
+        f"({stats['selected_users']} из {stats['recommended_users']})\n"
+        f"🎯 Выбран рекомендованный тариф: {stats['accepted_recommendations']} раз\n\n"
         f"📈 Популярные тарифы:\n{popular_tariffs_text}"
     )
     
@@ -68,6 +82,381 @@ async def cmd_admin(message: Message) -> None:
     logger.info(f"Админ {user_id} запросил статистику бота.")
 
 
+@admin_router.message(Command("dbstats"))
+async def cmd_dbstats(message: Message, state: FSMContext) -> None:
+    """
+    Обрабатывает команду /dbstats, показывает метрики подсистемы базы данных.
+    
+    Args:
+        message: Сообщение от пользователя
+        state: Контекст FSM (через него доступно хранилище состояний)
+    """
+    user_id = message.from_user.id
+    
+    # Проверяем, является ли пользователь администратором
+    if not is_admin(user_id):
+        await message.answer("У вас нет доступа к этой команде.")
+        return
+    
+    write_queue = db.get_write_queue_metrics()
+    if write_queue:
+        write_queue_text = (
+            f"Глубина очереди: {write_queue['depth']} (максимум {write_queue['max_depth']})\n"
+            f"Записано запросов: {write_queue['written']}, ошибок: {write_queue['failed']}\n"
+            f"Сбросов: {write_queue['flushes']}, средняя пачка: {write_queue['avg_batch_size']:.1f}\n"
+            f"Задержка сброса: последняя {write_queue['last_flush_ms']:.1f} мс, "
+            f"средняя {write_queue['avg_flush_ms']:.1f} мс, максимум {write_queue['max_flush_ms']:.1f} мс"
+        )
+    else:
+        write_queue_text = "Отложенная запись выключена."
+    
+    user_cache = db.get_user_cache_metrics()
+    if user_cache:
+        user_cache_text = (
+            f"Записей: {user_cache['size']} из {user_cache['max_size']} (TTL {user_cache['ttl']:.0f} с)\n"
+            f"Попаданий: {user_cache['hits']}, промахов: {user_cache['misses']} "
+            f"({user_cache['hit_rate'] * 100:.1f}% попаданий)\n"
+            f"Вытеснений: {user_cache['evictions']}, устареваний: {user_cache['expirations']}"
+        )
+    else:
+        user_cache_text = "Кэш пользователей выключен."
+    
+    recommendation_cache = get_recommendation_cache_metrics()
+    if recommendation_cache["enabled"]:
+        recommendation_cache_text = (
+            f"Версия промпта: {recommendation_cache['fingerprint']}\n"
+            f"Записей в памяти: {recommendation_cache['memory_size']} из {recommendation_cache['memory_max_size']}\n"
+            f"Попаданий: в памяти {recommendation_cache['memory_hits']}, в базе {recommendation_cache['db_hits']}, "
+            f"промахов: {recommendation_cache['misses']} ({recommendation_cache['hit_rate'] * 100:.1f}% попаданий)"
+        )
+    else:
+        recommendation_cache_text = "Кэш рекомендаций выключен."
+    
+    distilled = recommendation_cache["distilled"]
+    if distilled["loaded"]:
+        recommendation_cache_text += (
+            f"\nЛокальная модель (порог {distilled['threshold']:.2f}, классов {distilled['classes']}): "
+            f"уверенно {distilled['confident']}, передано OpenAI {distilled['unsure']}, "
+            f"среднее время {distilled['avg_inference_ms']:.3f} мс"
+        )
+    
+    semantic_cache = recommendation_cache["semantic"]
+    if semantic_cache["enabled"]:
+        recommendation_cache_text += (
+            f"\nПохожие ответы (порог {semantic_cache['threshold']:.2f}): "
+            f"в индексе {semantic_cache['size']} из {semantic_cache['max_size']}, "
+            f"попаданий {semantic_cache['hits']}, промахов {semantic_cache['misses']} "
+            f"({semantic_cache['hit_rate'] * 100:.1f}%), средняя похожесть {semantic_cache['avg_similarity']:.2f}"
+        )
+    
+    decisions = get_scorer_metrics()
+    recommendation_cache_text += (
+        f"\nПодбор тарифа: локально {decisions['local']}, из кэша {decisions['cache']}, "
+        f"по похожим ответам {decisions['semantic']}, локальной моделью {decisions['distilled']}, "
+        f"через OpenAI {decisions['llm']}, локально при сбое OpenAI {decisions['fallback']}"
+    )
+    
+    get_fsm_metrics = getattr(state.storage, "get_metrics", None)
+    if get_fsm_metrics is not None:
+        fsm = get_fsm_metrics()
+        fsm_cache = fsm["cache"]
+        fsm_text = (
+            f"Изменений: {fsm['writes']}, слито до записи: {fsm['coalesced']}, ждут записи: {fsm['pending']}\n"
+            f"Сбросов: {fsm['flushes']} ({fsm['flushed_records']} записей), ошибок: {fsm['failed_flushes']}\n"
+            f"Чтений из базы: {fsm['db_reads']}"
+        )
+        if fsm_cache:
+            fsm_text += (
+                f"\nКлючей в кэше: {fsm_cache['size']} из {fsm_cache['max_size']}, "
+                f"попаданий {fsm_cache['hit_rate'] * 100:.1f}%, вытеснений {fsm_cache['evictions']}"
+            )
+    else:
+        fsm_text = f"Хранилище {type(state.storage).__name__} не пишет в базу, сессии показывает /fsmstats."
+    
+    await message.answer(
+        "🗄 Метрики базы данных\n\n"
+        f"👤 Кэш пользователей:\n{user_cache_text}\n\n"
+        f"💡 Кэш рекомендаций:\n{recommendation_cache_text}\n\n"
+        f"🧭 Состояния FSM:\n{fsm_text}\n\n"
+        f"✍️ Отложенная запись:\n{write_queue_text}"
+    )
+    logger.info(f"Админ {user_id} запросил метрики базы данных.")
+
+
+@admin_router.message(Command("fsmstats"))
+async def cmd_fsmstats(message: Message, state: FSMContext) -> None:
+    """
+    Обрабатывает команду /fsmstats, показывает сессии FSM и их объем по состояниям.
+    
+    Args:
+        message: Сообщение от пользователя
+        state: Контекст FSM (через него доступно хранилище состояний)
+    """
+    user_id = message.from_user.id
+    
+    # Проверяем, является ли пользователь администратором
+    if not is_admin(user_id):
+        await message.answer("У вас нет доступа к этой команде.")
+        return
+    
+    get_report = getattr(state.storage, "get_sessions_report", None)
+    if get_report is None:
+        await message.answer(f"Хранилище {type(state.storage).__name__} не умеет считать сессии.")
+        return
+    
+    report = await get_report()
+    budget_text = f" из {report['budget_bytes'] / 1024:.0f} КБ" if report["budget_bytes"] else ""
+    ttl_text = f"{report['idle_ttl'] / 3600:.0f} ч" if report["idle_ttl"] else "без ограничения"
+    states_text = "\n".join(
+        f"- {item['state'] or 'без состояния'}: {item['sessions']} сессий, {item['bytes'] / 1024:.1f} КБ"
+        for item in report["states"]
+    ) or "Сессий нет."
+    
+    await message.answer(
+        f"🧭 Сессии FSM (хранилище {report['storage']})\n\n"
+        f"Сессий: {report['sessions']}, объем: {report['bytes'] / 1024:.1f} КБ{budget_text}\n"
+        f"Удаляются после простоя: {ttl_text}\n"
+        f"Удалено по простою: {report['expired']}, вытеснено: {report['evicted']}\n\n"
+        f"По состояниям:\n{states_text}"
+    )
+    logger.info(f"Админ {user_id} запросил отчет о сессиях FSM.")
+
+
+@admin_router.message(Command("webhookstats"))
+async def cmd_webhookstats(message: Message) -> None:
+    """
+    Обрабатывает команду /webhookstats, показывает метрики приема апдейтов через webhook.
+    
+    Args:
+        message: Сообщение от пользователя
+    """
+    user_id = message.from_user.id
+    
+    # Проверяем, является ли пользователь администратором
+    if not is_admin(user_id):
+        await message.answer("У вас нет доступа к этой команде.")
+        return
+    
+    # При запуске через supervisor.py апдейты принимает супервизор и присылает его метрики
+    shard_report = get_shard_report()
+    webhook = get_webhook_metrics() or (shard_report["ingest"] if shard_report else None)
+    if webhook is None:
+        await message.answer("Бот получает апдейты поллингом (BOT_MODE=polling).")
+        return
+    
+    await message.answer(
+        "🌐 Прием апдейтов через webhook\n\n"
+        f"Очередь: {webhook['depth']} из {webhook['max_depth']}, "
+        f"обрабатывается: {webhook['in_progress']} ({webhook['workers']} обработчиков)\n"
+        f"Принято: {webhook['accepted']}, обработано: {webhook['processed']}, ошибок: {webhook['failed']}\n"
+        f"Отклонено: неверный секрет {webhook['unauthorized']}, некорректных {webhook['bad_requests']}, "
+        f"очередь заполнена {webhook['overflowed']}\n"
+        f"Ответ Telegram: в среднем {webhook['avg_ack_ms']:.2f} мс\n"
+        f"От приема до обработки: в среднем {webhook['avg_latency'] * 1000:.0f} мс, "
+        f"максимум {webhook['max_latency'] * 1000:.0f} мс"
+    )
+    logger.info(f"Админ {user_id} запросил метрики webhook.")
+
+
+@admin_router.message(Command("shardstats"))
+async def cmd_shardstats(message: Message) -> None:
+    """
+    Обрабатывает команду /shardstats, показывает состояние процессов-обработчиков.
+    
+    Args:
+        message: Сообщение от пользователя
+    """
+    user_id = message.from_user.id
+    
+    # Проверяем, является ли пользователь администратором
+    if not is_admin(user_id):
+        await message.answer("У вас нет доступа к этой команде.")
+        return
+    
+    report = get_shard_report()
+    if report is None:
+        await message.answer("Бот работает в одном процессе (запущен через bot.py).")
+        return
+    
+    shards_text = "\n".join(
+        f"{'🟢' if shard['alive'] else '🔴'} Шард {shard['number']} (pid {shard['pid']}): "
+        f"{shard['rate_in']:.1f} → {shard['rate_out']:.1f} апд/с, "
+        f"очередь {shard['queue']}, в обработке {shard['pending']}, "
+        f"обработано {shard['processed']} (ошибок {shard['failed']}), "
+        f"в среднем {shard['avg_latency'] * 1000:.0f} мс, перезапусков {shard['restarts']}, "
+        f"отчет {shard['heartbeat_age']:.0f} с назад"
+        for shard in report["shards"]
+    )
+    total_in = sum(shard["rate_in"] for shard in report["shards"])
+    total_out = sum(shard["rate_out"] for shard in report["shards"])
+    
+    await message.answer(
+        f"🧩 Процессы-обработчики: {len(report['shards'])}\n\n"
+        f"{shards_text}\n\n"
+        f"Всего: принято {total_in:.1f} апд/с, обработано {total_out:.1f} апд/с\n"
+        f"/dbstats и /llmstats показывают метрики процесса шарда 0, который обрабатывает администраторов."
+    )
+    logger.info(f"Админ {user_id} запросил метрики шардов.")
+
+
+@admin_router.message(Command("notifystats"))
+async def cmd_notifystats(message: Message) -> None:
+    """
+    Обрабатывает команду /notifystats, показывает статистику последних уведомлений о триале.
+    
+    Args:
+        message: Сообщение от пользователя
+    """
+    user_id = message.from_user.id
+    
+    # Проверяем, является ли пользователь администратором
+    if not is_admin(user_id):
+        await message.answer("У вас нет доступа к этой команде.")
+        return
+    
+    titles = {
+        "trial_ending": "⏳ Напоминания о скором окончании триала",
+        "trial_ended": "⌛️ Уведомления об окончании триала"
+    }
+    last_runs = get_last_runs()
+    
+    sections = []
+    for name, title in titles.items():
+        run = last_runs.get(name)
+        if run:
+            sections.append(
+                f"{title}:\n"
+                f"Отправлено: {run['sent']}, ошибок: {run['failed']}, "
+                f"заблокировали бота: {run['blocked']}, повторов: {run['retries']}\n"
+                f"Длительность: {run['duration']:.1f} с"
+            )
+        else:
+            sections.append(f"{title}:\nЕще не запускались.")
+    
+    await message.answer("📬 Статистика уведомлений\n\n" + "\n\n".join(sections))
+    logger.info(f"Админ {user_id} запросил статистику уведомлений.")
+
+
+@admin_router.message(Command("llmstats"))
+async def cmd_llmstats(message: Message) -> None:
+    """
+    Обрабатывает команду /llmstats, показывает метрики вызовов OpenAI.
+    
+    Args:
+        message: Сообщение от пользователя
+    """
+    user_id = message.from_user.id
+    
+    # Проверяем, является ли пользователь администратором
+    if not is_admin(user_id):
+        await message.answer("У вас нет доступа к этой команде.")
+        return
+    
+    llm = get_llm_metrics()
+    first_text = llm["first_text"]
+    usage = await get_llm_usage_report()
+    
+    outcomes_text = ", ".join(f"{outcome}: {calls}" for outcome, calls in usage["outcomes_24h"].items()) or "нет"
+    daily_text = "\n".join(
+        f"{day['day']}: {day['calls']} вызовов, ${day['cost']:.4f}, "
+        f"токенов {day['prompt_tokens']}+{day['completion_tokens']}, "
+        f"из кэша {day['cached_ratio'] * 100:.0f}%"
+        for day in usage["daily"]
+    ) or "Вызовов еще не было"
+    
+    routing = llm["routing"]
+    bucket_labels = [f"≤{bound / 1000:g}с" for bound in routing["bounds_ms"]] + [f">{routing['bounds_ms'][-1] / 1000:g}с"]
+    histograms_text = "\n".join(
+        f"{h['model']} ({h['mode']}): {h['count']} ответов, "
+        f"p50 {h['p50_ms'] if h['p50_ms'] is not None else '—'} мс, "
+        f"p95 {h['p95_ms'] if h['p95_ms'] is not None else '—'} мс, "
+        f"p99 {h['p99_ms'] if h['p99_ms'] is not None else '—'} мс\n"
+        + " ".join(f"{label}: {count}" for label, count in zip(bucket_labels, h["buckets"]) if count)
+        for h in routing["histograms"]
+    ) or "Замеров еще нет"
+    
+    analysis_queue = get_analysis_queue_metrics()
+    if analysis_queue:
+        analysis_queue_text = (
+            f"\n\n📥 Очередь анализа ответов:\n"
+            f"В очереди: {analysis_queue['depth']}, выполняется: {analysis_queue['in_progress']} "
+            f"из {analysis_queue['workers']}\n"
+            f"Выполнено: {analysis_queue['completed']}, повторов: {analysis_queue['retried']}, "
+            f"отброшено: {analysis_queue['dropped']}\n"
+            f"Время до ответа: среднее {analysis_queue['avg_latency']:.1f} с, "
+            f"максимум {analysis_queue['max_latency']:.1f} с"
+        )
+    else:
+        analysis_queue_text = ""
+    
+    breaker_states = {"closed": "замкнут", "open": "разомкнут", "half_open": "пробный запрос"}
+    
+    await message.answer(
+        "🤖 Метрики вызовов OpenAI\n\n"
+        f"Вызовов: {llm['calls']}, успешно: {llm['success']}, не удалось: {llm['failed']}\n"
+        f"Повторов: {llm['retries']}, истек срок: {llm['deadline_exceeded']}\n"
+        f"Таймаутов: {llm['timeouts']}, обрывов соединения: {llm['connection_errors']}, "
+        f"429: {llm['rate_limited']}, 5xx: {llm['server_errors']}, ошибок запроса: {llm['client_errors']}\n"
+        f"Выполняется: {llm['in_flight']} из {llm['concurrency']}\n"
+        f"Предохранитель: {breaker_states.get(llm['breaker_state'], llm['breaker_state'])}, "
+        f"отклонено вызовов: {llm['rejected']}\n\n"
+        f"За сутки: {usage['calls_24h']} вызовов ({outcomes_text})\n"
+        f"Время ответа: p50 {usage['p50_ms']} мс, p95 {usage['p95_ms']} мс\n\n"
+        f"💰 Расходы по дням (UTC):\n{daily_text}\n\n"
+        f"🔀 Выбор модели: основная {routing['primary']}, альтернативная {routing['alternate'] or 'нет'}, "
+        f"по времени ответа: {'да' if routing['routing'] else 'нет'}, "
+        f"хеджирование: {'да' if routing['hedging'] else 'нет'}\n"
+        f"Запросов: {routing['calls']}, отправлено альтернативной модели: {routing['routed']}, "
+        f"вторых запросов: {routing['hedged']}, из них ответили первыми: {routing['hedge_wins']}, "
+        f"отменено запросов: {routing['abandoned']}\n"
+        f"{histograms_text}\n\n"
+        f"Объединение одинаковых запросов: выполнено {llm['single_flight']['calls']}, "
+        f"сэкономлено {llm['single_flight']['coalesced']} "
+        f"({llm['single_flight']['saved_rate'] * 100:.1f}%)\n\n"
+        f"Время до первого текста рекомендации:\n"
+        f"Потоком: {first_text['stream']['count']} ответов, среднее {first_text['stream']['avg']:.2f} с, "
+        f"максимум {first_text['stream']['max']:.2f} с\n"
+        f"Целиком: {first_text['batch']['count']} ответов, среднее {first_text['batch']['avg']:.2f} с, "
+        f"максимум {first_text['batch']['max']:.2f} с"
+        f"{analysis_queue_text}"
+    )
+    logger.info(f"Админ {user_id} запросил метрики вызовов OpenAI.")
+
+
+@admin_router.message(Command("reconcilestats"))
+async def cmd_reconcilestats(message: Message) -> None:
+    """
+    Обрабатывает команду /reconcilestats, пересчитывает счетчики статистики и показывает расхождения.
+    
+    Args:
+        message: Сообщение от пользователя
+    """
+    user_id = message.from_user.id
+    
+    # Проверяем, является ли пользователь администратором
+    if not is_admin(user_id):
+        await message.answer("У вас нет доступа к этой команде.")
+        return
+    
+    try:
+        result = await reconcile_stats()
+    except Exception:
+        await message.answer("Не удалось выполнить сверку счетчиков. Подробности в логах.")
+        return
+    
+    if result["drift"]:
+        drift_text = "\n".join(
+            f"- {item['counter']}: было {item['stored']}, стало {item['actual']}"
+            for item in result["drift"]
+        )
+        text = f"⚠️ Найдены и исправлены расхождения:\n{drift_text}"
+    else:
+        text = "✅ Счетчики совпадают с таблицей пользователей."
+    
+    await message.answer(f"🧮 Сверка статистики ({result['duration'] * 1000:.0f} мс)\n\n{text}")
+    logger.info(f"Админ {user_id} запустил сверку счетчиков статистики.")
+
+
 @admin_router.message(Command("broadcast"))
 async def cmd_broadcast(message: Message, state: FSMContext) -> None:
     """
@@ -96,8 +485,8 @@ async def cmd_broadcast(message: Message, state: FSMContext) -> None:
     
     await message.answer(f"Начинаю рассылку сообщения:\n\n{broadcast_text}")
     
-    # Заглушка для рассылки
-    # В реальном боте здесь должен быть код для отправки сообщения всем пользователям
+    # Создаем рассылку и запускаем ее в фоне: прогресс придет отдельным сообщением
+    broadcast = await db.create_broadcast(broadcast_text, message.chat.id)
+    start_broadcast(message.bot, broadcast)
     
-    await message.answer("Рассылка завершена успешно!")
-    logger.info(f"Админ {user_id} выполнил рассылку сообщения.") 
\ No newline at end of file
+    logger.info(f"Админ {user_id} запустил рассылку {broadcast['id']}.") 
\ No newline at end of file
@@ -2,16 +2,20 @@
 Обработчики для процесса онбординга пользователей.
 """
 import logging
-from aiogram import Router, F
+from typing import Any, Dict, Optional, Tuple
+from aiogram import Router, Bot, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
 
-from config import WELCOME_MESSAGE, ONBOARDING_QUESTIONS
+from config import WELCOME_MESSAGE, ONBOARDING_QUESTIONS, OPENAI_STREAMING
 from database import db
 from keyboards.reply import get_start_keyboard, get_onboarding_options_keyboard
 from keyboards.inline import get_tariff_selection_keyboard
+from services.analysis_queue import enqueue_analysis
 from services.openai_api import analyze_onboarding_answers
+from services.stream_message import StreamingMessage
 from utils.states import OnboardingStates
 
 # Инициализация логгера
@@ -232,46 +236,208 @@ async def process_current_tools(message: Message, state: FSMContext) -> None:
         answer=user_answer
     )
     
-    # Отправляем сообщение о том, что анализируем ответы
-    await message.answer(
+    # Отправляем сообщение о том, что анализируем ответы; в него же потом выводится рекомендация
+    status_message = await message.answer(
         "Спасибо за ваши ответы! Анализирую информацию и подбираю оптимальный тариф..."
     )
+    await state.update_data(status_message_id=status_message.message_id)
+    
+    # Анализ выполняется в фоновой очереди, обработчик апдейта сразу освобождается
+    await state.set_state(OnboardingStates.analyzing)
+    try:
+        await enqueue_analysis(message.from_user.id, message.chat.id, message.bot.id)
+    except Exception as e:
+        logger.error(f"Не удалось поставить анализ ответов пользователя {message.from_user.id} в очередь: {e}")
+        await send_recommendation(message.bot, state, message.chat.id, message.from_user.id)
+
+
+@onboarding_router.message(OnboardingStates.analyzing)
+async def process_while_analyzing(message: Message) -> None:
+    """
+    Отвечает на сообщения, пока ответы пользователя анализируются.
+    
+    Args:
+        message: Сообщение от пользователя
+    """
+    await message.answer("Я еще подбираю для вас тариф, это займет несколько секунд...")
+
+
+async def send_recommendation(bot: Bot, state: FSMContext, chat_id: int, user_id: int) -> None:
+    """
+    Анализирует ответы пользователя и отправляет рекомендацию с выбором тарифа.
+    
+    Рекомендация выводится в сообщение со статусом анализа: при потоковом
+    ответе OpenAI объяснение появляется в нем по мере генерации, а клавиатура
+    выбора тарифа добавляется, когда ответ получен целиком.
     
+    Args:
+        bot: Экземпляр бота для отправки сообщений
+        state: Контекст FSM пользователя
+        chat_id: ID чата с пользователем
+        user_id: ID пользователя
+    """
     # Получаем все ответы пользователя
-    user_answers = await db.get_user_answers(message.from_user.id)
+    user_answers = await db.get_user_answers(user_id)
+    
+    # Сообщение со статусом анализа, которое будет дополняться текстом рекомендации
+    data = await state.get_data()
+    status = StreamingMessage(bot, chat_id, data.get("status_message_id"))
+    
+    async def show_explanation(explanation: str) -> None:
+        status.update(f"Подбираю тариф...\n\n{explanation}…")
     
     # Анализируем ответы и получаем рекомендации по тарифам
-    tariff_data = await analyze_onboarding_answers(user_answers)
+    tariff_data = await analyze_onboarding_answers(
+        user_answers,
+        on_explanation=show_explanation if OPENAI_STREAMING else None
+    )
     
-    # Сохраняем данные о тарифах в FSM контекст
-    await state.update_data(tariff_data=tariff_data)
+    # Сохраняем рекомендацию в базу: кнопки выбора ссылаются на нее по ID
+    recommendation = None
+    if tariff_data:
+        try:
+            recommendation = await db.save_recommendation(user_id, tariff_data)
+        except Exception as e:
+            logger.error(f"Не удалось сохранить рекомендацию пользователю {user_id}: {e}")
     
     # Формируем сообщение с рекомендацией
-    if tariff_data:
-        tariff_names = [tariff["name"] for tariff in tariff_data["tariffs"]]
-        recommendation = tariff_data["recommendation"]
-        explanation = tariff_data["explanation"]
-        
-        message_text = (
-            f"Я рекомендую тариф «{recommendation}»!\n\n"
-            f"{explanation}\n\n"
-            "Выберите один из предложенных вариантов:"
+    if recommendation:
+        # Показываем рекомендацию с клавиатурой в сообщении со статусом
+        await status.finish(
+            _recommendation_text(recommendation),
+            reply_markup=get_tariff_selection_keyboard(recommendation["id"], recommendation["tariffs"])
         )
         
-        # Клавиатура для выбора тарифа
-        keyboard = get_tariff_selection_keyboard(tariff_names)
-        
-        # Отправляем сообщение с рекомендацией и клавиатурой
-        await message.answer(text=message_text, reply_markup=keyboard)
-        
         # Устанавливаем состояние выбора тарифа
         await state.set_state(OnboardingStates.tariff_selection)
     else:
         # Если произошла ошибка при анализе ответов
-        await message.answer(
-            "К сожалению, не удалось подобрать тариф на основе ваших ответов. "
-            "Пожалуйста, свяжитесь с менеджером для получения персональной консультации."
-        )
+        await _report_analysis_failure(status, state)
+
+
+async def _report_analysis_failure(status: StreamingMessage, state: FSMContext) -> None:
+    """
+    Сообщает пользователю, что подобрать тариф не удалось, и позволяет повторить анализ.
+    
+    Args:
+        status: Сообщение со статусом анализа
+        state: Контекст FSM пользователя
+    """
+    await status.finish(
+        "К сожалению, не удалось подобрать тариф на основе ваших ответов. "
+        "Пожалуйста, свяжитесь с менеджером для получения персональной консультации."
+    )
+    
+    # Возвращаемся к последнему вопросу, чтобы следующий ответ запустил анализ заново
+    await state.set_state(OnboardingStates.current_tools)
+
+
+def _recommendation_text(recommendation: Dict[str, Any]) -> str:
+    """
+    Формирует текст сообщения с рекомендацией тарифа.
+    
+    Args:
+        recommendation: Рекомендация из db.save_recommendation или db.get_recommendation
+        
+    Returns:
+        Текст сообщения
+    """
+    return (
+        f"Я рекомендую тариф «{recommendation['recommendation']}»!\n\n"
+        f"{recommendation['explanation']}\n\n"
+        "Выберите один из предложенных вариантов:"
+    )
+
+
+async def _get_offer(callback: CallbackQuery) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Находит рекомендацию и тариф по данным кнопки "prefix:ID рекомендации[:ID тарифа]".
+    
+    Рекомендация должна принадлежать нажавшему пользователю, а тариф -
+    входить в нее. Кнопки старого формата (с индексом тарифа) не распознаются.
+    
+    Args:
+        callback: Callback-запрос от нажатия на инлайн-кнопку
+        
+    Returns:
+        Рекомендация и тариф (None, если ID тарифа в кнопке нет или он не найден)
+    """
+    parts = callback.data.split(":")
+    try:
+        recommendation_id = int(parts[1])
+        tariff_id = int(parts[2]) if len(parts) > 2 else None
+    except (IndexError, ValueError):
+        return None, None
+    if parts[0] != "back_to_tariffs" and tariff_id is None:
+        return None, None
+    
+    recommendation = await db.get_recommendation(recommendation_id)
+    if not recommendation or recommendation["user_id"] != callback.from_user.id:
+        return None, None
+    
+    tariff = next((item for item in recommendation["tariffs"] if item["id"] == tariff_id), None)
+    return recommendation, tariff
+
+
+async def deliver_recommendation(bot: Bot, storage: BaseStorage, job: Dict[str, Any]) -> None:
+    """
+    Обработчик задачи из очереди анализа: отправляет рекомендацию пользователю.
+    
+    Если пользователь за время анализа начал онбординг заново, задача пропускается.
+    
+    Args:
+        bot: Экземпляр бота для отправки сообщений
+        storage: Хранилище FSM диспетчера
+        job: Задача из таблицы analysis_jobs
+    """
+    state = await _analyzing_state(storage, job)
+    if state is None:
+        logger.info(f"Пользователь {job['user_id']} уже вышел из анализа, рекомендация не отправлена.")
+        return
+    
+    await send_recommendation(bot, state, job["chat_id"], job["user_id"])
+
+
+async def fail_recommendation(bot: Bot, storage: BaseStorage, job: Dict[str, Any]) -> None:
+    """
+    Обработчик задачи, отброшенной после всех попыток: сообщает пользователю об ошибке.
+    
+    Без этого пользователь остался бы в состоянии анализа без ответа.
+    
+    Args:
+        bot: Экземпляр бота для отправки сообщений
+        storage: Хранилище FSM диспетчера
+        job: Задача из таблицы analysis_jobs
+    """
+    state = await _analyzing_state(storage, job)
+    if state is None:
+        return
+    
+    data = await state.get_data()
+    await _report_analysis_failure(StreamingMessage(bot, job["chat_id"], data.get("status_message_id")), state)
+
+
+async def _analyzing_state(storage: BaseStorage, job: Dict[str, Any]) -> Optional[FSMContext]:
+    """
+    Возвращает контекст FSM пользователя задачи, если он все еще ждет результата анализа.
+    
+    Args:
+        storage: Хранилище FSM диспетчера
+        job: Задача из таблицы analysis_jobs
+        
+    Returns:
+        Контекст FSM или None, если пользователь за время анализа начал онбординг заново
+    """
+    state = FSMContext(
+        storage=storage,
+        key=StorageKey(bot_id=job["bot_id"], chat_id=job["chat_id"], user_id=job["user_id"])
+    )
+    
+    # После перезапуска бота состояние в памяти может быть потеряно
+    current_state = await state.get_state()
+    if current_state not in (OnboardingStates.analyzing.state, None):
+        return None
+    return state
 
 
 @onboarding_router.callback_query(OnboardingStates.tariff_selection, F.data.startswith("select_tariff:"))
@@ -283,15 +449,17 @@ async def select_tariff(callback: CallbackQuery, state: FSMContext) -> None:
         callback: Callback-запрос от нажатия на инлайн-кнопку
         state: Контекст FSM
     """
-    # Получаем индекс выбранного тарифа
-    tariff_index = int(callback.data.split(":")[1])
-    
-    # Получаем данные о тарифах из FSM контекста
-    data = await state.get_data()
-    tariff_data = data.get("tariff_data")
-    
-    if tariff_data and tariff_index < len(tariff_data["tariffs"]):
-        selected_tariff = tariff_data["tariffs"][tariff_index]
+    # Получаем рекомендацию и выбранный тариф по ID из кнопки
+    recommendation, selected_tariff = await _get_offer(callback)
+    
+    if selected_tariff:
+        # Сохраняем выбор в рекомендации и тариф пользователя
+        try:
+            await db.select_recommended_tariff(recommendation["id"], selected_tariff["id"])
+            await db.update_user_tariff(callback.from_user.id, selected_tariff["id"])
+        except Exception:
+            await callback.answer("Не удалось сохранить выбор тарифа. Попробуйте еще раз.")
+            return
         
         # Отправляем сообщение о выбранном тарифе
         await callback.message.edit_text(
@@ -316,16 +484,10 @@ async def show_tariff_details(callback: CallbackQuery, state: FSMContext) -> Non
         callback: Callback-запрос от нажатия на инлайн-кнопку
         state: Контекст FSM
     """
-    # Получаем индекс выбранного тарифа
-    tariff_index = int(callback.data.split(":")[1])
+    # Получаем рекомендацию и тариф по ID из кнопки
+    recommendation, selected_tariff = await _get_offer(callback)
     
-    # Получаем данные о тарифах из FSM контекста
-    data = await state.get_data()
-    tariff_data = data.get("tariff_data")
-    
-    if tariff_data and tariff_index < len(tariff_data["tariffs"]):
-        selected_tariff = tariff_data["tariffs"][tariff_index]
-        
+    if selected_tariff:
         # Формируем список функций
         features_list = "\n".join([f"✅ {feature}" for feature in selected_tariff["features"]])
         
@@ -341,13 +503,13 @@ async def show_tariff_details(callback: CallbackQuery, state: FSMContext) -> Non
         from keyboards.inline import get_tariff_details_keyboard
         await callback.message.edit_text(
             text=details_text,
-            reply_markup=get_tariff_details_keyboard(tariff_index)
+            reply_markup=get_tariff_details_keyboard(recommendation["id"], selected_tariff["id"])
         )
     else:
         await callback.answer("Произошла ошибка при получении информации о тарифе. Попробуйте еще раз.")
 
 
-@onboarding_router.callback_query(OnboardingStates.tariff_selection, F.data == "back_to_tariffs")
+@onboarding_router.callback_query(OnboardingStates.tariff_selection, F.data.startswith("back_to_tariffs:"))
 async def back_to_tariffs(callback: CallbackQuery, state: FSMContext) -> None:
     """
     Возвращает пользователя к списку тарифов.
@@ -356,26 +518,15 @@ async def back_to_tariffs(callback: CallbackQuery, state: FSMContext) -> None:
         callback: Callback-запрос от нажатия на инлайн-кнопку
         state: Контекст FSM
     """
-    # Получаем данные о тарифах из FSM контекста
-    data = await state.get_data()
-    tariff_data = data.get("tariff_data")
+    # Получаем рекомендацию по ID из кнопки
+    recommendation, _ = await _get_offer(callback)
     
-    if tariff_data:
-        tariff_names = [tariff["name"] for tariff in tariff_data["tariffs"]]
-        recommendation = tariff_data["recommendation"]
-        explanation = tariff_data["explanation"]
-        
-        message_text = (
-            f"Я рекомендую тариф «{recommendation}»!\n\n"
-            f"{explanation}\n\n"
-            "Выберите один из предложенных вариантов:"
-        )
-        
-        # Клавиатура для выбора тарифа
-        keyboard = get_tariff_selection_keyboard(tariff_names)
-        
+    if recommendation:
         # Отправляем сообщение с рекомендацией и клавиатурой
-        await callback.message.edit_text(text=message_text, reply_markup=keyboard)
+        await callback.message.edit_text(
+            text=_recommendation_text(recommendation),
+            reply_markup=get_tariff_selection_keyboard(recommendation["id"], recommendation["tariffs"])
+        )
     else:
         await callback.answer("Произошла ошибка при возвращении к списку тарифов. Попробуйте заново.")
 
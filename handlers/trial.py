@@ -2,15 +2,19 @@
 Обработчики для управления триал-периодом.
 """
 import logging
-import asyncio
-import datetime
+from typing import Any, Dict, List, Optional
 from aiogram import Router, Bot, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 
-from config import REMINDER_DAYS_BEFORE
+from config import (
+    REMINDER_DAYS_BEFORE, TRIAL_SCHEDULER_HORIZON_HOURS, TRIAL_SCHEDULER_PAGE_SIZE,
+    TRIAL_SCHEDULER_BATCH_SIZE, NOTIFY_CONCURRENCY
+)
 from database import db
 from keyboards.inline import get_trial_ending_keyboard, get_trial_ended_keyboard
+from services.sender import MessageSender
+from services.trial_scheduler import TrialScheduler
 
 # Инициализация логгера
 logger = logging.getLogger(__name__)
@@ -50,88 +54,105 @@ async def remind_later(callback: CallbackQuery) -> None:
     await callback.answer()
 
 
-async def send_trial_ending_notification(bot: Bot) -> None:
+async def send_trial_ending_notification(bot: Bot, users: Optional[List[Dict[str, Any]]] = None) -> None:
     """
     Отправляет уведомления пользователям, у которых скоро закончится триал-период.
     
+    Уведомления отправляются параллельно (NOTIFY_CONCURRENCY отправителей)
+    с общим и поканальным ограничением скорости.
+    
     Args:
         bot: Экземпляр бота для отправки сообщений
+        users: Пользователи для уведомления; если не переданы, выбираются из базы
     """
     try:
         # Получаем пользователей, у которых заканчивается триал
-        users = await db.get_users_with_ending_trial(REMINDER_DAYS_BEFORE)
+        if users is None:
+            users = await db.get_users_with_ending_trial(REMINDER_DAYS_BEFORE)
+        
+        sender = MessageSender(bot)
+        
+        async def notify(user: Dict[str, Any]) -> str:
+            # Отправляем уведомление
+            outcome = await sender.send_message(
+                chat_id=user["chat_id"],
+                text=(
+                    "⚠️ Ваш триал-период заканчивается завтра!\n\n"
+                    "Чтобы продолжить пользоваться всеми функциями, "
+                    "пожалуйста, перейдите на платную версию."
+                ),
+                reply_markup=get_trial_ending_keyboard()
+            )
+            logger.info(f"Уведомление о скором окончании триала пользователю {user['user_id']}: {outcome}")
+            return outcome
         
-        for user in users:
-            try:
-                # Отправляем уведомление
-                await bot.send_message(
-                    chat_id=user["chat_id"],
-                    text=(
-                        "⚠️ Ваш триал-период заканчивается завтра!\n\n"
-                        "Чтобы продолжить пользоваться всеми функциями, "
-                        "пожалуйста, перейдите на платную версию."
-                    ),
-                    reply_markup=get_trial_ending_keyboard()
-                )
-                logger.info(f"Отправлено уведомление о скором окончании триала пользователю {user['user_id']}")
-            except Exception as e:
-                logger.error(f"Ошибка при отправке уведомления пользователю {user['user_id']}: {e}")
+        await sender.fan_out("trial_ending", users, notify, NOTIFY_CONCURRENCY)
     except Exception as e:
         logger.error(f"Ошибка при отправке уведомлений о скором окончании триала: {e}")
 
 
-async def handle_ended_trials(bot: Bot) -> None:
+async def handle_ended_trials(bot: Bot, users: Optional[List[Dict[str, Any]]] = None) -> None:
     """
     Обрабатывает пользователей, у которых закончился триал-период.
     
+    Все истекшие триалы завершаются одним запросом в одной транзакции, затем
+    уведомления отправляются параллельно (NOTIFY_CONCURRENCY отправителей)
+    с общим и поканальным ограничением скорости. Уведомление получают только
+    пользователи, которых завершил именно этот запуск, поэтому повторный
+    запуск не приводит к повторным уведомлениям.
+    
     Args:
         bot: Экземпляр бота для отправки сообщений
+        users: Пользователи с наступившим сроком окончания; если не переданы,
+            завершаются все истекшие триалы
     """
     try:
-        # Получаем пользователей, у которых закончился триал
-        users = await db.get_users_with_ended_trial()
+        # Завершаем триалы и получаем пользователей, которых это затронуло
+        user_ids = [user["user_id"] for user in users] if users is not None else None
+        expired_users = db.expire_ended_trials(user_ids)
+        
+        sender = MessageSender(bot)
         
-        for user in users:
-            try:
-                # Обновляем статус активности пользователя
-                await db.update_trial_status(user["user_id"], False)
-                
-                # Отправляем уведомление
-                await bot.send_message(
-                    chat_id=user["chat_id"],
-                    text=(
-                        "⚠️ Ваш триал-период закончился!\n\n"
-                        "Теперь доступ к функциям ограничен. "
-                        "Для продолжения использования всех возможностей системы, "
-                        "пожалуйста, перейдите на платную версию."
-                    ),
-                    reply_markup=get_trial_ended_keyboard()
-                )
-                logger.info(f"Отправлено уведомление о завершении триала пользователю {user['user_id']}")
-            except Exception as e:
-                logger.error(f"Ошибка при обработке завершения триала пользователя {user['user_id']}: {e}")
+        async def notify(user: Dict[str, Any]) -> str:
+            # Отправляем уведомление
+            outcome = await sender.send_message(
+                chat_id=user["chat_id"],
+                text=(
+                    "⚠️ Ваш триал-период закончился!\n\n"
+                    "Теперь доступ к функциям ограничен. "
+                    "Для продолжения использования всех возможностей системы, "
+                    "пожалуйста, перейдите на платную версию."
+                ),
+                reply_markup=get_trial_ended_keyboard()
+            )
+            logger.info(f"Уведомление о завершении триала пользователю {user['user_id']}: {outcome}")
+            return outcome
+        
+        await sender.fan_out("trial_ended", expired_users, notify, NOTIFY_CONCURRENCY)
     except Exception as e:
         logger.error(f"Ошибка при обработке пользователей с завершенным триалом: {e}")
 
 
 async def start_trial_checker(bot: Bot) -> None:
     """
-    Запускает периодическую проверку статуса триал-периодов.
+    Запускает планировщик событий триал-периода.
+    
+    Напоминания и окончания триалов срабатывают в момент наступления срока
+    каждого пользователя, а не раз в сутки.
     
     Args:
         bot: Экземпляр бота для отправки сообщений
     """
-    while True:
-        try:
-            # Проверяем заканчивающиеся триалы
-            await send_trial_ending_notification(bot)
-            
-            # Обрабатываем завершенные триалы
-            await handle_ended_trials(bot)
-            
-            # Делаем паузу до следующей проверки (раз в день)
-            await asyncio.sleep(86400)  # 24 часа в секундах
-        except Exception as e:
-            logger.error(f"Ошибка в процессе проверки триал-периодов: {e}")
-            # При ошибке делаем небольшую паузу и пробуем снова
-            await asyncio.sleep(3600)  # 1 час в секундах
\ No newline at end of file
+    scheduler = TrialScheduler(
+        on_reminder=lambda users: send_trial_ending_notification(bot, users),
+        on_expiry=lambda users: handle_ended_trials(bot, users),
+        reminder_offset=REMINDER_DAYS_BEFORE * 86400,
+        horizon=TRIAL_SCHEDULER_HORIZON_HOURS * 3600,
+        page_size=TRIAL_SCHEDULER_PAGE_SIZE,
+        batch_size=TRIAL_SCHEDULER_BATCH_SIZE
+    )
+    
+    # Новые пользователи и смена тарифа сразу попадают в планировщик
+    db.register_user_listener(scheduler.on_user_changed)
+    
+    await scheduler.run()
@@ -5,21 +5,24 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 
-def get_tariff_selection_keyboard(tariff_names: list) -> InlineKeyboardMarkup:
+def get_tariff_selection_keyboard(recommendation_id: int, tariffs: list) -> InlineKeyboardMarkup:
     """
     Создает инлайн-клавиатуру для выбора тарифа.
     
     Args:
-        tariff_names: Список названий тарифов
+        recommendation_id: ID рекомендации в таблице recommendations
+        tariffs: Предложенные тарифы (словари с полями id и name)
         
     Returns:
         InlineKeyboardMarkup: Клавиатура для выбора тарифа
     """
     builder = InlineKeyboardBuilder()
     
-    for i, name in enumerate(tariff_names):
-        builder.button(text=f"Выбрать «{name}»", callback_data=f"select_tariff:{i}")
-        builder.button(text=f"Подробнее о «{name}»", callback_data=f"tariff_details:{i}")
+    for tariff in tariffs:
+        builder.button(text=f"Выбрать «{tariff['name']}»",
+                       callback_data=f"select_tariff:{recommendation_id}:{tariff['id']}")
+        builder.button(text=f"Подробнее о «{tariff['name']}»",
+                       callback_data=f"tariff_details:{recommendation_id}:{tariff['id']}")
     
     builder.button(text="Связаться с менеджером", callback_data="contact_manager")
     
@@ -66,20 +69,21 @@ def get_trial_ended_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
-def get_tariff_details_keyboard(tariff_index: int) -> InlineKeyboardMarkup:
+def get_tariff_details_keyboard(recommendation_id: int, tariff_id: int) -> InlineKeyboardMarkup:
     """
     Создает инлайн-клавиатуру для просмотра подробностей о тарифе.
     
     Args:
-        tariff_index: Индекс выбранного тарифа
+        recommendation_id: ID рекомендации в таблице recommendations
+        tariff_id: ID выбранного тарифа
         
     Returns:
         InlineKeyboardMarkup: Клавиатура с кнопками выбора и возврата
     """
     builder = InlineKeyboardBuilder()
     
-    builder.button(text="Выбрать этот тариф", callback_data=f"select_tariff:{tariff_index}")
-    builder.button(text="Вернуться к списку тарифов", callback_data="back_to_tariffs")
+    builder.button(text="Выбрать этот тариф", callback_data=f"select_tariff:{recommendation_id}:{tariff_id}")
+    builder.button(text="Вернуться к списку тарифов", callback_data=f"back_to_tariffs:{recommendation_id}")
     builder.button(text="Связаться с менеджером", callback_data="contact_manager")
     
     # Устанавливаем по 1 кнопке в ряду
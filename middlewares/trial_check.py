@@ -1,11 +1,13 @@
 """
 Middleware для проверки триал-периода пользователей.
 """
-import datetime
+import time
+import asyncio
 import logging
-from typing import Any, Awaitable, Callable, Dict
+from typing import Any, Awaitable, Callable, Dict, Generator, Optional
 
 from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
 from aiogram.types import Message, CallbackQuery
 
 from database import db
@@ -13,12 +15,103 @@ from database import db
 # Инициализация логгера
 logger = logging.getLogger(__name__)
 
+# Имя флага обработчика, которому статус триала нужен до вызова
+TRIAL_CHECK_FLAG = "trial_check"
+
+
+class TrialStatus:
+    """
+    Ленивый статус триал-периода пользователя.
+
+    Ничего не читает из базы при создании. Проверка выполняется при первом
+    await и запоминается до конца обработки апдейта, повторные await
+    возвращают готовый результат.
+
+    Пример использования в обработчике:
+        async def handler(message: Message, trial_status: TrialStatus) -> None:
+            if await trial_status:
+                ...
+    """
+
+    def __init__(self, user_id: int) -> None:
+        """
+        Args:
+            user_id: ID пользователя в Telegram
+        """
+        self.user_id = user_id
+        self._task: Optional[asyncio.Task] = None
+
+    def __await__(self) -> Generator[Any, None, bool]:
+        return self.is_ended().__await__()
+
+    @property
+    def evaluated(self) -> bool:
+        """
+        Возвращает True, если статус уже был вычислен в рамках апдейта.
+        """
+        return self._task is not None and self._task.done()
+
+    async def is_ended(self) -> bool:
+        """
+        Проверяет, закончился ли триал-период пользователя.
+
+        Returns:
+            True, если триал закончился и тариф не выбран
+        """
+        # Одновременные ожидания разделяют одну проверку
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._evaluate())
+        return await asyncio.shield(self._task)
+
+    async def _evaluate(self) -> bool:
+        """
+        Загружает пользователя и вычисляет статус триала.
+
+        Returns:
+            True, если триал закончился и тариф не выбран
+        """
+        # Получаем информацию о пользователе
+        user = await db.get_user(self.user_id)
+
+        # Если пользователя нет в базе, ограничений нет
+        if not user:
+            return False
+
+        trial_ended = False
+
+        # Проверяем статус активности пользователя
+        if not user.get("is_active", True):
+            # Пользователь неактивен, проверяем причину
+            if user.get("tariff_id"):
+                # У пользователя есть тариф, активируем его
+                await db.update_trial_status(self.user_id, True)
+            else:
+                # Триал закончился, ограничиваем функционал
+                trial_ended = True
+
+        # Проверяем время окончания триала (epoch в секундах, без разбора строки)
+        trial_end_ts = user.get("trial_end_ts")
+        if trial_end_ts and user.get("is_active", True):
+            # Проверяем, закончился ли триал
+            if time.time() > trial_end_ts and not user.get("tariff_id"):
+                # Триал закончился и нет выбранного тарифа
+                # Устанавливаем пользователя неактивным
+                await db.update_trial_status(self.user_id, False)
+                trial_ended = True
+
+        return trial_ended
+
 
 class TrialMiddleware(BaseMiddleware):
     """
     Middleware для проверки статуса триал-периода пользователя.
+
+    В data передается ленивый объект TrialStatus под ключом "trial_status":
+    обращение к базе происходит только если обработчик его дожидается.
+    Обработчики с флагом trial_check (flags={"trial_check": True}) получают
+    статус заранее, в виде флага data["trial_ended"].
     """
-    
+
     async def __call__(
         self,
         handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
@@ -26,13 +119,13 @@ class TrialMiddleware(BaseMiddleware):
         data: Dict[str, Any]
     ) -> Any:
         """
-        Обрабатывает событие и проверяет статус триал-периода.
-        
+        Обрабатывает событие и передает обработчику статус триал-периода.
+
         Args:
             handler: Функция-обработчик события
             event: Сообщение или колбэк-запрос
             data: Словарь с данными события
-            
+
         Returns:
             Результат выполнения обработчика
         """
@@ -44,40 +137,15 @@ class TrialMiddleware(BaseMiddleware):
         else:
             # Для других типов событий пропускаем проверку
             return await handler(event, data)
-        
-        # Получаем информацию о пользователе
-        user = await db.get_user(user_id)
-        
-        # Если пользователя нет в базе, пропускаем проверку
-        if not user:
-            return await handler(event, data)
-        
-        # Проверяем статус активности пользователя
-        if not user.get("is_active", True):
-            # Пользователь неактивен, проверяем причину
-            if user.get("tariff_id"):
-                # У пользователя есть тариф, активируем его
-                await db.update_trial_status(user_id, True)
-            else:
-                # Триал закончился, ограничиваем функционал
-                # Добавляем флаг о закончившемся триале в data
-                data["trial_ended"] = True
-        
-        # Проверяем дату окончания триала
-        trial_end_date = user.get("trial_end_date")
-        if trial_end_date:
-            # Преобразуем строку в datetime
-            if isinstance(trial_end_date, str):
-                trial_end_date = datetime.datetime.fromisoformat(trial_end_date)
-            
-            # Проверяем, закончился ли триал
-            now = datetime.datetime.now()
-            if now > trial_end_date and not user.get("tariff_id"):
-                # Триал закончился и нет выбранного тарифа
-                # Устанавливаем пользователя неактивным
-                await db.update_trial_status(user_id, False)
+
+        trial_status = TrialStatus(user_id)
+        data["trial_status"] = trial_status
+
+        # Обработчик заявил, что статус нужен ему сразу
+        if get_flag(data, TRIAL_CHECK_FLAG):
+            if await trial_status:
                 # Добавляем флаг о закончившемся триале в data
                 data["trial_ended"] = True
-        
+
         # Вызываем следующий обработчик
-        return await handler(event, data) 
\ No newline at end of file
+        return await handler(event, data)
@@ -0,0 +1,91 @@
+"""
+Офлайн-оценка кэша рекомендаций по похожим ответам.
+
+Рекомендации OpenAI из таблицы recommendation_cache проигрываются в порядке
+создания: для каждого набора ответов ищется самый похожий из более ранних
+(с теми же вариантами ответов), после чего набор добавляется в индекс, как
+это происходит в боте. Для каждого порога похожести печатаются:
+- доля попаданий - сколько запросов к OpenAI кэш заменил бы;
+- согласие - в какой доле попаданий рекомендованный тариф совпал бы
+  с тем, что для этих ответов на самом деле рекомендовал OpenAI.
+
+Запуск:
+    python scripts/eval_semantic_cache.py --db database/bot.db --thresholds 0.7 0.8 0.9
+"""
+import sys
+import json
+import sqlite3
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services.semantic_cache import SemanticIndex
+
+
+def load_rows(db_path: str, fingerprint: str = None) -> list:
+    """
+    Читает рекомендации одной версии промпта (по умолчанию - последней) в порядке создания.
+    """
+    connection = sqlite3.connect(db_path)
+    connection.row_factory = sqlite3.Row
+    try:
+        if fingerprint is None:
+            row = connection.execute(
+                "SELECT fingerprint FROM recommendation_cache ORDER BY created_at DESC LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return []
+            fingerprint = row["fingerprint"]
+        print(f"Версия промпта: {fingerprint}")
+        return connection.execute(
+            "SELECT answers, result, created_at FROM recommendation_cache "
+            "WHERE fingerprint = ? ORDER BY created_at",
+            (fingerprint,)
+        ).fetchall()
+    finally:
+        connection.close()
+
+
+def same_recommendation(first: dict, second: dict) -> bool:
+    """
+    Сравнивает рекомендованные тарифы без учета регистра и пробелов.
+    """
+    return first["recommendation"].strip().lower() == second["recommendation"].strip().lower()
+
+
+def main(args: argparse.Namespace) -> None:
+    rows = load_rows(args.db, args.fingerprint)
+    if not rows:
+        print("В таблице recommendation_cache нет рекомендаций для оценки.")
+        return
+
+    index = SemanticIndex(max_entries=args.max_entries)
+    # Для каждого набора ответов: похожесть ближайшего соседа и совпадение рекомендаций
+    matches = []
+    for row in rows:
+        answers = json.loads(row["answers"])
+        result = json.loads(row["result"])
+        found = index.nearest(answers)
+        if found is not None:
+            similarity, entry = found
+            matches.append((similarity, same_recommendation(entry.result, result)))
+        index.add(answers, result, row["created_at"])
+
+    print(f"Наборов ответов: {len(rows)}, с соседом по тем же вариантам ответов: {len(matches)}")
+    print(f"{'порог':>6}  {'попаданий':>10}  {'доля':>7}  {'согласие':>9}")
+    for threshold in sorted(args.thresholds):
+        hits = [agree for similarity, agree in matches if similarity >= threshold]
+        agreement = sum(hits) / len(hits) if hits else 0.0
+        print(f"{threshold:6.2f}  {len(hits):10d}  {len(hits) / len(rows) * 100:6.1f}%  {agreement * 100:8.1f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=str(Path(__file__).resolve().parent.parent / "database" / "bot.db"),
+                        help="Путь к базе данных бота")
+    parser.add_argument("--fingerprint", default=None, help="Версия промпта (по умолчанию - последняя)")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.6, 0.7, 0.8, 0.85, 0.9, 0.95],
+                        help="Пороги похожести для оценки")
+    parser.add_argument("--max-entries", type=int, default=20000, help="Максимум наборов ответов в индексе")
+    main(parser.parse_args())
@@ -0,0 +1,115 @@
+"""
+Проигрывание записанных апдейтов на webhook-сервер бота (BOT_MODE=webhook).
+
+Апдейты читаются из файла в одном из форматов:
+- ответ getUpdates целиком: {"ok": true, "result": [...]};
+- JSON-массив апдейтов;
+- по одному апдейту в строке (JSON Lines).
+
+Записать апдейты можно, остановив бота и выполнив
+    curl "https://api.telegram.org/bot<TOKEN>/getUpdates" > updates.json
+Бот отвечает на проигранные апдейты настоящими сообщениями, поэтому
+используйте апдейты из своих чатов.
+
+Каждый апдейт отправляется POST-запросом с заголовком
+X-Telegram-Bot-Api-Secret-Token, как это делает Telegram, не более
+--concurrency запросов одновременно. Печатаются коды ответов, время
+ответа сервера и пропускная способность приема.
+
+Запуск (сервер запущен с WEBHOOK_SECRET из .env):
+    python scripts/replay_updates.py updates.json --repeat 100 --concurrency 40
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+from collections import Counter
+from pathlib import Path
+
+import aiohttp
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from config import WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+from services.webhook import SECRET_HEADER
+
+
+def load_updates(path: str) -> list:
+    """
+    Читает апдейты из файла.
+    """
+    text = Path(path).read_text(encoding="utf-8")
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        # JSON Lines: по апдейту в строке
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(data, dict):
+        return data["result"] if "result" in data else [data]
+    return data
+
+
+def expand(updates: list, repeat: int) -> list:
+    """
+    Повторяет апдейты repeat раз с новыми update_id, сохраняя порядок внутри каждого повтора.
+    """
+    first_id = max(update["update_id"] for update in updates) + 1
+    result = []
+    for number in range(repeat):
+        for update in updates:
+            copy = dict(update)
+            if number:
+                copy["update_id"] = first_id + len(result)
+            result.append(copy)
+    return result
+
+
+async def main(args: argparse.Namespace) -> None:
+    updates = load_updates(args.file)
+    if not updates:
+        print("В файле нет апдейтов.")
+        return
+    updates = expand(updates, args.repeat)
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    statuses: Counter = Counter()
+    timings = []
+    headers = {SECRET_HEADER: args.secret, "Content-Type": "application/json"}
+
+    async def post(session: aiohttp.ClientSession, update: dict) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                async with session.post(args.url, data=json.dumps(update), headers=headers) as response:
+                    await response.read()
+                    statuses[response.status] += 1
+            except aiohttp.ClientError as e:
+                statuses[type(e).__name__] += 1
+            timings.append(time.perf_counter() - started)
+
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(post(session, update) for update in updates))
+        wall = time.perf_counter() - started
+
+    timings.sort()
+    print(f"Отправлено апдейтов: {len(updates)} на {args.url}")
+    print("Коды ответов: " + ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items(), key=str)))
+    print(
+        f"Ответ сервера: среднее {statistics.mean(timings) * 1000:.2f} мс, "
+        f"p95 {timings[int(len(timings) * 0.95) - 1] * 1000:.2f} мс, максимум {timings[-1] * 1000:.2f} мс"
+    )
+    print(f"Пропускная способность приема: {len(updates) / wall:.1f} апд/с")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("file", help="Файл с записанными апдейтами")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}", help="Адрес webhook-сервера")
+    parser.add_argument("--secret", default=WEBHOOK_SECRET, help="Секрет (по умолчанию WEBHOOK_SECRET)")
+    parser.add_argument("--concurrency", type=int, default=40, help="Одновременных запросов (у Telegram до 100)")
+    parser.add_argument("--repeat", type=int, default=1, help="Сколько раз проиграть апдейты (с новыми update_id)")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,147 @@
+"""
+Обучение локальной модели подбора тарифа на рекомендациях OpenAI.
+
+Примеры берутся из таблицы recommendation_cache одной версии промпта
+(по умолчанию - последней): ответы пользователя и тариф, который
+рекомендовал OpenAI (только тарифы бота). Тексты объяснений OpenAI
+в модель не попадают: бот формирует объяснение по шаблону. Модель
+обучается на части примеров, на отложенной части печатается отчет
+о точности:
+- точность на всех примерах и у самого частого класса (базовый уровень);
+- для каждого порога уверенности - доля примеров, где модель заменила бы
+  вызов OpenAI, и точность на них;
+- точность и полнота по каждому тарифу.
+Затем модель обучается на всех примерах и сохраняется в файл .npz.
+
+Запуск:
+    python scripts/train_distilled_model.py --db database/bot.db --output database/distilled_model.npz
+"""
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from config import DISTILLED_MODEL_PATH
+from services.distilled_model import DistilledModel
+from services.tariff_scorer import tariff_data_for
+
+
+def load_examples(db_path: str, fingerprint: str = None) -> tuple:
+    """
+    Читает пары (ответы, рекомендованный тариф) одной версии промпта в порядке создания.
+
+    Returns:
+        Версия промпта, примеры и количество примеров с тарифами, которых нет среди тарифов бота
+    """
+    connection = sqlite3.connect(db_path)
+    connection.row_factory = sqlite3.Row
+    try:
+        if fingerprint is None:
+            row = connection.execute(
+                "SELECT fingerprint FROM recommendation_cache ORDER BY created_at DESC LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None, [], 0
+            fingerprint = row["fingerprint"]
+        rows = connection.execute(
+            "SELECT answers, result FROM recommendation_cache WHERE fingerprint = ? ORDER BY created_at",
+            (fingerprint,)
+        ).fetchall()
+    finally:
+        connection.close()
+
+    examples = []
+    skipped = 0
+    for row in rows:
+        result = json.loads(row["result"])
+        tariff_data = tariff_data_for(str(result.get("recommendation", "")))
+        if tariff_data is None:
+            skipped += 1
+            continue
+        examples.append((json.loads(row["answers"]), tariff_data["recommendation"]))
+    return fingerprint, examples, skipped
+
+
+def report(model: DistilledModel, test: list, thresholds: list) -> None:
+    """
+    Печатает отчет о точности модели на отложенных примерах.
+    """
+    predictions = []
+    started = time.perf_counter()
+    for answers, label in test:
+        index, confidence = model.predict(answers)
+        predictions.append((model.classes[index], confidence, label))
+    inference_ms = (time.perf_counter() - started) / len(test) * 1000
+
+    correct = sum(predicted == label for predicted, _, label in predictions)
+    majority = Counter(label for _, label in test).most_common(1)[0][1]
+    print(f"Отложенных примеров: {len(test)}")
+    print(f"Точность: {correct / len(test) * 100:.1f}% (самый частый тариф: {majority / len(test) * 100:.1f}%)")
+    print(f"Среднее время предсказания: {inference_ms:.3f} мс")
+
+    print(f"\n{'порог':>6}  {'без OpenAI':>10}  {'точность':>9}")
+    for threshold in sorted(thresholds):
+        confident = [(predicted, label) for predicted, confidence, label in predictions if confidence >= threshold]
+        accuracy = sum(predicted == label for predicted, label in confident) / len(confident) if confident else 0.0
+        print(f"{threshold:6.2f}  {len(confident) / len(test) * 100:9.1f}%  {accuracy * 100:8.1f}%")
+
+    print(f"\n{'тариф':<24}  {'примеров':>8}  {'точность':>9}  {'полнота':>8}")
+    for name in model.classes:
+        predicted_as = [label for predicted, _, label in predictions if predicted == name]
+        actual = [predicted for predicted, _, label in predictions if label == name]
+        precision = sum(label == name for label in predicted_as) / len(predicted_as) if predicted_as else 0.0
+        recall = sum(predicted == name for predicted in actual) / len(actual) if actual else 0.0
+        print(f"{name[:24]:<24}  {len(actual):8d}  {precision * 100:8.1f}%  {recall * 100:7.1f}%")
+
+
+def main(args: argparse.Namespace) -> None:
+    fingerprint, examples, skipped = load_examples(args.db, args.fingerprint)
+    if skipped:
+        print(f"Пропущено примеров с тарифами, которых нет среди тарифов бота: {skipped}")
+    counts = Counter(label for _, label in examples)
+    examples = [(answers, label) for answers, label in examples if counts[label] >= args.min_class_examples]
+    if len({label for _, label in examples}) < 2:
+        print("Недостаточно примеров: нужно хотя бы два тарифа по --min-class-examples примеров.")
+        return
+
+    print(f"Версия промпта: {fingerprint}, примеров: {len(examples)}")
+    print(", ".join(f"{label}: {count}" for label, count in counts.most_common() if count >= args.min_class_examples))
+
+    random.Random(args.seed).shuffle(examples)
+    test_size = max(1, int(len(examples) * args.test_share))
+    test, train = examples[:test_size], examples[test_size:]
+
+    training = dict(epochs=args.epochs, learning_rate=args.learning_rate, l2=args.l2, seed=args.seed)
+    started = time.perf_counter()
+    model = DistilledModel.train(train, fingerprint, **training)
+    print(f"Обучение на {len(train)} примерах: {time.perf_counter() - started:.1f} с\n")
+    report(model, test, args.thresholds)
+
+    # Итоговая модель обучается на всех примерах
+    model = DistilledModel.train(examples, fingerprint, **training)
+    output = Path(args.output)
+    model.save(output)
+    print(f"\nМодель сохранена в {output} ({output.stat().st_size / 1024:.1f} КБ)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=str(Path(__file__).resolve().parent.parent / "database" / "bot.db"),
+                        help="Путь к базе данных бота")
+    parser.add_argument("--output", default=str(DISTILLED_MODEL_PATH), help="Путь к файлу модели")
+    parser.add_argument("--fingerprint", default=None, help="Версия промпта (по умолчанию - последняя)")
+    parser.add_argument("--test-share", type=float, default=0.2, help="Доля отложенных примеров для отчета")
+    parser.add_argument("--min-class-examples", type=int, default=5, help="Минимум примеров тарифа для обучения")
+    parser.add_argument("--epochs", type=int, default=100, help="Количество проходов по данным")
+    parser.add_argument("--learning-rate", type=float, default=0.5, help="Шаг градиентного спуска")
+    parser.add_argument("--l2", type=float, default=1e-4, help="Коэффициент L2-регуляризации")
+    parser.add_argument("--seed", type=int, default=0, help="Зерно генератора случайных чисел")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.5, 0.7, 0.8, 0.9, 0.95],
+                        help="Пороги уверенности для отчета")
+    main(parser.parse_args())
@@ -0,0 +1,243 @@
+"""
+Фоновая очередь анализа ответов онбординга с сохранением задач в SQLite.
+"""
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from config import ANALYSIS_WORKERS, ANALYSIS_MAX_ATTEMPTS
+from database import db
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+
+# Задержка перед повтором задачи после ошибки, в секундах
+RETRY_DELAY_SECONDS = 5.0
+
+# Обработчик задачи: получает словарь с данными задачи из таблицы analysis_jobs
+JobHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class AnalysisQueue:
+    """
+    Очередь задач анализа ответов с пулом обработчиков.
+
+    Задача сначала записывается в таблицу analysis_jobs, затем попадает
+    в очередь в памяти; после выполнения строка удаляется. При старте
+    очередь заново подхватывает оставшиеся в таблице задачи, поэтому
+    анализ, не законченный до перезапуска бота, будет выполнен.
+    """
+
+    def __init__(
+        self,
+        handler: JobHandler,
+        workers: int = ANALYSIS_WORKERS,
+        max_attempts: int = ANALYSIS_MAX_ATTEMPTS,
+        owns: Optional[Callable[[int], bool]] = None,
+        on_failure: Optional[JobHandler] = None
+    ) -> None:
+        """
+        Args:
+            handler: Обработчик задачи
+            workers: Количество параллельных обработчиков
+            max_attempts: Максимальное количество попыток выполнения задачи
+            owns: Проверка, что задачи пользователя выполняет этот процесс
+                (при запуске через supervisor.py); None - все задачи
+            on_failure: Обработчик задачи, отброшенной после max_attempts попыток
+        """
+        self.handler = handler
+        self.on_failure = on_failure
+        self.owns = owns
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+
+        # Счетчики
+        self.enqueued = 0
+        self.completed = 0
+        self.retried = 0
+        self.dropped = 0
+        self.in_progress = 0
+        self._total_latency = 0.0
+        self._max_latency = 0.0
+
+    async def start(self) -> None:
+        """
+        Подхватывает задачи, оставшиеся в базе, и запускает обработчики.
+        """
+        pending = await db.get_pending_analysis_jobs()
+        if self.owns is not None:
+            pending = [job for job in pending if self.owns(job["user_id"])]
+        for job in pending:
+            job["enqueued_at"] = time.monotonic()
+            self._queue.put_nowait(job)
+        if pending:
+            logger.info(f"Возобновлено {len(pending)} задач анализа ответов.")
+
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        """
+        Останавливает обработчики; незавершенные задачи остаются в базе.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def enqueue(self, user_id: int, chat_id: int, bot_id: int) -> bool:
+        """
+        Добавляет задачу анализа ответов пользователя.
+
+        Args:
+            user_id: ID пользователя
+            chat_id: ID чата с пользователем
+            bot_id: ID бота
+
+        Returns:
+            True, если задача добавлена; False, если задача пользователя уже в очереди
+        """
+        job = await db.enqueue_analysis_job(user_id, chat_id, bot_id)
+        if job is None:
+            return False
+
+        self.enqueued += 1
+        job["enqueued_at"] = time.monotonic()
+        self._queue.put_nowait(job)
+        return True
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Возвращает метрики очереди.
+
+        Returns:
+            Словарь с глубиной очереди, счетчиками задач и временем от постановки
+            в очередь (или от запуска бота для возобновленных задач) до выполнения
+        """
+        return {
+            "depth": self._queue.qsize(),
+            "in_progress": self.in_progress,
+            "workers": self.workers,
+            "enqueued": self.enqueued,
+            "completed": self.completed,
+            "retried": self.retried,
+            "dropped": self.dropped,
+            "avg_latency": self._total_latency / self.completed if self.completed else 0.0,
+            "max_latency": self._max_latency
+        }
+
+    async def _worker(self) -> None:
+        """
+        Обработчик: берет задачи из очереди и выполняет их.
+        """
+        while True:
+            job = await self._queue.get()
+            self.in_progress += 1
+            try:
+                await self._process(job)
+            except Exception as e:
+                logger.error(f"Ошибка в обработчике очереди анализа: {e}")
+            finally:
+                self.in_progress -= 1
+                self._queue.task_done()
+
+    async def _process(self, job: Dict[str, Any]) -> None:
+        """
+        Выполняет одну задачу, при ошибке повторяет ее позже.
+        """
+        attempts = await db.start_analysis_job(job["id"])
+        if attempts == 0:
+            # Задача уже выполнена и удалена
+            return
+
+        try:
+            await self.handler(job)
+        except Exception as e:
+            if attempts >= self.max_attempts:
+                logger.error(
+                    f"Задача анализа {job['id']} пользователя {job['user_id']} "
+                    f"отброшена после {attempts} попыток: {e}"
+                )
+                self.dropped += 1
+                await db.delete_analysis_job(job["id"])
+                if self.on_failure is not None:
+                    await self.on_failure(job)
+                return
+
+            logger.warning(f"Ошибка в задаче анализа {job['id']} (попытка {attempts}), повторим позже: {e}")
+            self.retried += 1
+            asyncio.get_running_loop().call_later(RETRY_DELAY_SECONDS, self._queue.put_nowait, job)
+            return
+
+        await db.delete_analysis_job(job["id"])
+        latency = time.monotonic() - job["enqueued_at"]
+        self.completed += 1
+        self._total_latency += latency
+        self._max_latency = max(self._max_latency, latency)
+
+
+# Очередь создается при запуске бота в start_analysis_queue()
+_analysis_queue: Optional[AnalysisQueue] = None
+
+
+async def start_analysis_queue(
+    handler: JobHandler,
+    owns: Optional[Callable[[int], bool]] = None,
+    on_failure: Optional[JobHandler] = None
+) -> AnalysisQueue:
+    """
+    Создает и запускает очередь анализа ответов.
+
+    Args:
+        handler: Обработчик задачи
+        owns: Проверка, что задачи пользователя выполняет этот процесс (None - все задачи)
+        on_failure: Обработчик задачи, отброшенной после всех попыток
+
+    Returns:
+        Запущенная очередь
+    """
+    global _analysis_queue
+
+    _analysis_queue = AnalysisQueue(handler, owns=owns, on_failure=on_failure)
+    await _analysis_queue.start()
+    return _analysis_queue
+
+
+async def stop_analysis_queue() -> None:
+    """
+    Останавливает очередь анализа ответов.
+    """
+    if _analysis_queue is not None:
+        await _analysis_queue.stop()
+
+
+async def enqueue_analysis(user_id: int, chat_id: int, bot_id: int) -> bool:
+    """
+    Ставит анализ ответов пользователя в очередь.
+
+    Args:
+        user_id: ID пользователя
+        chat_id: ID чата с пользователем
+        bot_id: ID бота
+
+    Returns:
+        True, если задача добавлена; False, если задача пользователя уже в очереди
+
+    Raises:
+        RuntimeError: Очередь не запущена
+    """
+    if _analysis_queue is None:
+        raise RuntimeError("Очередь анализа ответов не запущена")
+    return await _analysis_queue.enqueue(user_id, chat_id, bot_id)
+
+
+def get_analysis_queue_metrics() -> Optional[Dict[str, Any]]:
+    """
+    Возвращает метрики очереди анализа ответов.
+
+    Returns:
+        Словарь с метриками или None, если очередь не запущена
+    """
+    return _analysis_queue.get_metrics() if _analysis_queue is not None else None
@@ -0,0 +1,224 @@
+"""
+Движок рассылки сообщений всем пользователям бота.
+"""
+import time
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Set
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+
+from config import BROADCAST_WORKERS, BROADCAST_PAGE_SIZE, BROADCAST_PROGRESS_INTERVAL
+from database import db
+from services.sender import BLOCKED, SENT, MessageSender
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+
+# Запущенные рассылки (ссылки на задачи, чтобы их не собрал сборщик мусора)
+_running_tasks: Set[asyncio.Task] = set()
+
+
+class BroadcastEngine:
+    """
+    Рассылка с ограничением скорости и возобновлением после перезапуска.
+
+    Получатели читаются из users страницами по ключу user_id, без загрузки
+    всей таблицы. Страница раздается пулу отправителей, которые отправляют
+    через MessageSender с общим лимитом скорости бота. После каждой страницы
+    прогресс сохраняется в таблицу broadcasts, поэтому после сбоя рассылка
+    продолжается с последней сохраненной страницы. Админ получает отчет о
+    скорости и оставшемся времени, который периодически обновляется.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        broadcast: Dict[str, Any],
+        sender: Optional[MessageSender] = None,
+        workers: int = BROADCAST_WORKERS,
+        page_size: int = BROADCAST_PAGE_SIZE,
+        progress_interval: float = BROADCAST_PROGRESS_INTERVAL
+    ) -> None:
+        """
+        Args:
+            bot: Экземпляр бота для отправки сообщений
+            broadcast: Запись рассылки из таблицы broadcasts
+            sender: Отправитель сообщений (по умолчанию с общими лимитами бота)
+            workers: Количество параллельных отправителей
+            page_size: Количество получателей на страницу
+            progress_interval: Период обновления отчета админу в секундах
+        """
+        self.bot = bot
+        self.broadcast = broadcast
+        self.sender = sender or MessageSender(bot)
+        self.workers = max(1, workers)
+        self.page_size = max(1, page_size)
+        self.progress_interval = progress_interval
+
+        self.sent = broadcast["sent"]
+        self.failed = broadcast["failed"]
+        self.blocked = broadcast["blocked"]
+        self._processed_at_start = self.processed
+        self._started_at = time.monotonic()
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._status_message_id: Optional[int] = None
+
+    @property
+    def processed(self) -> int:
+        """
+        Количество получателей, которым отправка уже выполнена (успешно или нет).
+        """
+        return self.sent + self.failed + self.blocked
+
+    async def run(self) -> None:
+        """
+        Выполняет рассылку до конца списка получателей.
+        """
+        broadcast_id = self.broadcast["id"]
+        last_user_id = self.broadcast["last_user_id"]
+
+        await self._report(final=False)
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        reporter = asyncio.create_task(self._reporter())
+        try:
+            while True:
+                recipients = await db.get_broadcast_recipients(last_user_id, self.page_size)
+                if not recipients:
+                    break
+
+                for recipient in recipients:
+                    self._queue.put_nowait(recipient)
+                await self._queue.join()
+
+                last_user_id = recipients[-1]["user_id"]
+                await db.update_broadcast_progress(
+                    broadcast_id, last_user_id, self.sent, self.failed, self.blocked
+                )
+
+            await db.finish_broadcast(broadcast_id)
+        finally:
+            reporter.cancel()
+            for worker in workers:
+                worker.cancel()
+
+        await self._report(final=True)
+        logger.info(
+            f"Рассылка {broadcast_id} завершена: отправлено {self.sent}, "
+            f"ошибок {self.failed}, заблокировали бота {self.blocked}."
+        )
+
+    async def _worker(self) -> None:
+        """
+        Отправитель: берет получателей из очереди и отправляет им сообщение.
+        """
+        while True:
+            recipient = await self._queue.get()
+            try:
+                await self._send(recipient)
+            except Exception as e:
+                # Неожиданная ошибка не должна останавливать отправителя: иначе рассылка зависнет
+                self.failed += 1
+                logger.error(f"Ошибка при отправке рассылки пользователю {recipient.get('user_id')}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _send(self, recipient: Dict[str, Any]) -> None:
+        """
+        Отправляет сообщение одному получателю и учитывает результат.
+        """
+        outcome = await self.sender.send_message(chat_id=recipient["chat_id"], text=self.broadcast["text"])
+        if outcome == SENT:
+            self.sent += 1
+        elif outcome == BLOCKED:
+            self.blocked += 1
+        else:
+            self.failed += 1
+
+    async def _reporter(self) -> None:
+        """
+        Периодически обновляет отчет о прогрессе у администратора.
+        """
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            await self._report(final=False)
+
+    async def _report(self, final: bool) -> None:
+        """
+        Отправляет или обновляет сообщение админу с прогрессом рассылки.
+        """
+        total = max(self.broadcast["total"], self.processed)
+        elapsed = time.monotonic() - self._started_at
+        rate = (self.processed - self._processed_at_start) / elapsed if elapsed > 0 else 0.0
+        remaining = max(total - self.processed, 0)
+
+        if final:
+            header = f"✅ Рассылка #{self.broadcast['id']} завершена"
+            eta_text = ""
+        else:
+            header = f"📨 Рассылка #{self.broadcast['id']} выполняется"
+            eta_text = f"\nОсталось примерно: {_format_duration(remaining / rate)}" if rate > 0 else ""
+
+        text = (
+            f"{header}\n\n"
+            f"Обработано: {self.processed} из {total}\n"
+            f"Отправлено: {self.sent}, ошибок: {self.failed}, заблокировали бота: {self.blocked}\n"
+            f"Скорость: {rate:.1f} сообщ./с"
+            f"{eta_text}"
+        )
+
+        chat_id = self.broadcast["admin_chat_id"]
+        try:
+            if self._status_message_id is None:
+                message = await self.bot.send_message(chat_id=chat_id, text=text)
+                self._status_message_id = message.message_id
+            else:
+                await self.bot.edit_message_text(
+                    text=text, chat_id=chat_id, message_id=self._status_message_id
+                )
+        except TelegramAPIError as e:
+            logger.warning(f"Не удалось обновить отчет о рассылке {self.broadcast['id']}: {e}")
+
+
+def _format_duration(seconds: float) -> str:
+    """
+    Форматирует длительность в виде ЧЧ:ММ:СС.
+    """
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def start_broadcast(bot: Bot, broadcast: Dict[str, Any]) -> asyncio.Task:
+    """
+    Запускает рассылку в фоновой задаче.
+
+    Args:
+        bot: Экземпляр бота для отправки сообщений
+        broadcast: Запись рассылки из таблицы broadcasts
+
+    Returns:
+        Задача, выполняющая рассылку
+    """
+    async def run() -> None:
+        try:
+            await BroadcastEngine(bot, broadcast).run()
+        except Exception as e:
+            logger.error(f"Рассылка {broadcast['id']} прервана ошибкой: {e}")
+
+    task = asyncio.create_task(run())
+    _running_tasks.add(task)
+    task.add_done_callback(_running_tasks.discard)
+    return task
+
+
+async def resume_broadcasts(bot: Bot) -> None:
+    """
+    Возобновляет рассылки, прерванные остановкой бота.
+
+    Args:
+        bot: Экземпляр бота для отправки сообщений
+    """
+    for broadcast in await db.get_unfinished_broadcasts():
+        logger.info(f"Возобновляем рассылку {broadcast['id']} после пользователя {broadcast['last_user_id']}.")
+        start_broadcast(bot, broadcast)
@@ -0,0 +1,355 @@
+"""
+Локальная модель подбора тарифа, обученная на рекомендациях OpenAI.
+"""
+import os
+import time
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from config import ONBOARDING_QUESTIONS, DISTILLED_MODEL_PATH, DISTILLED_MODEL_THRESHOLD
+from services.recommendation_cache import normalize_text
+from services.semantic_cache import FREE_TEXT_QUESTIONS, SparseVector, vectorize
+from services.tariff_scorer import tariff_data_for
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+
+# Версия набора признаков: модель с другой версией не загружается
+FEATURE_VERSION = 1
+
+# Размерность хэшированных признаков одного свободного ответа
+TEXT_DIMENSIONS = 2 ** 10
+
+# Вопросы с вариантами ответов и нормализованные варианты
+OPTION_QUESTIONS: List[Tuple[int, List[str]]] = [
+    (question["id"], [normalize_text(option) for option in question["options"]])
+    for question in ONBOARDING_QUESTIONS if question["type"] == "options"
+]
+
+
+def _feature_layout() -> Tuple[Dict[int, int], Dict[int, int], int]:
+    """
+    Вычисляет смещения признаков вопросов в векторе.
+
+    У каждого вопроса с вариантами есть слот "другой ответ", у каждого
+    свободного ответа - TEXT_DIMENSIONS хэшированных признаков.
+
+    Returns:
+        Смещения вопросов с вариантами, смещения свободных ответов и общее количество признаков
+    """
+    offset = 0
+    option_offsets = {}
+    for question_id, options in OPTION_QUESTIONS:
+        option_offsets[question_id] = offset
+        offset += len(options) + 1
+    text_offsets = {}
+    for question_id in sorted(FREE_TEXT_QUESTIONS):
+        text_offsets[question_id] = offset
+        offset += TEXT_DIMENSIONS
+    return option_offsets, text_offsets, offset
+
+
+_OPTION_OFFSETS, _TEXT_OFFSETS, FEATURES = _feature_layout()
+
+
+def encode(answers: List[Any]) -> SparseVector:
+    """
+    Кодирует ответы в разреженный вектор признаков.
+
+    Варианты ответов кодируются one-hot (неизвестный вариант - отдельный
+    слот), свободные ответы - хэшированными словами и n-граммами,
+    нормированными по длине.
+
+    Args:
+        answers: Ответы из db.get_user_answers или пары [id, текст] из normalize_answers
+
+    Returns:
+        Номера признаков и их значения
+    """
+    indices: List[np.ndarray] = []
+    values: List[np.ndarray] = []
+    by_question = {}
+    for answer in answers:
+        question_id, text = (answer["id"], answer["answer"]) if isinstance(answer, dict) else answer
+        by_question[question_id] = normalize_text(text)
+
+    for question_id, options in OPTION_QUESTIONS:
+        text = by_question.get(question_id, "")
+        slot = options.index(text) if text in options else len(options)
+        indices.append(np.array([_OPTION_OFFSETS[question_id] + slot], dtype=np.int32))
+        values.append(np.ones(1, dtype=np.float32))
+
+    for question_id, offset in _TEXT_OFFSETS.items():
+        text_indices, text_values = vectorize(by_question.get(question_id, ""), TEXT_DIMENSIONS)
+        norm = float(np.linalg.norm(text_values))
+        if norm:
+            indices.append(text_indices + offset)
+            values.append(text_values / norm)
+
+    return np.concatenate(indices), np.concatenate(values)
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    """
+    Вычисляет softmax по последней оси.
+    """
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def _dense(rows: Sequence[SparseVector]) -> np.ndarray:
+    """
+    Собирает плотную матрицу признаков для пачки примеров.
+    """
+    matrix = np.zeros((len(rows), FEATURES), dtype=np.float32)
+    for row, (indices, values) in enumerate(rows):
+        np.add.at(matrix[row], indices, values)
+    return matrix
+
+
+class DistilledModel:
+    """
+    Мультиклассовая логистическая регрессия "ответы -> рекомендованный тариф".
+
+    Модель хранит только веса и названия тарифов: тексты рекомендаций
+    OpenAI написаны для конкретных пользователей и в артефакт не попадают.
+    Артефакт - один файл .npz без pickle.
+    """
+
+    def __init__(self, weights: np.ndarray, bias: np.ndarray, classes: List[str], fingerprint: str) -> None:
+        """
+        Args:
+            weights: Матрица весов (признаки x классы)
+            bias: Смещения классов
+            classes: Названия рекомендованных тарифов
+            fingerprint: Версия промпта, на рекомендациях которого обучена модель
+        """
+        self.weights = weights.astype(np.float32)
+        self.bias = bias.astype(np.float32)
+        self.classes = classes
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def train(
+        cls,
+        examples: List[Tuple[List[Any], str]],
+        fingerprint: str,
+        epochs: int = 100,
+        learning_rate: float = 0.5,
+        l2: float = 1e-4,
+        batch_size: int = 256,
+        seed: int = 0
+    ) -> "DistilledModel":
+        """
+        Обучает модель мини-батчевым градиентным спуском.
+
+        Args:
+            examples: Пары (ответы, рекомендованный тариф)
+            fingerprint: Версия промпта обучающих рекомендаций
+            epochs: Количество проходов по данным
+            learning_rate: Шаг градиентного спуска
+            l2: Коэффициент L2-регуляризации
+            batch_size: Размер пачки
+            seed: Зерно генератора случайных чисел
+
+        Returns:
+            Обученная модель
+        """
+        classes = sorted({label for _, label in examples})
+        class_index = {label: index for index, label in enumerate(classes)}
+        rows = [encode(answers) for answers, _ in examples]
+        labels = np.array([class_index[label] for _, label in examples], dtype=np.int64)
+
+        rng = np.random.default_rng(seed)
+        weights = np.zeros((FEATURES, len(classes)), dtype=np.float32)
+        bias = np.zeros(len(classes), dtype=np.float32)
+
+        for _ in range(epochs):
+            order = rng.permutation(len(rows))
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                features = _dense([rows[i] for i in batch])
+                probabilities = _softmax(features @ weights + bias)
+                probabilities[np.arange(len(batch)), labels[batch]] -= 1
+                gradient = probabilities / len(batch)
+                weights -= learning_rate * (features.T @ gradient + l2 * weights)
+                bias -= learning_rate * gradient.sum(axis=0)
+
+        return cls(weights, bias, classes, fingerprint)
+
+    def predict(self, answers: List[Any]) -> Tuple[int, float]:
+        """
+        Предсказывает рекомендованный тариф.
+
+        Args:
+            answers: Ответы пользователя
+
+        Returns:
+            Индекс класса и уверенность модели (вероятность класса)
+        """
+        indices, values = encode(answers)
+        logits = values @ self.weights[indices] + self.bias
+        probabilities = _softmax(logits)
+        best = int(np.argmax(probabilities))
+        return best, float(probabilities[best])
+
+    def save(self, path: Path) -> None:
+        """
+        Сохраняет модель в файл .npz.
+
+        Args:
+            path: Путь к файлу
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # np.savez добавляет расширение .npz; пишем во временный файл и атомарно заменяем
+        tmp_path = path.with_name(path.name + ".tmp.npz")
+        np.savez_compressed(
+            tmp_path,
+            weights=self.weights.astype(np.float16),
+            bias=self.bias,
+            classes=np.array(self.classes),
+            fingerprint=np.array(self.fingerprint),
+            feature_version=np.array(FEATURE_VERSION),
+            text_dimensions=np.array(TEXT_DIMENSIONS)
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "DistilledModel":
+        """
+        Загружает модель из файла .npz.
+
+        Args:
+            path: Путь к файлу
+
+        Returns:
+            Модель
+
+        Raises:
+            ValueError: Модель обучена на другом наборе признаков
+        """
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["feature_version"]) != FEATURE_VERSION or int(data["text_dimensions"]) != TEXT_DIMENSIONS:
+                raise ValueError("модель обучена на другом наборе признаков, ее нужно переобучить")
+            if data["weights"].shape[0] != FEATURES:
+                raise ValueError("количество признаков модели не совпадает с вопросами онбординга")
+            return cls(
+                data["weights"],
+                data["bias"],
+                [str(label) for label in data["classes"]],
+                str(data["fingerprint"])
+            )
+
+
+class DistilledRecommender:
+    """
+    Подбор тарифа локальной моделью вместо вызова OpenAI.
+
+    Модель загружается из DISTILLED_MODEL_PATH при первом обращении. Если
+    уверенность модели не ниже threshold, возвращается предсказанный тариф
+    с объяснением по шаблону (services/tariff_scorer.py); иначе вызывающий
+    код обращается к OpenAI.
+    Модель, обученная для другой версии промпта, не используется.
+    """
+
+    def __init__(self, fingerprint: str, path: Path = DISTILLED_MODEL_PATH,
+                 threshold: float = DISTILLED_MODEL_THRESHOLD) -> None:
+        """
+        Args:
+            fingerprint: Текущая версия промпта
+            path: Путь к файлу модели
+            threshold: Минимальная уверенность (больше 1 - модель не используется)
+        """
+        self.fingerprint = fingerprint
+        self.path = Path(path)
+        self.threshold = threshold
+        self.model: Optional[DistilledModel] = None
+        self._loaded = False
+
+        # Счетчики
+        self.confident = 0
+        self.unsure = 0
+        self._total_inference = 0.0
+
+    def predict(self, answers: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Подбирает тариф, если модель достаточно уверена.
+
+        Args:
+            answers: Ответы пользователя
+
+        Returns:
+            Рекомендация или None, если модели нет или она не уверена
+        """
+        if self.threshold > 1:
+            return None
+        self._load_once()
+        if self.model is None:
+            return None
+
+        started = time.perf_counter()
+        label, confidence = self.model.predict(answers)
+        self._total_inference += time.perf_counter() - started
+
+        if confidence < self.threshold:
+            self.unsure += 1
+            return None
+
+        tariff_data = tariff_data_for(self.model.classes[label])
+        if tariff_data is None:
+            # Модель обучена на тарифе, которого больше нет среди тарифов бота
+            self.unsure += 1
+            return None
+
+        self.confident += 1
+        logger.info(f"Тариф «{self.model.classes[label]}» подобран локальной моделью (уверенность {confidence:.2f}).")
+        return tariff_data
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Возвращает метрики локальной модели.
+
+        Returns:
+            Словарь с признаком загрузки, порогом, количеством уверенных
+            и неуверенных предсказаний и средним временем предсказания
+        """
+        predictions = self.confident + self.unsure
+        return {
+            "loaded": self.model is not None,
+            "classes": len(self.model.classes) if self.model is not None else 0,
+            "threshold": self.threshold,
+            "confident": self.confident,
+            "unsure": self.unsure,
+            "avg_inference_ms": self._total_inference / predictions * 1000 if predictions else 0.0
+        }
+
+    def _load_once(self) -> None:
+        """
+        При первом обращении загружает модель, если файл есть и подходит к текущему промпту.
+        """
+        if self._loaded:
+            return
+        self._loaded = True
+
+        if not self.path.exists():
+            logger.info(f"Файл локальной модели {self.path} не найден, тарифы подбирает OpenAI.")
+            return
+        try:
+            model = DistilledModel.load(self.path)
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке локальной модели {self.path}: {e}")
+            return
+        if model.fingerprint != self.fingerprint:
+            logger.warning(
+                f"Локальная модель обучена для версии промпта {model.fingerprint}, "
+                f"текущая версия {self.fingerprint}: модель не используется, ее нужно переобучить."
+            )
+            return
+
+        self.model = model
+        logger.info(f"Загружена локальная модель подбора тарифа: {len(model.classes)} классов.")
@@ -0,0 +1,301 @@
+"""
+Выбор модели OpenAI по времени ответа и хеджирование медленных запросов.
+"""
+import time
+import random
+import asyncio
+import logging
+from bisect import bisect_left
+from collections import Counter, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+from config import (
+    OPENAI_MODEL, OPENAI_ALT_MODEL, OPENAI_LATENCY_ROUTING, OPENAI_LATENCY_WINDOW,
+    OPENAI_HEDGE_ENABLED, OPENAI_HEDGE_PERCENTILE, OPENAI_HEDGE_DELAY
+)
+from services.llm_usage import percentile
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограммы времени ответа, в миллисекундах (последняя корзина - все, что больше)
+HISTOGRAM_BOUNDS_MS = [250, 500, 1000, 2000, 4000, 8000, 16000]
+
+# Минимум замеров модели, после которого ее перцентили используются для решений
+MIN_SAMPLES = 20
+
+# Доля простых запросов, которые отправляются модели без достаточного числа замеров
+EXPLORE_RATE = 0.1
+
+T = TypeVar("T")
+
+
+class LatencyHistogram:
+    """
+    Время ответа одной модели в одном режиме (ответ целиком или поток).
+
+    Перцентили считаются по последним window замерам, чтобы решения
+    учитывали текущее состояние API; корзины гистограммы накапливаются
+    с момента запуска.
+    """
+
+    def __init__(self, window: int) -> None:
+        """
+        Args:
+            window: Количество последних замеров для перцентилей
+        """
+        self.recent: Deque[int] = deque(maxlen=max(1, window))
+        self.buckets = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+        self.count = 0
+
+    def observe(self, latency_ms: int) -> None:
+        """
+        Добавляет замер.
+
+        Args:
+            latency_ms: Время ответа в миллисекундах
+        """
+        self.recent.append(latency_ms)
+        self.buckets[bisect_left(HISTOGRAM_BOUNDS_MS, latency_ms)] += 1
+        self.count += 1
+
+    def percentile(self, p: float) -> Optional[int]:
+        """
+        Возвращает перцентиль последних замеров.
+
+        Args:
+            p: Перцентиль от 0 до 100
+
+        Returns:
+            Время в миллисекундах или None, если замеров меньше MIN_SAMPLES
+        """
+        if len(self.recent) < MIN_SAMPLES:
+            return None
+        return percentile(sorted(self.recent), p)
+
+
+class LatencyRouter:
+    """
+    Выбор модели и хеджирование вызовов OpenAI.
+
+    Для простых наборов ответов запрос уходит модели с лучшим p50 за
+    последнее время (основной или альтернативной). Если включено
+    хеджирование и основной запрос не ответил за время, равное
+    hedge_percentile-перцентилю его модели, отправляется второй запрос
+    (альтернативной модели, если она задана) и используется тот ответ,
+    который пришел первым; второй запрос отменяется.
+    """
+
+    def __init__(
+        self,
+        primary: str = OPENAI_MODEL,
+        alternate: Optional[str] = OPENAI_ALT_MODEL or None,
+        routing: bool = OPENAI_LATENCY_ROUTING,
+        hedging: bool = OPENAI_HEDGE_ENABLED,
+        hedge_percentile: float = OPENAI_HEDGE_PERCENTILE,
+        hedge_delay: float = OPENAI_HEDGE_DELAY,
+        window: int = OPENAI_LATENCY_WINDOW
+    ) -> None:
+        """
+        Args:
+            primary: Основная модель
+            alternate: Альтернативная модель (None - только основная)
+            routing: Выбирать модель для простых запросов по времени ответа
+            hedging: Отправлять второй запрос, если первый отвечает слишком долго
+            hedge_percentile: Перцентиль времени ответа, после которого отправляется второй запрос
+            hedge_delay: Задержка второго запроса в секундах, пока замеров недостаточно
+            window: Количество последних замеров для перцентилей
+        """
+        self.primary = primary
+        self.alternate = alternate if alternate and alternate != primary else None
+        self.routing = routing and self.alternate is not None
+        self.hedging = hedging
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay = hedge_delay
+        self.window = window
+        self._histograms: Dict[Tuple[str, str], LatencyHistogram] = {}
+        self._metrics: Counter = Counter()
+
+    @property
+    def models(self) -> List[str]:
+        """
+        Модели, между которыми выбирает маршрутизатор.
+        """
+        return [self.primary, self.alternate] if self.alternate else [self.primary]
+
+    def histogram(self, model: str, mode: str) -> LatencyHistogram:
+        """
+        Возвращает гистограмму модели в режиме mode ("batch" или "stream").
+        """
+        key = (model, mode)
+        if key not in self._histograms:
+            self._histograms[key] = LatencyHistogram(self.window)
+        return self._histograms[key]
+
+    def choose(self, simple: bool, mode: str) -> str:
+        """
+        Выбирает модель для запроса.
+
+        Args:
+            simple: Простой набор ответов (с ним справится любая модель)
+            mode: "batch" или "stream"
+
+        Returns:
+            Имя модели
+        """
+        if not simple or not self.routing:
+            return self.primary
+
+        p50 = {model: self.histogram(model, mode).percentile(50) for model in self.models}
+        unmeasured = [model for model, value in p50.items() if value is None]
+        if unmeasured and random.random() < EXPLORE_RATE:
+            # Модель без замеров иногда получает запрос, иначе о ней ничего не узнать
+            return random.choice(unmeasured)
+
+        measured = {model: value for model, value in p50.items() if value is not None}
+        if not measured:
+            return self.primary
+        return min(measured, key=measured.get)
+
+    async def call(
+        self,
+        request: Callable[[str], Awaitable[T]],
+        simple: bool = False,
+        mode: str = "batch",
+        on_abandoned: Optional[Callable[[str, float], Awaitable[None]]] = None
+    ) -> Tuple[T, str]:
+        """
+        Выполняет запрос с выбором модели и, если включено, хеджированием.
+
+        Args:
+            request: Функция, выполняющая запрос к указанной модели
+            simple: Простой набор ответов
+            mode: "batch" или "stream" (у потока время до начала ответа)
+            on_abandoned: Вызывается с моделью и временем работы для каждого запроса,
+                отмененного или закрытого при хеджировании: он уже израсходовал токены
+
+        Returns:
+            Ответ и модель, которая его дала
+        """
+        model = self.choose(simple, mode)
+        self._metrics["calls"] += 1
+        if model != self.primary:
+            self._metrics["routed"] += 1
+
+        first = asyncio.ensure_future(self._timed(request, model, mode))
+        if not self.hedging:
+            return await first, model
+
+        tasks = {first: model}
+        started = {first: time.monotonic()}
+        abandoned: List[asyncio.Future] = []
+        try:
+            delay = self._hedge_delay(model, mode)
+            done, _ = await asyncio.wait({first}, timeout=delay)
+            if done:
+                return first.result(), model
+
+            # Основной запрос отвечает дольше обычного: отправляем второй
+            hedge_model = self.alternate if model == self.primary and self.alternate else self.primary
+            self._metrics["hedged"] += 1
+            logger.info(f"Запрос к {model} идет дольше {delay:.1f} с, отправлен второй запрос к {hedge_model}.")
+            second = asyncio.ensure_future(self._timed(request, hedge_model, mode))
+            tasks[second] = hedge_model
+            started[second] = time.monotonic()
+
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winners = [task for task in done if task.exception() is None]
+                if winners:
+                    winner = winners[0]
+                    for extra in winners[1:]:
+                        # Оба запроса ответили одновременно: лишний поток нужно закрыть
+                        await _close(extra.result())
+                        abandoned.append(extra)
+                    if winner is second:
+                        self._metrics["hedge_wins"] += 1
+                    return winner.result(), tasks[winner]
+                error = next(iter(done)).exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                    abandoned.append(task)
+            self._metrics["abandoned"] += len(abandoned)
+            if on_abandoned is not None:
+                for task in abandoned:
+                    try:
+                        await on_abandoned(tasks[task], time.monotonic() - started[task])
+                    except Exception as e:
+                        logger.warning(f"Не удалось учесть отмененный запрос к {tasks[task]}: {e}")
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Возвращает гистограммы времени ответа и счетчики маршрутизации.
+
+        Returns:
+            Словарь с настройками, счетчиками и гистограммами по моделям и режимам
+        """
+        return {
+            "primary": self.primary,
+            "alternate": self.alternate,
+            "routing": self.routing,
+            "hedging": self.hedging,
+            "calls": self._metrics["calls"],
+            "routed": self._metrics["routed"],
+            "hedged": self._metrics["hedged"],
+            "hedge_wins": self._metrics["hedge_wins"],
+            "abandoned": self._metrics["abandoned"],
+            "bounds_ms": HISTOGRAM_BOUNDS_MS,
+            "histograms": [
+                {
+                    "model": model,
+                    "mode": mode,
+                    "count": histogram.count,
+                    "p50_ms": histogram.percentile(50),
+                    "p95_ms": histogram.percentile(95),
+                    "p99_ms": histogram.percentile(99),
+                    "buckets": list(histogram.buckets)
+                }
+                for (model, mode), histogram in sorted(self._histograms.items())
+            ]
+        }
+
+    async def _timed(self, request: Callable[[str], Awaitable[T]], model: str, mode: str) -> T:
+        """
+        Выполняет запрос и учитывает время ответа.
+
+        Время отмененного запроса (проигравшего при хеджировании) тоже
+        учитывается: это нижняя граница его времени ответа, и без нее
+        медленные ответы пропадали бы из перцентилей.
+        """
+        started = time.monotonic()
+        try:
+            result = await request(model)
+        except asyncio.CancelledError:
+            self.histogram(model, mode).observe(int((time.monotonic() - started) * 1000))
+            raise
+        self.histogram(model, mode).observe(int((time.monotonic() - started) * 1000))
+        return result
+
+    def _hedge_delay(self, model: str, mode: str) -> float:
+        """
+        Возвращает время ожидания перед вторым запросом в секундах.
+        """
+        value = self.histogram(model, mode).percentile(self.hedge_percentile)
+        return value / 1000 if value is not None else self.hedge_delay
+
+
+async def _close(result: Any) -> None:
+    """
+    Закрывает лишний потоковый ответ, чтобы освободить соединение.
+    """
+    close = getattr(result, "close", None)
+    if close is not None:
+        try:
+            await close()
+        except Exception as e:
+            logger.warning(f"Не удалось закрыть лишний ответ OpenAI: {e}")
@@ -0,0 +1,312 @@
+"""
+Устойчивый слой вызовов OpenAI: сроки, повторы, ограничение параллельности и предохранитель.
+"""
+import time
+import random
+import asyncio
+import logging
+from collections import Counter
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+import openai
+from openai import AsyncOpenAI
+
+from config import (
+    OPENAI_TIMEOUT, OPENAI_MAX_RETRIES, OPENAI_RETRY_BASE_DELAY, OPENAI_CONCURRENCY,
+    OPENAI_BREAKER_THRESHOLD, OPENAI_BREAKER_RESET
+)
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+
+# Состояния предохранителя
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Временные ошибки, после которых запрос имеет смысл повторить
+RETRYABLE_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    asyncio.TimeoutError,
+)
+
+
+class LLMUnavailableError(Exception):
+    """
+    OpenAI недоступен: предохранитель разомкнут, истек срок или исчерпаны повторы.
+    """
+
+
+class CircuitBreaker:
+    """
+    Предохранитель для внешнего сервиса.
+
+    После threshold временных сбоев подряд предохранитель размыкается и
+    запросы сразу отклоняются. Через reset_timeout секунд пропускается один
+    пробный запрос: успех замыкает предохранитель, сбой снова размыкает.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float) -> None:
+        """
+        Args:
+            threshold: Количество сбоев подряд до размыкания
+            reset_timeout: Время в секундах до пробного запроса
+        """
+        self.threshold = max(1, threshold)
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        """
+        Проверяет, можно ли выполнить запрос.
+
+        Returns:
+            True, если запрос разрешен
+        """
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        """
+        Учитывает успешный запрос.
+        """
+        if self.state != CLOSED:
+            logger.info("Предохранитель OpenAI замкнут: сервис снова отвечает.")
+        self.state = CLOSED
+        self._failures = 0
+        self._probe_in_flight = False
+
+    def release_probe(self) -> None:
+        """
+        Освобождает пробный запрос, который завершился без результата (например, отменен).
+        """
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        """
+        Учитывает временный сбой запроса.
+        """
+        self._failures += 1
+        self._probe_in_flight = False
+        if self.state == HALF_OPEN or self._failures >= self.threshold:
+            if self.state != OPEN:
+                logger.warning(f"Предохранитель OpenAI разомкнут после {self._failures} сбоев подряд.")
+            self.state = OPEN
+            self._opened_at = time.monotonic()
+
+
+class ResilientLLMClient:
+    """
+    Обертка над AsyncOpenAI для вызовов chat.completions.
+
+    У каждого вызова общий срок timeout секунд вместе с ожиданием очереди и
+    повторами. Временные ошибки (таймауты, обрывы соединения, 429, 5xx)
+    повторяются с экспоненциальной задержкой и случайным разбросом.
+    Одновременно выполняется не больше concurrency запросов. При серии
+    сбоев предохранитель размыкается и вызовы сразу завершаются
+    LLMUnavailableError, чтобы вызывающий код перешел на запасной вариант.
+    """
+
+    def __init__(
+        self,
+        client: AsyncOpenAI,
+        timeout: float = OPENAI_TIMEOUT,
+        max_retries: int = OPENAI_MAX_RETRIES,
+        base_delay: float = OPENAI_RETRY_BASE_DELAY,
+        concurrency: int = OPENAI_CONCURRENCY,
+        breaker: Optional[CircuitBreaker] = None
+    ) -> None:
+        """
+        Args:
+            client: Клиент OpenAI
+            timeout: Общий срок на вызов вместе с повторами, в секундах
+            max_retries: Максимальное количество повторов
+            base_delay: Базовая задержка перед повтором в секундах
+            concurrency: Максимальное количество одновременных запросов
+            breaker: Предохранитель (по умолчанию из настроек)
+        """
+        # Повторы выполняет эта обертка, встроенные повторы SDK отключены
+        self.client = client.with_options(max_retries=0)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.concurrency = max(1, concurrency)
+        self.breaker = breaker or CircuitBreaker(OPENAI_BREAKER_THRESHOLD, OPENAI_BREAKER_RESET)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._in_flight = 0
+        self._metrics: Counter = Counter()
+
+    async def create_chat_completion(self, **kwargs: Any) -> Any:
+        """
+        Выполняет client.chat.completions.create с повторами и ограничениями.
+
+        Args:
+            **kwargs: Параметры chat.completions.create
+
+        Returns:
+            Ответ OpenAI
+
+        Raises:
+            LLMUnavailableError: Предохранитель разомкнут, истек срок или исчерпаны повторы
+            openai.APIStatusError: Ошибка запроса, которую бессмысленно повторять (400, 401 и т.п.)
+        """
+        self._metrics["calls"] += 1
+        deadline = time.monotonic() + self.timeout
+        attempt = 0
+
+        while True:
+            if not self.breaker.allow():
+                self._metrics["rejected"] += 1
+                raise LLMUnavailableError("предохранитель OpenAI разомкнут")
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.breaker.record_failure()
+                self._metrics["deadline_exceeded"] += 1
+                raise LLMUnavailableError(f"истек срок {self.timeout:.0f} с на запрос к OpenAI")
+
+            try:
+                response = await asyncio.wait_for(self._call(kwargs), remaining)
+            except RETRYABLE_ERRORS as e:
+                self.breaker.record_failure()
+                self._metrics[_outcome(e)] += 1
+
+                delay = self._retry_delay(e, attempt)
+                if attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+                    self._metrics["failed"] += 1
+                    raise LLMUnavailableError(
+                        f"OpenAI не ответил после {attempt + 1} попыток ({_outcome(e)}): {e}"
+                    ) from e
+
+                logger.warning(f"Временная ошибка OpenAI ({_outcome(e)}), повтор через {delay:.1f} с: {e}")
+                self._metrics["retries"] += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            except openai.APIStatusError:
+                # Ошибка в самом запросе: сервис работает, повтор не поможет
+                self.breaker.record_success()
+                self._metrics["client_errors"] += 1
+                raise
+            except BaseException:
+                # Отмена или непредвиденная ошибка не должны навсегда занять пробный запрос
+                self.breaker.release_probe()
+                raise
+
+            self.breaker.record_success()
+            self._metrics["success"] += 1
+            return response
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Возвращает метрики вызовов.
+
+        Returns:
+            Словарь со счетчиками исходов, числом запросов в работе и состоянием предохранителя
+        """
+        metrics = {
+            name: self._metrics[name]
+            for name in (
+                "calls", "success", "retries", "failed", "rejected", "deadline_exceeded",
+                "timeouts", "connection_errors", "rate_limited", "server_errors", "client_errors"
+            )
+        }
+        metrics["in_flight"] = self._in_flight
+        metrics["concurrency"] = self.concurrency
+        metrics["breaker_state"] = self.breaker.state
+        return metrics
+
+    async def _call(self, kwargs: Dict[str, Any]) -> Any:
+        """
+        Выполняет одну попытку запроса внутри ограничения параллельности.
+
+        Потоковый ответ читается уже после возврата, поэтому его место
+        освобождается только при закрытии потока (HeldStream.close()).
+        """
+        await self._semaphore.acquire()
+        self._in_flight += 1
+        try:
+            response = await self.client.chat.completions.create(**kwargs)
+        except BaseException:
+            self._release()
+            raise
+        if kwargs.get("stream"):
+            return HeldStream(response, self._release)
+        self._release()
+        return response
+
+    def _release(self) -> None:
+        """
+        Освобождает место в ограничении параллельности.
+        """
+        self._in_flight -= 1
+        self._semaphore.release()
+
+    def _retry_delay(self, error: Exception, attempt: int) -> float:
+        """
+        Вычисляет задержку перед повтором; для 429 учитывает заголовок Retry-After.
+        """
+        delay = self.base_delay * (2 ** attempt) * random.uniform(0.5, 1.5)
+        if isinstance(error, openai.RateLimitError):
+            try:
+                delay = max(delay, float(error.response.headers.get("retry-after", 0)))
+            except (TypeError, ValueError):
+                pass
+        return delay
+
+
+class HeldStream:
+    """
+    Потоковый ответ OpenAI, который занимает место в ограничении параллельности до закрытия.
+
+    Вызывающий код обязан закрыть поток (close()), в том числе при ошибке
+    или отмене чтения, иначе место не освободится.
+    """
+
+    def __init__(self, stream: Any, release: Callable[[], None]) -> None:
+        """
+        Args:
+            stream: Поток фрагментов ответа chat.completions
+            release: Функция, освобождающая место
+        """
+        self._stream = stream
+        self._release = release
+
+    def __aiter__(self) -> AsyncIterator[Any]:
+        return self._stream.__aiter__()
+
+    async def close(self) -> None:
+        """
+        Закрывает соединение и освобождает место (повторный вызов ничего не делает).
+        """
+        release, self._release = self._release, None
+        try:
+            await self._stream.close()
+        finally:
+            if release is not None:
+                release()
+
+
+def _outcome(error: Exception) -> str:
+    """
+    Возвращает имя счетчика для временной ошибки.
+    """
+    if isinstance(error, (openai.APITimeoutError, asyncio.TimeoutError)):
+        return "timeouts"
+    if isinstance(error, openai.APIConnectionError):
+        return "connection_errors"
+    if isinstance(error, openai.RateLimitError):
+        return "rate_limited"
+    return "server_errors"
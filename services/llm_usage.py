@@ -0,0 +1,153 @@
+"""
+Учет вызовов OpenAI: токены, время ответа, исход и стоимость.
+"""
+import time
+import math
+import datetime
+import logging
+from typing import Any, Dict, List, Tuple
+
+from openai.types import CompletionUsage
+
+from config import (
+    OPENAI_PRICE_INPUT, OPENAI_PRICE_CACHED_INPUT, OPENAI_PRICE_OUTPUT, LLM_CALLS_RETENTION_DAYS
+)
+from database import db
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+
+# Старые записи о вызовах удаляются раз в столько записанных вызовов
+PRUNE_EVERY = 500
+
+# Среднее число символов на токен для оценки входных токенов (русский текст - около 3)
+CHARS_PER_TOKEN = 3
+
+# Количество записанных вызовов с момента запуска
+_recorded = 0
+
+
+def usage_tokens(usage: Any) -> Tuple[int, int, int]:
+    """
+    Извлекает количество токенов из response.usage.
+
+    Args:
+        usage: Объект usage из ответа OpenAI или None
+
+    Returns:
+        Входные токены, выходные токены и входные токены из кэша промптов
+    """
+    if usage is None:
+        return 0, 0, 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or 0
+    return usage.prompt_tokens or 0, usage.completion_tokens or 0, cached
+
+
+def estimate_usage(prompt: str) -> CompletionUsage:
+    """
+    Оценивает usage запроса, отмененного до ответа: известен только размер входа.
+
+    Args:
+        prompt: Весь текст запроса (сообщения и схема)
+
+    Returns:
+        usage с оценкой входных токенов и без выходных
+    """
+    prompt_tokens = math.ceil(len(prompt) / CHARS_PER_TOKEN)
+    return CompletionUsage(prompt_tokens=prompt_tokens, completion_tokens=0, total_tokens=prompt_tokens)
+
+
+def estimate_cost(prompt_tokens: int, completion_tokens: int, cached_tokens: int) -> float:
+    """
+    Оценивает стоимость вызова по ценам из настроек.
+
+    Args:
+        prompt_tokens: Входные токены (включая взятые из кэша)
+        completion_tokens: Выходные токены
+        cached_tokens: Входные токены из кэша промптов
+
+    Returns:
+        Стоимость в долларах
+    """
+    return (
+        (prompt_tokens - cached_tokens) * OPENAI_PRICE_INPUT
+        + cached_tokens * OPENAI_PRICE_CACHED_INPUT
+        + completion_tokens * OPENAI_PRICE_OUTPUT
+    ) / 1_000_000
+
+
+def percentile(sorted_values: List[int], p: float) -> int:
+    """
+    Возвращает перцентиль отсортированного списка (метод ближайшего ранга).
+
+    Args:
+        sorted_values: Значения по возрастанию
+        p: Перцентиль от 0 до 100
+
+    Returns:
+        Значение перцентиля или 0 для пустого списка
+    """
+    if not sorted_values:
+        return 0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+async def record_llm_call(model: str, usage: Any, latency: float, outcome: str) -> None:
+    """
+    Записывает вызов OpenAI в таблицу llm_calls.
+
+    Args:
+        model: Модель
+        usage: Объект usage из ответа OpenAI или None, если ответа нет
+        latency: Время вызова в секундах вместе с повторами
+        outcome: Исход вызова ("success" или вид ошибки)
+    """
+    global _recorded
+
+    prompt_tokens, completion_tokens, cached_tokens = usage_tokens(usage)
+    await db.save_llm_call(
+        model, prompt_tokens, completion_tokens, cached_tokens, int(latency * 1000), outcome
+    )
+
+    _recorded += 1
+    if _recorded % PRUNE_EVERY == 0:
+        await db.prune_llm_calls(int(time.time()) - LLM_CALLS_RETENTION_DAYS * 86400)
+
+
+async def get_llm_usage_report(days: int = 7) -> Dict[str, Any]:
+    """
+    Собирает отчет о вызовах OpenAI.
+
+    Args:
+        days: Количество дней в сводке по дням
+
+    Returns:
+        Словарь с p50/p95 времени ответа и исходами за последние сутки
+        и сводкой по дням со стоимостью и долей токенов из кэша промптов
+    """
+    stats = await db.get_llm_call_stats(int(time.time()) - 86400)
+    latencies = stats["latencies"]
+
+    since_day = (datetime.datetime.now(datetime.timezone.utc).date() - datetime.timedelta(days=days - 1)).isoformat()
+    daily: Dict[str, Dict[str, Any]] = {}
+    for row in await db.get_llm_daily_usage(since_day):
+        day = daily.setdefault(row["day"], {
+            "day": row["day"], "calls": 0, "failed": 0, "prompt_tokens": 0,
+            "completion_tokens": 0, "cached_tokens": 0, "cost": 0.0
+        })
+        for name in ("calls", "failed", "prompt_tokens", "completion_tokens", "cached_tokens"):
+            day[name] += row[name]
+        day["cost"] += estimate_cost(row["prompt_tokens"], row["completion_tokens"], row["cached_tokens"])
+
+    for day in daily.values():
+        day["cached_ratio"] = day["cached_tokens"] / day["prompt_tokens"] if day["prompt_tokens"] else 0.0
+
+    return {
+        "calls_24h": sum(stats["outcomes"].values()),
+        "outcomes_24h": stats["outcomes"],
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "daily": list(daily.values())
+    }
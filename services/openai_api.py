@@ -2,12 +2,27 @@
 Модуль для интеграции с OpenAI API.
 """
 import json
+import time
+import asyncio
+import hashlib
 import logging
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Awaitable, Callable, Optional, Tuple
 
 import openai
 from openai import AsyncOpenAI
-from config import OPENAI_API_KEY, OPENAI_MODEL, OPENAI_TARIFF_PROMPT
+from config import (
+    OPENAI_API_KEY, OPENAI_MODEL, OPENAI_ALT_MODEL, OPENAI_TARIFF_PROMPT, OPENAI_TIMEOUT, OPENAI_STREAMING,
+    OPENAI_SIMPLE_ANSWERS_CHARS, TARIFF_SCORER_ENABLED
+)
+from services.distilled_model import DistilledRecommender
+from services.latency_router import LatencyRouter
+from services.llm_client import LLMUnavailableError, ResilientLLMClient
+from services.llm_usage import estimate_usage, record_llm_call
+from services.recommendation_cache import RecommendationCache, normalize_answers
+from services.semantic_cache import SemanticCache
+from services.single_flight import SingleFlight
+from services.tariff_scorer import record_decision, score_answers
+from utils.partial_json import partial_json_string
 
 # Инициализация логгера
 logger = logging.getLogger(__name__)
@@ -15,72 +30,390 @@ logger = logging.getLogger(__name__)
 # Инициализация клиента OpenAI
 client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
+# Вызовы OpenAI со сроками, повторами, ограничением параллельности и предохранителем
+llm = ResilientLLMClient(client)
 
-async def analyze_onboarding_answers(answers: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+# Выбор модели по времени ответа и хеджирование медленных запросов
+router = LatencyRouter()
+
+# Системный промпт для анализа ответов
+SYSTEM_PROMPT = "Ты аналитик по подбору тарифов для бизнеса."
+
+# Неизменное начало запроса: системный промпт и инструкции без ответов пользователя
+STATIC_PROMPT = f"{SYSTEM_PROMPT}\n{OPENAI_TARIFF_PROMPT.strip()}"
+
+# Схема structured outputs для рекомендации тарифов
+RECOMMEND_TARIFF_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "recommend_tariff",
+        "description": "Рекомендует тарифы на основе ответов пользователя",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                # Короткая рекомендация и объяснение идут до списка тарифов, чтобы при потоковой
+                # выдаче показать объяснение пользователю, не дожидаясь тарифов
+                "recommendation": {"type": "string"},
+                "explanation": {"type": "string"},
+                "tariffs": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "name": {"type": "string"},
+                            "description": {"type": "string"},
+                            "price": {"type": "number"},
+                            "features": {
+                                "type": "array",
+                                "items": {"type": "string"}
+                            }
+                        },
+                        "required": ["name", "description", "price", "features"]
+                    }
+                }
+            },
+            "required": ["recommendation", "explanation", "tariffs"]
+        }
+    }
+}
+
+# Версия промпта: меняется при изменении модели, промптов или схемы и сбрасывает кэш рекомендаций
+PROMPT_FINGERPRINT = hashlib.sha256(
+    json.dumps([OPENAI_MODEL, SYSTEM_PROMPT, OPENAI_TARIFF_PROMPT, RECOMMEND_TARIFF_TOOL]
+               + ([OPENAI_ALT_MODEL] if OPENAI_ALT_MODEL else []),
+               ensure_ascii=False, sort_keys=True).encode("utf-8")
+).hexdigest()[:16]
+
+# Кэш рекомендаций по нормализованным ответам
+recommendation_cache = RecommendationCache(PROMPT_FINGERPRINT)
+
+# Кэш рекомендаций по похожим свободным ответам
+semantic_cache = SemanticCache(PROMPT_FINGERPRINT)
+
+# Локальная модель, обученная на рекомендациях OpenAI
+distilled = DistilledRecommender(PROMPT_FINGERPRINT)
+
+# Объединение одновременных запросов с одинаковыми ответами
+single_flight = SingleFlight()
+
+# Обработчик фрагментов объяснения: получает весь текст, полученный к этому моменту
+ExplanationCallback = Callable[[str], Awaitable[None]]
+
+# Время до первого текста для пользователя: "stream" - потоковая выдача, "batch" - ответ целиком
+_first_text_stats: Dict[str, Dict[str, float]] = {
+    mode: {"count": 0, "total": 0.0, "max": 0.0} for mode in ("stream", "batch")
+}
+
+
+async def analyze_onboarding_answers(
+    answers: List[Dict[str, Any]],
+    on_explanation: Optional[ExplanationCallback] = None
+) -> Optional[Dict[str, Any]]:
     """
     Анализирует ответы пользователя на вопросы онбординга и рекомендует тариф.
     
+    Сначала тариф подбирается локально по правилам (services/tariff_scorer.py).
+    OpenAI вызывается, только если свободные ответы меняют выбор или ответы
+    не распознаны; при сбое OpenAI возвращается локальная рекомендация.
+    Рекомендации OpenAI для одинаковых (после нормализации) ответов берутся
+    из кэша, для ответов с теми же вариантами и похожими свободными
+    ответами - из кэша похожих ответов. Затем тариф подбирает локальная
+    модель, обученная на рекомендациях OpenAI, если она достаточно уверена.
+    Одновременные запросы с одинаковыми ответами объединяются
+    в один вызов OpenAI.
+    
+    Если передан on_explanation и включен OPENAI_STREAMING, ответ OpenAI
+    читается потоком, и объяснение передается в on_explanation по мере
+    генерации, не дожидаясь конца ответа.
+    
     Args:
         answers: Список словарей с ответами пользователя
+        on_explanation: Обработчик фрагментов объяснения
         
     Returns:
         Словарь с рекомендованными тарифами и объяснением выбора
     """
+    scored = score_answers(answers) if TARIFF_SCORER_ENABLED else None
+    if scored and not scored["needs_llm"]:
+        record_decision("local")
+        logger.info(f"Тариф «{scored['tariff_data']['recommendation']}» подобран локально.")
+        return scored["tariff_data"]
+    if scored:
+        logger.info(f"Локального подбора недостаточно ({scored['reason']}), запрашиваем OpenAI.")
+    
+    normalized_answers = normalize_answers(answers)
+    cached = await recommendation_cache.get(normalized_answers)
+    if cached is not None:
+        record_decision("cache")
+        logger.info("Рекомендация тарифов взята из кэша.")
+        return cached
+    
+    similar = await semantic_cache.get(answers)
+    if similar is not None:
+        record_decision("semantic")
+        return similar
+    
+    predicted = distilled.predict(answers)
+    if predicted is not None:
+        record_decision("distilled")
+        return predicted
+    
     try:
-        # Форматируем ответы для запроса к OpenAI
-        formatted_answers = "\n".join([f"Вопрос: {answer['question_text']}\nОтвет: {answer['answer']}" 
-                                  for answer in answers])
-        
-        # Подготавливаем промпт
-        prompt = OPENAI_TARIFF_PROMPT.format(answers=formatted_answers)
-        
-        # Создаем запрос к OpenAI API с structured outputs
-        response = await client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[
-                {"role": "system", "content": "Ты аналитик по подбору тарифов для бизнеса."},
-                {"role": "user", "content": prompt}
-            ],
-            tools=[{
-                "type": "function",
-                "function": {
-                    "name": "recommend_tariff",
-                    "description": "Рекомендует тарифы на основе ответов пользователя",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "tariffs": {
-                                "type": "array",
-                                "items": {
-                                    "type": "object",
-                                    "properties": {
-                                        "name": {"type": "string"},
-                                        "description": {"type": "string"},
-                                        "price": {"type": "number"},
-                                        "features": {
-                                            "type": "array",
-                                            "items": {"type": "string"}
-                                        }
-                                    },
-                                    "required": ["name", "description", "price", "features"]
-                                }
-                            },
-                            "recommendation": {"type": "string"},
-                            "explanation": {"type": "string"}
-                        },
-                        "required": ["tariffs", "recommendation", "explanation"]
-                    }
-                }
-            }],
-            tool_choice={"type": "function", "function": {"name": "recommend_tariff"}}
+        # Одинаковые одновременные запросы объединяются в один вызов OpenAI
+        tariff_data = await single_flight.do(
+            recommendation_cache.make_key(normalized_answers),
+            lambda: _request_recommendation(answers, normalized_answers, on_explanation)
         )
+    except Exception as e:
+        logger.error(f"Ошибка при анализе ответов через OpenAI: {e}")
+        if scored:
+            record_decision("fallback")
+            return scored["tariff_data"]
+        return None
+    
+    record_decision("llm")
+    return tariff_data
+
+
+async def _request_recommendation(
+    answers: List[Dict[str, Any]],
+    normalized_answers: str,
+    on_explanation: Optional[ExplanationCallback] = None
+) -> Dict[str, Any]:
+    """
+    Запрашивает рекомендацию тарифов у OpenAI и сохраняет ее в кэш.
+    
+    Args:
+        answers: Список словарей с ответами пользователя
+        normalized_answers: Нормализованные ответы (ключ кэша)
+        on_explanation: Обработчик фрагментов объяснения (включает потоковую выдачу)
         
-        # Извлекаем ответ
-        tool_call = response.choices[0].message.tool_calls[0]
-        tariff_data = json.loads(tool_call.function.arguments)
+    Returns:
+        Словарь с рекомендованными тарифами и объяснением выбора
         
-        logger.info(f"OpenAI успешно проанализировал ответы и предложил тарифы.")
-        return tariff_data
+    Raises:
+        ValueError: Ответ OpenAI не соответствует схеме recommend_tariff
+    """
+    # Форматируем ответы для запроса к OpenAI
+    formatted_answers = "\n".join([f"Вопрос: {answer['question_text']}\nОтвет: {answer['answer']}" 
+                              for answer in answers])
+    
+    # Схема и инструкции одинаковы для всех запросов и идут первыми (кэш промптов OpenAI
+    # работает по совпадающему началу запроса), ответы пользователя - последним сообщением
+    request = dict(
+        messages=[
+            {"role": "system", "content": STATIC_PROMPT},
+            {"role": "user", "content": formatted_answers}
+        ],
+        tools=[RECOMMEND_TARIFF_TOOL],
+        tool_choice={"type": "function", "function": {"name": "recommend_tariff"}}
+    )
+    # Короткие ответы без подробностей может обработать более быстрая модель
+    simple = sum(len(str(answer["answer"])) for answer in answers) <= OPENAI_SIMPLE_ANSWERS_CHARS
+    started = time.monotonic()
+    model = OPENAI_MODEL
+    usage = None
+    
+    # Запрос, отмененный при хеджировании, тоже расходует токены: учитываем его с оценкой входа
+    abandoned_usage = estimate_usage(json.dumps(request, ensure_ascii=False))
+    
+    async def record_abandoned(abandoned_model: str, elapsed: float) -> None:
+        await record_llm_call(abandoned_model, abandoned_usage, elapsed, "cancelled")
+    
+    try:
+        if on_explanation is not None and OPENAI_STREAMING:
+            # Потоковый запрос: объяснение показывается пользователю по мере генерации
+            stream, model = await router.call(
+                lambda model: llm.create_chat_completion(
+                    model=model, stream=True, stream_options={"include_usage": True}, **request
+                ),
+                simple=simple,
+                mode="stream",
+                on_abandoned=record_abandoned
+            )
+            try:
+                # Срок общий с запросом: чтение потока получает только оставшееся время
+                arguments, usage = await asyncio.wait_for(
+                    _consume_stream(stream, on_explanation, started),
+                    max(started + OPENAI_TIMEOUT - time.monotonic(), 0)
+                )
+            finally:
+                # Закрытие освобождает соединение и место в ограничении OPENAI_CONCURRENCY
+                await stream.close()
+        else:
+            # Создаем запрос к OpenAI API с structured outputs
+            response, model = await router.call(
+                lambda model: llm.create_chat_completion(model=model, **request),
+                simple=simple,
+                mode="batch",
+                on_abandoned=record_abandoned
+            )
+            usage = response.usage
+            arguments = response.choices[0].message.tool_calls[0].function.arguments
+            _record_first_text("batch", time.monotonic() - started)
+        
+        # Извлекаем ответ; ответ неверной формы не должен попасть в кэши
+        tariff_data = json.loads(arguments)
+        _validate_tariff_data(tariff_data)
     except Exception as e:
-        logger.error(f"Ошибка при анализе ответов через OpenAI: {e}")
-        return None 
\ No newline at end of file
+        await record_llm_call(model, usage, time.monotonic() - started, _call_outcome(e))
+        raise
+    
+    await record_llm_call(model, usage, time.monotonic() - started, "success")
+    logger.info(f"OpenAI успешно проанализировал ответы и предложил тарифы.")
+    await recommendation_cache.set(normalized_answers, tariff_data)
+    semantic_cache.add(answers, tariff_data)
+    return tariff_data
+
+
+async def _consume_stream(
+    stream: Any,
+    on_explanation: ExplanationCallback,
+    started: float
+) -> Tuple[str, Any]:
+    """
+    Читает потоковый ответ OpenAI и передает объяснение по мере его появления.
+    
+    Args:
+        stream: Поток фрагментов ответа chat.completions
+        on_explanation: Обработчик фрагментов объяснения
+        started: Момент отправки запроса (time.monotonic())
+        
+    Returns:
+        Полный JSON аргументов вызова recommend_tariff и usage из последнего фрагмента
+    """
+    buffer = ""
+    shown = ""
+    usage = None
+    
+    async for chunk in stream:
+        # Количество токенов приходит в последнем фрагменте без choices
+        if getattr(chunk, "usage", None) is not None:
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        for tool_call in chunk.choices[0].delta.tool_calls or []:
+            if tool_call.function is not None and tool_call.function.arguments:
+                buffer += tool_call.function.arguments
+        
+        explanation = partial_json_string(buffer, "explanation")
+        if not explanation or len(explanation) <= len(shown):
+            continue
+        
+        if not shown:
+            _record_first_text("stream", time.monotonic() - started)
+        shown = explanation
+        try:
+            await on_explanation(explanation)
+        except Exception as e:
+            # Ошибка показа фрагмента не должна прерывать получение ответа
+            logger.warning(f"Ошибка при передаче фрагмента объяснения: {e}")
+    
+    if not shown:
+        # Объяснение не пришло отдельными фрагментами: первый текст увидят только в итоговом сообщении
+        _record_first_text("batch", time.monotonic() - started)
+    return buffer, usage
+
+
+def _call_outcome(error: Exception) -> str:
+    """
+    Возвращает исход неудачного вызова OpenAI для учета.
+    
+    Ограничение частоты (429) и ошибки сервера (5xx) учитываются отдельно от
+    ошибок самого запроса (4xx), в том числе когда повторы после них исчерпаны.
+    """
+    # После исчерпанных повторов причину показывает ошибка последней попытки
+    cause = error.__cause__ if isinstance(error, LLMUnavailableError) else error
+    if isinstance(cause, openai.APIStatusError):
+        if cause.status_code == 429:
+            return "rate_limited"
+        if cause.status_code >= 500:
+            return "server_error"
+        return "client_error"
+    if isinstance(error, LLMUnavailableError):
+        return "unavailable"
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    if isinstance(error, (ValueError, LookupError, AttributeError)):
+        return "invalid_response"
+    return "error"
+
+
+def _validate_tariff_data(tariff_data: Any) -> None:
+    """
+    Проверяет, что ответ OpenAI соответствует схеме recommend_tariff.
+    
+    Args:
+        tariff_data: Разобранные аргументы вызова recommend_tariff
+        
+    Raises:
+        ValueError: Ответ не соответствует схеме
+    """
+    if not isinstance(tariff_data, dict):
+        raise ValueError("ответ OpenAI не является объектом")
+    for field in ("recommendation", "explanation"):
+        if not isinstance(tariff_data.get(field), str):
+            raise ValueError(f"в ответе OpenAI нет строки {field}")
+    
+    tariffs = tariff_data.get("tariffs")
+    if not isinstance(tariffs, list) or not tariffs:
+        raise ValueError("в ответе OpenAI нет списка тарифов")
+    for tariff in tariffs:
+        if not isinstance(tariff, dict):
+            raise ValueError("тариф в ответе OpenAI не является объектом")
+        if not isinstance(tariff.get("name"), str) or not isinstance(tariff.get("description"), str):
+            raise ValueError("у тарифа в ответе OpenAI нет названия или описания")
+        price = tariff.get("price")
+        if isinstance(price, bool) or not isinstance(price, (int, float)):
+            raise ValueError(f"у тарифа «{tariff['name']}» в ответе OpenAI нет числовой цены")
+        if not isinstance(tariff.get("features"), list):
+            raise ValueError(f"у тарифа «{tariff['name']}» в ответе OpenAI нет списка функций")
+
+
+def _record_first_text(mode: str, elapsed: float) -> None:
+    """
+    Учитывает время от запроса до первого текста, который увидит пользователь.
+    
+    Args:
+        mode: "stream" или "batch"
+        elapsed: Время в секундах
+    """
+    stats = _first_text_stats[mode]
+    stats["count"] += 1
+    stats["total"] += elapsed
+    stats["max"] = max(stats["max"], elapsed)
+    logger.info(f"Время до первого текста рекомендации ({mode}): {elapsed:.2f} с")
+
+
+def get_llm_metrics() -> Dict[str, Any]:
+    """
+    Возвращает метрики вызовов OpenAI.
+    
+    Returns:
+        Словарь со счетчиками исходов вызовов и состоянием предохранителя
+    """
+    metrics = llm.get_metrics()
+    metrics["single_flight"] = single_flight.get_metrics()
+    metrics["routing"] = router.get_metrics()
+    metrics["first_text"] = {
+        mode: {
+            "count": int(stats["count"]),
+            "avg": stats["total"] / stats["count"] if stats["count"] else 0.0,
+            "max": stats["max"]
+        }
+        for mode, stats in _first_text_stats.items()
+    }
+    return metrics
+
+
+def get_recommendation_cache_metrics() -> Dict[str, Any]:
+    """
+    Возвращает метрики кэша рекомендаций.
+    
+    Returns:
+        Словарь с метриками кэша
+    """
+    metrics = recommendation_cache.get_metrics()
+    metrics["semantic"] = semantic_cache.get_metrics()
+    metrics["distilled"] = distilled.get_metrics()
+    return metrics
@@ -0,0 +1,116 @@
+"""
+Модуль ограничения скорости отправки сообщений (token bucket).
+"""
+import time
+import asyncio
+from typing import Dict, Optional
+
+from config import TELEGRAM_RATE_LIMIT, TELEGRAM_CHAT_INTERVAL
+
+
+class TokenBucket:
+    """
+    Асинхронный token bucket.
+
+    Токены пополняются со скоростью rate в секунду до емкости capacity.
+    Каждая отправка забирает один токен; при пустом ведре acquire() ждет.
+    Ведро можно поставить на паузу, например по TelegramRetryAfter.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        """
+        Args:
+            rate: Скорость пополнения в токенах в секунду
+            capacity: Емкость ведра (по умолчанию равна rate, то есть всплеск не больше секунды)
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """
+        Забирает один токен, при необходимости дожидаясь его появления.
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """
+        Останавливает выдачу токенов на указанное время.
+
+        Args:
+            seconds: Длительность паузы в секундах
+        """
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+
+class ChatRateLimiter:
+    """
+    Ограничитель частоты сообщений в один чат.
+
+    Между двумя сообщениями в один и тот же чат выдерживается интервал
+    не меньше interval секунд. Давно неактивные чаты периодически удаляются,
+    чтобы словарь не рос бесконечно.
+    """
+
+    # Размер словаря, при превышении которого удаляются устаревшие записи
+    PRUNE_THRESHOLD = 10000
+
+    def __init__(self, interval: float) -> None:
+        """
+        Args:
+            interval: Минимальный интервал между сообщениями в один чат в секундах
+        """
+        self.interval = interval
+        self._next_allowed: Dict[int, float] = {}
+
+    async def acquire(self, chat_id: int) -> None:
+        """
+        Дожидается момента, когда в чат можно отправить следующее сообщение.
+
+        Args:
+            chat_id: ID чата
+        """
+        now = time.monotonic()
+        # Резервируем слот заранее, чтобы параллельные отправки в чат выстроились в очередь
+        allowed_at = max(now, self._next_allowed.get(chat_id, 0.0))
+        self._next_allowed[chat_id] = allowed_at + self.interval
+
+        if len(self._next_allowed) > self.PRUNE_THRESHOLD:
+            self._prune(now)
+
+        if allowed_at > now:
+            await asyncio.sleep(allowed_at - now)
+
+    def _prune(self, now: float) -> None:
+        """
+        Удаляет чаты, ограничение для которых уже истекло.
+        """
+        self._next_allowed = {
+            chat_id: allowed_at
+            for chat_id, allowed_at in self._next_allowed.items()
+            if allowed_at > now
+        }
+
+
+# Общий лимит бота на отправку сообщений: Telegram допускает около 30 сообщений в секунду
+telegram_limiter = TokenBucket(TELEGRAM_RATE_LIMIT)
+
+# Лимит на сообщения в один чат
+chat_limiter = ChatRateLimiter(TELEGRAM_CHAT_INTERVAL)
@@ -0,0 +1,198 @@
+"""
+Кэш рекомендаций тарифов по нормализованным ответам онбординга.
+"""
+import re
+import json
+import time
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional
+
+from config import RECOMMENDATION_CACHE_SIZE, RECOMMENDATION_CACHE_TTL, RECOMMENDATION_CACHE_MAX_ROWS
+from database import db
+from database.cache import LRUCache, MISSING
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+
+# Символы, которые не влияют на смысл ответа (пунктуация, кавычки, эмодзи)
+_NOISE_RE = re.compile(r"[^\w\s+-]+")
+_SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Приводит текст ответа к нижнему регистру без пунктуации и лишних пробелов.
+
+    Args:
+        text: Текст ответа
+
+    Returns:
+        Нормализованный текст
+    """
+    text = _NOISE_RE.sub(" ", str(text).lower().replace("ё", "е"))
+    return _SPACES_RE.sub(" ", text).strip()
+
+
+def normalize_answers(answers: List[Dict[str, Any]]) -> str:
+    """
+    Приводит ответы к каноническому виду для ключа кэша.
+
+    Ответы упорядочиваются по ID вопроса, текст приводится к нижнему регистру,
+    пунктуация удаляется, пробелы схлопываются.
+
+    Args:
+        answers: Ответы пользователя из db.get_user_answers
+
+    Returns:
+        Нормализованные ответы в виде JSON
+    """
+    normalized = []
+    for answer in sorted(answers, key=lambda item: item["id"]):
+        normalized.append([answer["id"], normalize_text(answer["answer"])])
+    return json.dumps(normalized, ensure_ascii=False, separators=(",", ":"))
+
+
+class RecommendationCache:
+    """
+    Двухуровневый кэш рекомендаций: LRU в памяти поверх таблицы recommendation_cache.
+
+    Ключ - хэш от версии промпта (fingerprint) и нормализованных ответов,
+    поэтому при смене промпта, схемы ответа или модели старые записи
+    перестают совпадать и удаляются при очистке. Записи старше ttl
+    не используются, в базе хранится не больше max_rows самых новых записей.
+    """
+
+    def __init__(
+        self,
+        fingerprint: str,
+        max_size: int = RECOMMENDATION_CACHE_SIZE,
+        ttl: float = RECOMMENDATION_CACHE_TTL,
+        max_rows: int = RECOMMENDATION_CACHE_MAX_ROWS
+    ) -> None:
+        """
+        Args:
+            fingerprint: Версия промпта и модели
+            max_size: Максимум записей в памяти (0 - кэш выключен)
+            ttl: Время жизни записи в секундах
+            max_rows: Максимум записей в базе данных
+        """
+        self.fingerprint = fingerprint
+        self.enabled = max_size > 0
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._memory = LRUCache(max_size, ttl)
+
+        # Счетчики
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self._pruned = False
+
+    def make_key(self, normalized_answers: str) -> str:
+        """
+        Вычисляет ключ кэша для нормализованных ответов.
+
+        Args:
+            normalized_answers: Результат normalize_answers
+
+        Returns:
+            Ключ кэша
+        """
+        return hashlib.sha256(f"{self.fingerprint}\n{normalized_answers}".encode("utf-8")).hexdigest()
+
+    async def get(self, normalized_answers: str) -> Optional[Dict[str, Any]]:
+        """
+        Ищет рекомендацию сначала в памяти, затем в базе данных.
+
+        Args:
+            normalized_answers: Результат normalize_answers
+
+        Returns:
+            Рекомендация или None при промахе
+        """
+        if not self.enabled:
+            return None
+        await self._prune_once()
+
+        key = self.make_key(normalized_answers)
+        cached = self._memory.get(key)
+        if cached is not MISSING:
+            self.memory_hits += 1
+            return cached
+
+        cached = await db.get_cached_recommendation(key, self._min_created_at())
+        if cached is not None:
+            self.db_hits += 1
+            self._memory.set(key, cached)
+            return cached
+
+        self.misses += 1
+        return None
+
+    async def set(self, normalized_answers: str, result: Dict[str, Any]) -> None:
+        """
+        Сохраняет рекомендацию в памяти и в базе данных.
+
+        Args:
+            normalized_answers: Результат normalize_answers
+            result: Рекомендация тарифов
+        """
+        if not self.enabled:
+            return
+
+        key = self.make_key(normalized_answers)
+        self._memory.set(key, result)
+        await db.save_cached_recommendation(key, self.fingerprint, normalized_answers, result)
+        self.stores += 1
+
+        # Размер таблицы проверяем периодически, а не на каждую запись
+        if self.stores % 100 == 0:
+            await self.prune()
+
+    async def prune(self) -> int:
+        """
+        Удаляет из базы записи старой версии промпта, устаревшие и лишние записи.
+
+        Returns:
+            Количество оставшихся записей
+        """
+        remaining = await db.prune_recommendation_cache(self.fingerprint, self._min_created_at(), self.max_rows)
+        self._pruned = True
+        return remaining
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Возвращает метрики кэша рекомендаций.
+
+        Returns:
+            Словарь с попаданиями в память и в базу, промахами и долей попаданий
+        """
+        hits = self.memory_hits + self.db_hits
+        lookups = hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "fingerprint": self.fingerprint,
+            "memory_size": len(self._memory),
+            "memory_max_size": self._memory.max_size,
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_rate": hits / lookups if lookups else 0.0
+        }
+
+    async def _prune_once(self) -> None:
+        """
+        При первом обращении удаляет записи, оставшиеся от прежней версии промпта.
+        """
+        if not self._pruned:
+            remaining = await self.prune()
+            logger.info(f"Кэш рекомендаций {self.fingerprint}: в базе {remaining} записей.")
+
+    def _min_created_at(self) -> int:
+        """
+        Возвращает минимальное время создания актуальной записи (epoch).
+        """
+        return int(time.time() - self.ttl) if self.ttl else 0
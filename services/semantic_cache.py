@@ -0,0 +1,371 @@
+"""
+Кэш рекомендаций по похожим свободным ответам онбординга.
+"""
+import re
+import json
+import math
+import time
+import zlib
+import asyncio
+import logging
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import (
+    ONBOARDING_QUESTIONS, RECOMMENDATION_CACHE_TTL, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_MAX_ENTRIES
+)
+from database import db
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+
+# Размерность векторов (количество корзин хэширования признаков)
+DIMENSIONS = 2 ** 12
+
+# Длины символьных n-грамм внутри слова
+NGRAM_SIZES = (3, 4, 5)
+
+# Вопросы со свободным ответом; ответы на остальные вопросы должны совпадать точно
+FREE_TEXT_QUESTIONS = frozenset(question["id"] for question in ONBOARDING_QUESTIONS if question["type"] == "text")
+
+_WORD_RE = re.compile(r"\w+")
+
+# Разреженный вектор: номера корзин и частоты признаков
+SparseVector = Tuple[np.ndarray, np.ndarray]
+
+
+def vectorize(text: str, dimensions: int = DIMENSIONS) -> SparseVector:
+    """
+    Превращает текст в разреженный вектор частот хэшированных признаков.
+
+    Признаки - слова целиком и символьные n-граммы слов с границами
+    (" excel " дает " ex", "exc", ...), поэтому "эксель" и "excel" не
+    совпадут, а "розница" и "розничная торговля" будут похожи.
+    Частоты сглаживаются как 1 + log(tf).
+
+    Args:
+        text: Текст ответа
+        dimensions: Количество корзин хэширования
+
+    Returns:
+        Номера корзин и веса признаков
+    """
+    counts: Counter = Counter()
+    for word in _WORD_RE.findall(text.lower().replace("ё", "е")):
+        counts[zlib.crc32(word.encode("utf-8")) % dimensions] += 1
+        padded = f" {word} "
+        for size in NGRAM_SIZES:
+            for start in range(len(padded) - size + 1):
+                counts[zlib.crc32(padded[start:start + size].encode("utf-8")) % dimensions] += 1
+
+    indices = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+    values = np.fromiter((1.0 + math.log(count) for count in counts.values()), dtype=np.float32, count=len(counts))
+    return indices, values
+
+
+def split_answers(answers: List[Any]) -> Tuple[str, Dict[int, str]]:
+    """
+    Разделяет ответы на точно совпадающую часть и свободные ответы.
+
+    Args:
+        answers: Ответы из db.get_user_answers или пары [id, текст] из normalize_answers
+
+    Returns:
+        Ключ структурированных ответов и свободные ответы по ID вопроса
+    """
+    structured = []
+    free_text: Dict[int, str] = {}
+    for answer in answers:
+        question_id, text = (answer["id"], answer["answer"]) if isinstance(answer, dict) else answer
+        if question_id in FREE_TEXT_QUESTIONS:
+            free_text[question_id] = str(text)
+        else:
+            structured.append([question_id, str(text).strip().lower()])
+    return json.dumps(sorted(structured), ensure_ascii=False), free_text
+
+
+class _Entry:
+    """
+    Проанализированный набор ответов в индексе.
+    """
+
+    __slots__ = ("group", "vectors", "result", "created_at")
+
+    def __init__(self, group: str, vectors: Dict[int, SparseVector], result: Dict[str, Any],
+                 created_at: float) -> None:
+        self.group = group
+        self.vectors = vectors
+        self.result = result
+        self.created_at = created_at
+
+
+class SemanticIndex:
+    """
+    Индекс ближайших соседей по свободным ответам с весами TF-IDF.
+
+    Записи сгруппированы по структурированным ответам: сравниваются только
+    наборы с одинаковыми вариантами ответов. Похожесть двух наборов -
+    минимальный по свободным вопросам косинус векторов TF-IDF, то есть
+    похожими должны быть все свободные ответы. IDF считается по всем
+    записям индекса и обновляется при добавлении и вытеснении.
+    """
+
+    def __init__(self, max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES) -> None:
+        """
+        Args:
+            max_entries: Максимум записей; при превышении вытесняются самые старые
+        """
+        self.max_entries = max(1, max_entries)
+        self._groups: Dict[str, List[_Entry]] = {}
+        self._order: Deque[_Entry] = deque()
+        self._document_frequency = {question_id: np.zeros(DIMENSIONS, dtype=np.float64)
+                                    for question_id in FREE_TEXT_QUESTIONS}
+        # Плотные матрицы частот групп, пересобираются после изменения группы
+        self._matrices: Dict[Tuple[str, int], Tuple[np.ndarray, np.ndarray]] = {}
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def add(self, answers: List[Any], result: Dict[str, Any], created_at: Optional[float] = None) -> None:
+        """
+        Добавляет проанализированный набор ответов.
+
+        Args:
+            answers: Ответы пользователя
+            result: Рекомендация тарифов для этих ответов
+            created_at: Время анализа (epoch), по умолчанию текущее
+        """
+        group, free_text = split_answers(answers)
+        vectors = {question_id: vectorize(free_text.get(question_id, "")) for question_id in FREE_TEXT_QUESTIONS}
+        entry = _Entry(group, vectors, result, created_at if created_at is not None else time.time())
+
+        self._groups.setdefault(group, []).append(entry)
+        self._order.append(entry)
+        self._update_frequency(entry, 1)
+
+        while len(self._order) > self.max_entries:
+            self.remove(self._order[0])
+
+    def remove(self, entry: _Entry) -> None:
+        """
+        Удаляет запись из индекса.
+
+        Args:
+            entry: Запись индекса
+        """
+        self._order.remove(entry)
+        group = self._groups[entry.group]
+        group.remove(entry)
+        if not group:
+            del self._groups[entry.group]
+        self._update_frequency(entry, -1)
+
+    def nearest(self, answers: List[Any], min_created_at: float = 0) -> Optional[Tuple[float, _Entry]]:
+        """
+        Находит самый похожий набор ответов с теми же структурированными ответами.
+
+        Args:
+            answers: Ответы пользователя
+            min_created_at: Записи старше этого времени (epoch) не рассматриваются
+
+        Returns:
+            Похожесть от 0 до 1 и запись или None, если сравнивать не с чем
+        """
+        group, free_text = split_answers(answers)
+        entries = self._groups.get(group)
+        if not entries:
+            return None
+
+        similarity = np.ones(len(entries), dtype=np.float64)
+        for question_id in FREE_TEXT_QUESTIONS:
+            similarity = np.minimum(
+                similarity, self._similarity(group, entries, question_id, free_text.get(question_id, ""))
+            )
+
+        fresh = np.fromiter((entry.created_at >= min_created_at for entry in entries), dtype=bool, count=len(entries))
+        similarity[~fresh] = -1.0
+        best = int(np.argmax(similarity))
+        if similarity[best] < 0:
+            return None
+        return float(similarity[best]), entries[best]
+
+    def _similarity(self, group: str, entries: List[_Entry], question_id: int, text: str) -> np.ndarray:
+        """
+        Косинусная похожесть ответа на вопрос question_id с ответами записей группы.
+        """
+        idf = np.log((1 + len(self._order)) / (1 + self._document_frequency[question_id])) + 1
+        idf_squared = (idf * idf).astype(np.float32)
+        matrix, matrix_squared = self._matrix(group, entries, question_id)
+        norms = np.sqrt(matrix_squared @ idf_squared)
+
+        indices, values = vectorize(text)
+        query_norm = float(np.sqrt(np.sum(values * values * idf_squared[indices])))
+        if query_norm == 0:
+            # Пустой ответ похож только на пустой
+            return (norms == 0).astype(np.float64)
+
+        # Скалярное произведение считается только по признакам запроса
+        dot = matrix[:, indices] @ (values * idf_squared[indices])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            similarity = dot / (norms * query_norm)
+        return np.nan_to_num(similarity, nan=0.0)
+
+    def _matrix(self, group: str, entries: List[_Entry], question_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Возвращает плотную матрицу частот признаков ответов группы и ее поэлементный квадрат.
+        """
+        key = (group, question_id)
+        cached = self._matrices.get(key)
+        if cached is None or cached[0].shape[0] != len(entries):
+            matrix = np.zeros((len(entries), DIMENSIONS), dtype=np.float32)
+            for row, entry in enumerate(entries):
+                indices, values = entry.vectors[question_id]
+                matrix[row, indices] = values
+            cached = (matrix, matrix * matrix)
+            self._matrices[key] = cached
+        return cached
+
+    def _update_frequency(self, entry: _Entry, delta: int) -> None:
+        """
+        Обновляет документные частоты признаков и сбрасывает матрицу группы.
+        """
+        for question_id, (indices, _) in entry.vectors.items():
+            self._document_frequency[question_id][indices] += delta
+            self._matrices.pop((entry.group, question_id), None)
+
+
+class SemanticCache:
+    """
+    Кэш рекомендаций по похожим ответам.
+
+    Дополняет точный кэш (services/recommendation_cache.py): если варианты
+    ответов совпадают, а свободные ответы похожи не меньше чем на threshold,
+    используется рекомендация, ранее полученная от OpenAI. Индекс строится
+    при первом обращении по таблице recommendation_cache текущей версии
+    промпта и пополняется новыми рекомендациями OpenAI.
+    """
+
+    def __init__(
+        self,
+        fingerprint: str,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+        ttl: float = RECOMMENDATION_CACHE_TTL
+    ) -> None:
+        """
+        Args:
+            fingerprint: Версия промпта и модели
+            threshold: Минимальная похожесть от 0 до 1 (больше 1 - кэш выключен)
+            max_entries: Максимум наборов ответов в индексе
+            ttl: Время жизни записи в секундах
+        """
+        self.fingerprint = fingerprint
+        self.enabled = threshold <= 1 and max_entries > 0
+        self.threshold = threshold
+        self.ttl = ttl
+        self.index = SemanticIndex(max_entries)
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+
+        # Счетчики
+        self.hits = 0
+        self.misses = 0
+        self._total_similarity = 0.0
+
+    async def get(self, answers: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Ищет рекомендацию для похожих ответов.
+
+        Args:
+            answers: Ответы пользователя
+
+        Returns:
+            Рекомендация или None, если похожих ответов нет
+        """
+        if not self.enabled:
+            return None
+        if not await self._load_once():
+            self.misses += 1
+            return None
+
+        found = self.index.nearest(answers, self._min_created_at())
+        if found is None or found[0] < self.threshold:
+            self.misses += 1
+            return None
+
+        similarity, entry = found
+        self.hits += 1
+        self._total_similarity += similarity
+        logger.info(f"Рекомендация взята для похожих ответов (похожесть {similarity:.2f}).")
+        return entry.result
+
+    def add(self, answers: List[Dict[str, Any]], result: Dict[str, Any]) -> None:
+        """
+        Добавляет рекомендацию OpenAI в индекс.
+
+        Args:
+            answers: Ответы пользователя
+            result: Рекомендация тарифов
+        """
+        if self.enabled and self._loaded:
+            self.index.add(answers, result)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Возвращает метрики кэша по похожим ответам.
+
+        Returns:
+            Словарь с размером индекса, попаданиями, промахами и средней похожестью попаданий
+        """
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "size": len(self.index),
+            "max_size": self.index.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "avg_similarity": self._total_similarity / self.hits if self.hits else 0.0
+        }
+
+    async def _load_once(self) -> bool:
+        """
+        При первом обращении строит индекс по сохраненным рекомендациям.
+
+        Одновременные первые обращения ждут одной загрузки. Если чтение из
+        базы не удалось, индекс не считается построенным и загрузка
+        повторяется при следующем обращении.
+
+        Returns:
+            True, если индекс построен
+        """
+        if self._loaded:
+            return True
+
+        async with self._load_lock:
+            if self._loaded:
+                return True
+            try:
+                rows = await db.get_cached_recommendations(
+                    self.fingerprint, self._min_created_at(), self.index.max_entries
+                )
+            except Exception:
+                return False
+
+            started = time.monotonic()
+            for row in rows:
+                self.index.add(json.loads(row["answers"]), json.loads(row["result"]), row["created_at"])
+            self._loaded = True
+            logger.info(
+                f"Индекс похожих ответов построен: {len(self.index)} записей за {time.monotonic() - started:.2f} с."
+            )
+            return True
+
+    def _min_created_at(self) -> int:
+        """
+        Возвращает минимальное время создания актуальной записи (epoch).
+        """
+        return int(time.time() - self.ttl) if self.ttl else 0
@@ -0,0 +1,198 @@
+"""
+Модуль параллельной отправки сообщений с ограничением скорости и повторами.
+"""
+import time
+import random
+import asyncio
+import logging
+from typing import Any, AsyncIterable, Awaitable, Callable, Dict, Iterable, TypeVar, Union
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError, TelegramForbiddenError, TelegramNetworkError,
+    TelegramRetryAfter, TelegramServerError
+)
+
+from config import SEND_MAX_RETRIES, SEND_RETRY_BASE_DELAY
+from services.rate_limit import ChatRateLimiter, TokenBucket, chat_limiter, telegram_limiter
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+
+# Результаты отправки
+SENT = "sent"
+FAILED = "failed"
+BLOCKED = "blocked"
+
+# Статистика последних запусков рассылок по имени (для админ-панели)
+last_runs: Dict[str, Dict[str, Any]] = {}
+
+T = TypeVar("T")
+
+# Маркер окончания элементов для общего итератора
+_DONE = object()
+
+
+class MessageSender:
+    """
+    Отправитель сообщений с общим и поканальным ограничением скорости.
+
+    Каждая отправка берет токен из общего token bucket бота и выдерживает
+    интервал между сообщениями в один чат. TelegramRetryAfter ставит на паузу
+    все отправки бота, сетевые и серверные ошибки повторяются с
+    экспоненциальной задержкой и случайным разбросом.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        limiter: TokenBucket = telegram_limiter,
+        per_chat_limiter: ChatRateLimiter = chat_limiter,
+        max_retries: int = SEND_MAX_RETRIES,
+        base_delay: float = SEND_RETRY_BASE_DELAY
+    ) -> None:
+        """
+        Args:
+            bot: Экземпляр бота для отправки сообщений
+            limiter: Общий ограничитель скорости бота
+            per_chat_limiter: Ограничитель частоты сообщений в один чат
+            max_retries: Максимальное количество повторов при временных ошибках
+            base_delay: Базовая задержка перед повтором в секундах
+        """
+        self.bot = bot
+        self.limiter = limiter
+        self.per_chat_limiter = per_chat_limiter
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.retries = 0
+
+    async def send_message(self, chat_id: int, text: str, **kwargs: Any) -> str:
+        """
+        Отправляет сообщение с соблюдением лимитов и повторами.
+
+        Args:
+            chat_id: ID чата
+            text: Текст сообщения
+            **kwargs: Дополнительные параметры bot.send_message (например, reply_markup)
+
+        Returns:
+            Результат отправки: SENT, FAILED или BLOCKED
+        """
+        attempt = 0
+        while True:
+            await self.per_chat_limiter.acquire(chat_id)
+            await self.limiter.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                return SENT
+            except TelegramRetryAfter as e:
+                # Telegram просит подождать: останавливаем все отправки бота
+                logger.warning(f"Flood control при отправке в чат {chat_id}, пауза {e.retry_after} с.")
+                self.limiter.pause(e.retry_after)
+            except TelegramForbiddenError:
+                return BLOCKED
+            except (TelegramNetworkError, TelegramServerError) as e:
+                if attempt >= self.max_retries:
+                    logger.error(f"Не удалось отправить сообщение в чат {chat_id} после {attempt} повторов: {e}")
+                    return FAILED
+                delay = self.base_delay * (2 ** attempt) * random.uniform(0.5, 1.5)
+                logger.warning(f"Временная ошибка отправки в чат {chat_id}, повтор через {delay:.1f} с: {e}")
+                await asyncio.sleep(delay)
+            except TelegramAPIError as e:
+                logger.error(f"Ошибка при отправке сообщения в чат {chat_id}: {e}")
+                return FAILED
+
+            attempt += 1
+            self.retries += 1
+
+    async def fan_out(
+        self,
+        name: str,
+        items: Union[Iterable[T], AsyncIterable[T]],
+        send_one: Callable[[T], Awaitable[str]],
+        concurrency: int
+    ) -> Dict[str, Any]:
+        """
+        Обрабатывает элементы пулом из concurrency параллельных отправителей.
+
+        Args:
+            name: Имя запуска для логов и статистики
+            items: Элементы для обработки (например, пользователи), в том числе асинхронный поток
+            send_one: Корутина, обрабатывающая один элемент и возвращающая результат отправки
+            concurrency: Количество параллельных отправителей
+
+        Returns:
+            Статистика запуска: sent, failed, blocked, retries, duration
+        """
+        stats = {SENT: 0, FAILED: 0, BLOCKED: 0}
+        retries_before = self.retries
+        started = time.monotonic()
+        next_item = _shared_iterator(items)
+
+        async def worker() -> None:
+            # Общий итератор: отправители по очереди забирают следующий элемент
+            while (item := await next_item()) is not _DONE:
+                try:
+                    outcome = await send_one(item)
+                except Exception as e:
+                    logger.error(f"Ошибка при обработке элемента рассылки {name}: {e}")
+                    outcome = FAILED
+                stats[outcome] += 1
+
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+
+        result = {
+            "sent": stats[SENT],
+            "failed": stats[FAILED],
+            "blocked": stats[BLOCKED],
+            "retries": self.retries - retries_before,
+            "duration": time.monotonic() - started,
+            "finished_at": time.time()
+        }
+        last_runs[name] = result
+        logger.info(
+            f"Рассылка {name}: отправлено {result['sent']}, ошибок {result['failed']}, "
+            f"заблокировали бота {result['blocked']}, повторов {result['retries']}, "
+            f"за {result['duration']:.1f} с."
+        )
+        return result
+
+
+def _shared_iterator(items: Union[Iterable[T], AsyncIterable[T]]) -> Callable[[], Awaitable[Any]]:
+    """
+    Оборачивает обычный или асинхронный итератор для безопасного чтения
+    несколькими отправителями одновременно.
+
+    Returns:
+        Корутинная функция, возвращающая следующий элемент или _DONE
+    """
+    if hasattr(items, "__aiter__"):
+        async_iterator = items.__aiter__()
+        lock = asyncio.Lock()
+
+        async def next_async() -> Any:
+            # Асинхронный генератор нельзя продвигать из нескольких задач одновременно
+            async with lock:
+                try:
+                    return await async_iterator.__anext__()
+                except StopAsyncIteration:
+                    return _DONE
+
+        return next_async
+
+    iterator = iter(items)
+
+    async def next_sync() -> Any:
+        return next(iterator, _DONE)
+
+    return next_sync
+
+
+def get_last_runs() -> Dict[str, Dict[str, Any]]:
+    """
+    Возвращает статистику последних запусков рассылок по имени.
+
+    Returns:
+        Словарь {имя: статистика}
+    """
+    return dict(last_runs)
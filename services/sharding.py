@@ -0,0 +1,660 @@
+"""
+Распределение апдейтов по процессам-обработчикам (шардам) по ID пользователя.
+"""
+import os
+import time
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Connection
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set
+
+from config import (
+    ADMIN_IDS, SHARDS, SHARD_QUEUE_SIZE, SHARD_CONCURRENCY, SHARD_HEARTBEAT_INTERVAL, SHARD_HEARTBEAT_TIMEOUT
+)
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+
+# Максимум апдейтов в одной передаче процессу
+BATCH_SIZE = 100
+
+# Задержка перед повторной передачей, если процесс недоступен, в секундах
+RESEND_DELAY = 0.5
+
+# Задержка перезапуска удваивается при падениях подряд, но не больше этого значения
+MAX_RESTART_DELAY = 30.0
+
+# Время на запуск процесса (импорт модулей, открытие базы) до первого отчета, в секундах
+STARTUP_TIMEOUT = 120.0
+
+# Процесс, проработавший дольше этого, считается стабильным: задержка перезапуска сбрасывается
+STABLE_UPTIME = 60.0
+
+# Сколько секунд ждать обработки принятых апдейтов при остановке процесса
+DRAIN_TIMEOUT = 10.0
+
+# Период записи метрик шардов в лог, в секундах
+METRICS_LOG_INTERVAL = 60.0
+
+# Обработчик апдейта: получает апдейт в виде словаря, как его присылает Telegram
+UpdateHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+# Функция процесса-обработчика: target(shard, shards, updates_conn, status_conn)
+ShardTarget = Callable[[int, int, Connection, Connection], None]
+
+
+def update_user_id(update: Dict[str, Any]) -> Optional[int]:
+    """
+    Определяет ID пользователя - автора апдейта.
+
+    Args:
+        update: Апдейт в виде словаря
+
+    Returns:
+        ID пользователя, ID чата для событий без автора или None (например, для опроса)
+    """
+    for key, event in update.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        user = event.get("from") or event.get("user")
+        if isinstance(user, dict) and "id" in user:
+            return user["id"]
+        chat = event.get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return None
+
+
+def shard_for_user(user_id: int, shards: int) -> int:
+    """
+    Возвращает номер шарда, который обрабатывает пользователя.
+
+    Администраторы всегда обрабатываются шардом 0: там же работают фоновые
+    задачи и рассылки, которые они запускают.
+
+    Args:
+        user_id: ID пользователя
+        shards: Количество шардов
+
+    Returns:
+        Номер шарда от 0 до shards - 1
+    """
+    if user_id in ADMIN_IDS:
+        return 0
+    return hash(user_id) % shards
+
+
+def shard_for_update(update: Dict[str, Any], shards: int) -> int:
+    """
+    Возвращает номер шарда для апдейта.
+
+    Args:
+        update: Апдейт в виде словаря
+        shards: Количество шардов
+
+    Returns:
+        Номер шарда; апдейты без автора распределяются по update_id
+    """
+    user_id = update_user_id(update)
+    if user_id is None:
+        return update.get("update_id", 0) % shards
+    return shard_for_user(user_id, shards)
+
+
+class UserOrderedExecutor:
+    """
+    Параллельная обработка апдейтов с сохранением порядка для каждого пользователя.
+
+    Апдейты разных пользователей обрабатываются одновременно (не больше
+    concurrency), апдейты одного пользователя - строго по очереди в порядке
+    поступления, поэтому переходы FSM пользователя не перемешиваются.
+    """
+
+    def __init__(
+        self,
+        handler: UpdateHandler,
+        concurrency: int = SHARD_CONCURRENCY,
+        max_pending: int = SHARD_QUEUE_SIZE
+    ) -> None:
+        """
+        Args:
+            handler: Обработчик апдейта
+            concurrency: Максимум одновременно обрабатываемых апдейтов
+            max_pending: Максимум принятых, но не обработанных апдейтов
+        """
+        self.handler = handler
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._slots = asyncio.Semaphore(max(1, max_pending))
+        # Последняя задача каждого пользователя: следующая ждет ее завершения
+        self._tails: Dict[Hashable, asyncio.Task] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+        # Счетчики
+        self.processed = 0
+        self.failed = 0
+        self.in_progress = 0
+        self._total_latency = 0.0
+        self._max_latency = 0.0
+
+    async def submit(self, update: Dict[str, Any]) -> None:
+        """
+        Принимает апдейт в обработку; ждет, если принято max_pending апдейтов.
+
+        Args:
+            update: Апдейт в виде словаря
+        """
+        await self._slots.acquire()
+        user_id = update_user_id(update)
+        key = user_id if user_id is not None else ("update", update.get("update_id"))
+        task = asyncio.create_task(self._run(key, update, self._tails.get(key), time.monotonic()))
+        self._tails[key] = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def join(self, timeout: float = DRAIN_TIMEOUT) -> None:
+        """
+        Дожидается обработки принятых апдейтов.
+
+        Args:
+            timeout: Максимальное время ожидания в секундах
+        """
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+        if self._tasks:
+            logger.warning(f"Не дождались обработки {len(self._tasks)} апдейтов.")
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Возвращает метрики обработки.
+
+        Returns:
+            Словарь с количеством принятых и обрабатываемых апдейтов, счетчиками
+            и временем от приема апдейта до конца обработки
+        """
+        done = self.processed + self.failed
+        return {
+            "pending": len(self._tasks),
+            "in_progress": self.in_progress,
+            "processed": self.processed,
+            "failed": self.failed,
+            "avg_latency": self._total_latency / done if done else 0.0,
+            "max_latency": self._max_latency
+        }
+
+    async def _run(self, key: Hashable, update: Dict[str, Any], previous: Optional[asyncio.Task],
+                   accepted_at: float) -> None:
+        """
+        Обрабатывает апдейт после завершения предыдущего апдейта того же пользователя.
+        """
+        try:
+            if previous is not None:
+                # asyncio.wait не пробрасывает исключения предыдущей задачи
+                await asyncio.wait([previous])
+            async with self._semaphore:
+                self.in_progress += 1
+                try:
+                    await self.handler(update)
+                    self.processed += 1
+                except Exception as e:
+                    self.failed += 1
+                    logger.error(f"Ошибка при обработке апдейта {update.get('update_id')}: {e}")
+                finally:
+                    self.in_progress -= 1
+        finally:
+            latency = time.monotonic() - accepted_at
+            self._total_latency += latency
+            self._max_latency = max(self._max_latency, latency)
+            if self._tails.get(key) is asyncio.current_task():
+                del self._tails[key]
+            self._slots.release()
+
+
+# Метрики всех шардов, которые супервизор присылает процессу (для /shardstats)
+_shard_report: Optional[Dict[str, Any]] = None
+
+# Пользователи, измененные в этом процессе, о которых еще не сообщено супервизору
+_changed_users: Set[int] = set()
+_changed_event: Optional[asyncio.Event] = None
+
+
+def publish_user_changed(user_id: int, fields: Dict[str, Any]) -> None:
+    """
+    Слушатель изменений пользователей: сообщает супервизору, что запись изменилась.
+
+    Супервизор передает изменение остальным шардам, и они сбрасывают
+    пользователя из кэша (например, после окончания триала в шарде 0).
+
+    Args:
+        user_id: ID пользователя
+        fields: Измененные поля
+    """
+    _changed_users.add(user_id)
+    if _changed_event is not None:
+        _changed_event.set()
+
+
+async def serve_shard(
+    shard: int,
+    updates_conn: Connection,
+    status_conn: Connection,
+    handler: UpdateHandler,
+    heartbeat_interval: float = SHARD_HEARTBEAT_INTERVAL,
+    on_invalidate: Optional[Callable[[List[int]], None]] = None
+) -> None:
+    """
+    Основной цикл процесса-обработчика: принимает апдейты от супервизора до команды остановки.
+
+    Args:
+        shard: Номер шарда
+        updates_conn: Канал от супервизора (апдейты, метрики, изменения пользователей, команда остановки)
+        status_conn: Канал к супервизору (отчеты о работе и изменения пользователей)
+        handler: Обработчик апдейта
+        heartbeat_interval: Период отчетов супервизору в секундах
+        on_invalidate: Вызывается с ID пользователей, которых изменили другие шарды
+    """
+    global _shard_report, _changed_event
+
+    executor = UserOrderedExecutor(handler)
+    loop = asyncio.get_running_loop()
+    # Отчеты и изменения пользователей отправляются из разных задач, а канал не потокобезопасен
+    send_lock = asyncio.Lock()
+
+    async def report(message: Any) -> None:
+        async with send_lock:
+            await loop.run_in_executor(None, status_conn.send, message)
+
+    async def heartbeat() -> None:
+        while True:
+            metrics = {"pid": os.getpid(), **executor.get_metrics()}
+            try:
+                await report(("heartbeat", metrics))
+            except (OSError, ValueError) as e:
+                logger.error(f"Не удалось отправить отчет супервизору: {e}")
+            await asyncio.sleep(heartbeat_interval)
+
+    async def publish_changes() -> None:
+        while True:
+            await _changed_event.wait()
+            _changed_event.clear()
+            user_ids = list(_changed_users)
+            _changed_users.clear()
+            try:
+                await report(("invalidate", user_ids))
+            except (OSError, ValueError) as e:
+                logger.error(f"Не удалось сообщить супервизору об изменении пользователей: {e}")
+
+    _changed_event = asyncio.Event()
+    if _changed_users:
+        _changed_event.set()
+    heartbeat_task = asyncio.create_task(heartbeat())
+    publish_task = asyncio.create_task(publish_changes())
+    logger.info(f"Шард {shard} готов к приему апдейтов.")
+    try:
+        while True:
+            try:
+                kind, payload = await loop.run_in_executor(None, updates_conn.recv)
+            except (EOFError, OSError):
+                logger.warning(f"Шард {shard}: супервизор закрыл канал, останавливаемся.")
+                break
+            if kind == "updates":
+                for update in payload:
+                    await executor.submit(update)
+            elif kind == "metrics":
+                _shard_report = payload
+            elif kind == "invalidate":
+                if on_invalidate is not None:
+                    on_invalidate(payload)
+            elif kind == "stop":
+                break
+    finally:
+        heartbeat_task.cancel()
+        publish_task.cancel()
+        await executor.join()
+        logger.info(f"Шард {shard} остановлен, обработано апдейтов: {executor.processed}.")
+
+
+def get_shard_report() -> Optional[Dict[str, Any]]:
+    """
+    Возвращает метрики всех шардов, последние присланные супервизором.
+
+    Returns:
+        Словарь с метриками или None, если бот запущен без supervisor.py
+    """
+    return _shard_report
+
+
+class _Shard:
+    """
+    Состояние процесса-обработчика на стороне супервизора.
+    """
+
+    def __init__(self, number: int, queue_size: int) -> None:
+        self.number = number
+        self.outbox: asyncio.Queue = asyncio.Queue(max(1, queue_size))
+        self.ready = asyncio.Event()
+        self.process: Optional[multiprocessing.process.BaseProcess] = None
+        self.updates_conn: Optional[Connection] = None
+        self.started_at = 0.0
+        self.last_heartbeat = 0.0
+        self.restarting = False
+        self.crashes_in_row = 0
+        self.restarts = 0
+        self.routed = 0
+        self.resent = 0
+        # Пользователи, измененные другими шардами: передаются процессу перед следующей пачкой
+        self.invalidations: Set[int] = set()
+        # Последний отчет процесса и счетчики процессов до перезапусков
+        self.report: Dict[str, Any] = {}
+        self.processed_before = 0
+        self.failed_before = 0
+        # Для вычисления скорости между проверками
+        self.last_routed = 0
+        self.last_processed = 0
+        self.rate_in = 0.0
+        self.rate_out = 0.0
+
+    @property
+    def processed(self) -> int:
+        return self.processed_before + self.report.get("processed", 0)
+
+    @property
+    def failed(self) -> int:
+        return self.failed_before + self.report.get("failed", 0)
+
+
+class ShardSupervisor:
+    """
+    Супервизор процессов-обработчиков.
+
+    Запускает shards процессов и передает каждому апдейты его пользователей
+    (shard_for_update) пачками через канал multiprocessing. Следит за
+    процессами: упавший или переставший присылать отчеты процесс
+    перезапускается с нарастающей задержкой, а непереданные апдейты
+    передаются новому процессу. Апдейты, которые процесс принял, но не
+    успел обработать до падения, теряются. Изменения записей пользователей,
+    о которых сообщает процесс, передаются остальным процессам, чтобы они
+    сбросили эти записи из кэша.
+    """
+
+    def __init__(
+        self,
+        target: ShardTarget,
+        shards: int = SHARDS,
+        queue_size: int = SHARD_QUEUE_SIZE,
+        heartbeat_interval: float = SHARD_HEARTBEAT_INTERVAL,
+        heartbeat_timeout: float = SHARD_HEARTBEAT_TIMEOUT
+    ) -> None:
+        """
+        Args:
+            target: Функция процесса-обработчика; процессы запускаются методом spawn,
+                поэтому функция должна импортироваться из модуля
+            shards: Количество процессов
+            queue_size: Максимум апдейтов в очереди к одному процессу
+            heartbeat_interval: Период проверки процессов в секундах
+            heartbeat_timeout: Процесс без отчета дольше этого перезапускается
+        """
+        self.target = target
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.shards = [_Shard(number, queue_size) for number in range(max(1, shards))]
+        # Метрики приема апдейтов (например, webhook-сервера) для отчета
+        self.ingest_metrics: Optional[Callable[[], Dict[str, Any]]] = None
+        self._context = multiprocessing.get_context("spawn")
+        # Потоки для блокирующих операций с каналами и процессами: на каждый шард чтение отчетов,
+        # передача апдейтов и ожидание завершения процесса при перезапуске
+        self._executor = ThreadPoolExecutor(max_workers=3 * len(self.shards), thread_name_prefix="shard")
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+    async def start(self) -> None:
+        """
+        Запускает процессы, передачу апдейтов и наблюдение за процессами.
+        """
+        for shard in self.shards:
+            self._spawn(shard)
+            self._tasks.append(asyncio.create_task(self._sender(shard)))
+        self._tasks.append(asyncio.create_task(self._monitor()))
+        logger.info(f"Запущено процессов-обработчиков: {len(self.shards)}.")
+
+    async def route(self, update: Dict[str, Any]) -> None:
+        """
+        Ставит апдейт в очередь его шарда; ждет, если очередь заполнена.
+
+        Args:
+            update: Апдейт в виде словаря
+        """
+        shard = self.shards[shard_for_update(update, len(self.shards))]
+        shard.routed += 1
+        await shard.outbox.put(update)
+
+    async def stop(self, timeout: float = DRAIN_TIMEOUT) -> None:
+        """
+        Передает оставшиеся апдейты и штатно останавливает процессы.
+
+        Args:
+            timeout: Сколько секунд ждать передачи очередей и остановки процессов
+        """
+        self._stopping = True
+        try:
+            await asyncio.wait_for(asyncio.gather(*(shard.outbox.join() for shard in self.shards)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Не все апдейты переданы процессам до остановки.")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        loop = asyncio.get_running_loop()
+        for shard in self.shards:
+            if shard.process is not None and shard.process.is_alive():
+                try:
+                    await loop.run_in_executor(self._executor, shard.updates_conn.send, ("stop", None))
+                except (OSError, ValueError):
+                    pass
+        for shard in self.shards:
+            if shard.process is None:
+                continue
+            # Процесс дорабатывает принятые апдейты и записывает состояния FSM
+            await loop.run_in_executor(self._executor, shard.process.join, timeout + DRAIN_TIMEOUT)
+            if shard.process.is_alive():
+                logger.warning(f"Шард {shard.number} не остановился вовремя, завершаем принудительно.")
+                shard.process.kill()
+            shard.updates_conn.close()
+        self._executor.shutdown(wait=False)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Возвращает метрики шардов.
+
+        Returns:
+            Словарь со списком шардов (состояние процесса, перезапуски, очередь,
+            счетчики, скорость приема и обработки, время с последнего отчета)
+            и метриками приема апдейтов
+        """
+        now = time.monotonic()
+        shards = []
+        for shard in self.shards:
+            shards.append({
+                "number": shard.number,
+                "alive": shard.process is not None and shard.process.is_alive() and not shard.restarting,
+                "pid": shard.process.pid if shard.process is not None else None,
+                "restarts": shard.restarts,
+                "queue": shard.outbox.qsize(),
+                "pending": shard.report.get("pending", 0),
+                "in_progress": shard.report.get("in_progress", 0),
+                "routed": shard.routed,
+                "processed": shard.processed,
+                "failed": shard.failed,
+                "resent": shard.resent,
+                "rate_in": shard.rate_in,
+                "rate_out": shard.rate_out,
+                "avg_latency": shard.report.get("avg_latency", 0.0),
+                "heartbeat_age": now - shard.last_heartbeat
+            })
+        return {
+            "shards": shards,
+            "ingest": self.ingest_metrics() if self.ingest_metrics is not None else None
+        }
+
+    def _spawn(self, shard: _Shard) -> None:
+        """
+        Запускает процесс шарда с новыми каналами.
+        """
+        updates_recv, updates_send = self._context.Pipe(duplex=False)
+        status_recv, status_send = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=self.target,
+            args=(shard.number, len(self.shards), updates_recv, status_send),
+            name=f"shard-{shard.number}"
+        )
+        process.start()
+        # Концы каналов процесса закрываем у себя, чтобы заметить его завершение
+        updates_recv.close()
+        status_send.close()
+
+        shard.process = process
+        shard.updates_conn = updates_send
+        shard.started_at = shard.last_heartbeat = time.monotonic()
+        shard.restarting = False
+        # Кэш нового процесса пуст, сбрасывать в нем нечего
+        shard.invalidations.clear()
+        asyncio.create_task(self._reader(shard, status_recv))
+        shard.ready.set()
+        logger.info(f"Шард {shard.number} запущен, pid {process.pid}.")
+
+    async def _reader(self, shard: _Shard, conn: Connection) -> None:
+        """
+        Читает отчеты процесса, пока канал открыт.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                kind, payload = await loop.run_in_executor(self._executor, conn.recv)
+                if kind == "heartbeat":
+                    shard.last_heartbeat = time.monotonic()
+                    shard.report = payload
+                elif kind == "invalidate":
+                    for other in self.shards:
+                        if other is not shard:
+                            other.invalidations.update(payload)
+        except (EOFError, OSError):
+            # Процесс завершился; перезапуском займется _monitor
+            pass
+        finally:
+            conn.close()
+
+    async def _sender(self, shard: _Shard) -> None:
+        """
+        Передает апдейты из очереди шарда процессу пачками, сохраняя порядок.
+
+        Элемент None в очереди - запрос на передачу метрик всех шардов.
+        Изменения пользователей от других шардов передаются перед пачкой,
+        чтобы ее апдейты не прочитали устаревшие записи из кэша; без апдейтов
+        они уходят вместе с запросом метрик, который _monitor ставит каждый период.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await shard.outbox.get()]
+            while len(batch) < BATCH_SIZE and not shard.outbox.empty() and batch[-1] is not None:
+                batch.append(shard.outbox.get_nowait())
+
+            updates = [update for update in batch if update is not None]
+            message = ("updates", updates) if updates else ("metrics", self.get_metrics())
+            while True:
+                await shard.ready.wait()
+                try:
+                    if shard.invalidations:
+                        # При ошибке передачи изменения не нужны: у перезапущенного процесса кэш пуст
+                        user_ids = list(shard.invalidations)
+                        shard.invalidations.clear()
+                        await loop.run_in_executor(self._executor, shard.updates_conn.send, ("invalidate", user_ids))
+                    await loop.run_in_executor(self._executor, shard.updates_conn.send, message)
+                    break
+                except (OSError, ValueError) as e:
+                    # Процесс упал: передадим пачку заново после перезапуска (его выполнит _monitor)
+                    logger.warning(f"Не удалось передать апдейты шарду {shard.number}: {e}")
+                    shard.resent += len(updates)
+                    shard.ready.clear()
+                    await asyncio.sleep(RESEND_DELAY)
+
+            if updates and batch[-1] is None:
+                # Запрос метрик попал в конец пачки апдейтов
+                await self._send_quietly(shard, ("metrics", self.get_metrics()))
+            for _ in batch:
+                shard.outbox.task_done()
+
+    async def _send_quietly(self, shard: _Shard, message: Any) -> None:
+        """
+        Передает процессу служебное сообщение, игнорируя ошибки канала.
+        """
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, shard.updates_conn.send, message)
+        except (OSError, ValueError):
+            pass
+
+    async def _monitor(self) -> None:
+        """
+        Проверяет процессы, перезапускает упавшие и зависшие, рассылает и пишет в лог метрики.
+        """
+        last_check = last_log = time.monotonic()
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            now = time.monotonic()
+            elapsed = max(now - last_check, 1e-9)
+            last_check = now
+
+            for shard in self.shards:
+                shard.rate_in = (shard.routed - shard.last_routed) / elapsed
+                shard.rate_out = max(shard.processed - shard.last_processed, 0) / elapsed
+                shard.last_routed, shard.last_processed = shard.routed, shard.processed
+                if shard.restarting or self._stopping:
+                    continue
+
+                if not shard.process.is_alive():
+                    logger.error(f"Шард {shard.number} завершился с кодом {shard.process.exitcode}, перезапускаем.")
+                    asyncio.create_task(self._restart(shard))
+                elif now - shard.last_heartbeat > (self.heartbeat_timeout if shard.report else STARTUP_TIMEOUT):
+                    logger.error(f"Шард {shard.number} не присылает отчеты {now - shard.last_heartbeat:.0f} с, перезапускаем.")
+                    shard.process.kill()
+                    asyncio.create_task(self._restart(shard))
+                else:
+                    # Метрики всех шардов для /shardstats; при заполненной очереди пропускаем
+                    try:
+                        shard.outbox.put_nowait(None)
+                    except asyncio.QueueFull:
+                        pass
+
+            if now - last_log >= METRICS_LOG_INTERVAL:
+                last_log = now
+                for item in self.get_metrics()["shards"]:
+                    logger.info(
+                        f"Шард {item['number']}: принято {item['rate_in']:.1f} апд/с, обработано {item['rate_out']:.1f} апд/с, "
+                        f"очередь {item['queue']}, в обработке {item['pending']}, "
+                        f"всего {item['processed']} (ошибок {item['failed']}), перезапусков {item['restarts']}"
+                    )
+
+    async def _restart(self, shard: _Shard) -> None:
+        """
+        Перезапускает процесс шарда с задержкой, растущей при падениях подряд.
+        """
+        shard.restarting = True
+        shard.ready.clear()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, shard.process.join)
+        shard.updates_conn.close()
+
+        shard.processed_before, shard.failed_before = shard.processed, shard.failed
+        shard.report = {}
+        shard.last_processed = shard.processed
+        shard.restarts += 1
+        if time.monotonic() - shard.started_at >= STABLE_UPTIME:
+            shard.crashes_in_row = 0
+        delay = min(2.0 ** shard.crashes_in_row - 1, MAX_RESTART_DELAY)
+        shard.crashes_in_row += 1
+        if delay:
+            logger.info(f"Шард {shard.number} будет перезапущен через {delay:.0f} с.")
+            await asyncio.sleep(delay)
+
+        if not self._stopping:
+            self._spawn(shard)
@@ -0,0 +1,72 @@
+"""
+Объединение одновременных одинаковых запросов (single-flight).
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Выполняет не больше одного запроса на ключ одновременно.
+
+    Первый вызов с ключом запускает запрос в отдельной задаче, остальные
+    вызовы с тем же ключом, пришедшие до его завершения, ждут тот же
+    результат (или ту же ошибку). Отмена одного из ожидающих не отменяет
+    запрос для остальных.
+    """
+
+    def __init__(self) -> None:
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+
+        # Счетчики
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Возвращает результат fn(), объединяя одновременные вызовы с одинаковым ключом.
+
+        Args:
+            key: Ключ запроса
+            fn: Функция, создающая корутину запроса
+
+        Returns:
+            Результат запроса
+        """
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        self.calls += 1
+        future = asyncio.ensure_future(fn())
+        self._in_flight[key] = future
+        future.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(future)
+
+    def _finish(self, key: Hashable, future: asyncio.Future) -> None:
+        """
+        Снимает завершенный запрос; ошибка помечается полученной, даже если все ожидающие отменены.
+        """
+        self._in_flight.pop(key, None)
+        if not future.cancelled():
+            future.exception()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Возвращает метрики объединения запросов.
+
+        Returns:
+            Словарь с количеством выполненных и сэкономленных запросов
+        """
+        total = self.calls + self.coalesced
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight),
+            "saved_rate": self.coalesced / total if total else 0.0
+        }
@@ -0,0 +1,65 @@
+"""
+Фоновая сверка счетчиков статистики админ-панели с таблицами users и рекомендаций.
+"""
+import time
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+from config import STATS_RECONCILE_INTERVAL_HOURS
+from database import db
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+
+# Результат последней сверки (для админ-панели)
+last_reconcile: Optional[Dict[str, Any]] = None
+
+
+async def reconcile_stats() -> Dict[str, Any]:
+    """
+    Выполняет сверку счетчиков и запоминает ее результат.
+
+    Returns:
+        Результат сверки: список расхождений, длительность и время завершения
+    """
+    global last_reconcile
+
+    started = time.monotonic()
+    drift = await db.reconcile_admin_stats()
+    last_reconcile = {
+        "drift": drift,
+        "duration": time.monotonic() - started,
+        "finished_at": time.time()
+    }
+    return last_reconcile
+
+
+def get_last_reconcile() -> Optional[Dict[str, Any]]:
+    """
+    Возвращает результат последней сверки.
+
+    Returns:
+        Результат сверки или None, если сверка еще не выполнялась
+    """
+    return last_reconcile
+
+
+async def start_stats_reconciler(interval_hours: float = STATS_RECONCILE_INTERVAL_HOURS) -> None:
+    """
+    Периодически сверяет счетчики статистики с таблицами users и рекомендаций.
+
+    Первая сверка выполняется сразу после запуска.
+
+    Args:
+        interval_hours: Период сверки в часах (0 - сверка выключена)
+    """
+    if interval_hours <= 0:
+        return
+
+    while True:
+        try:
+            await reconcile_stats()
+        except Exception as e:
+            logger.error(f"Ошибка при сверке счетчиков статистики: {e}")
+        await asyncio.sleep(interval_hours * 3600)
@@ -0,0 +1,133 @@
+"""
+Сообщение, которое постепенно дополняется по мере получения текста.
+"""
+import time
+import asyncio
+import logging
+from typing import Any, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramRetryAfter
+
+from config import STREAM_EDIT_INTERVAL
+from services.rate_limit import TokenBucket, telegram_limiter
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+
+# Максимальная длина текста сообщения в Telegram
+MAX_MESSAGE_LENGTH = 4096
+
+
+class StreamingMessage:
+    """
+    Сообщение со статусом, текст которого обновляется через edit_message_text.
+
+    update() только запоминает последний текст, правки отправляются в фоне
+    не чаще одного раза в interval секунд (Telegram ограничивает частоту
+    правок), промежуточные версии текста пропускаются. finish() отправляет
+    итоговый текст вместе с клавиатурой.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        chat_id: int,
+        message_id: Optional[int] = None,
+        interval: float = STREAM_EDIT_INTERVAL,
+        limiter: TokenBucket = telegram_limiter
+    ) -> None:
+        """
+        Args:
+            bot: Экземпляр бота
+            chat_id: ID чата
+            message_id: ID сообщения со статусом (None - сообщение будет отправлено при первом обновлении)
+            interval: Минимальный интервал между правками в секундах
+            limiter: Общий ограничитель скорости бота
+        """
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.interval = interval
+        self.limiter = limiter
+        self.edits = 0
+        self._pending: Optional[str] = None
+        self._shown: Optional[str] = None
+        self._last_edit = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def update(self, text: str) -> None:
+        """
+        Запоминает новый текст и запускает фоновую правку сообщения.
+
+        Args:
+            text: Текст сообщения
+        """
+        self._pending = text[:MAX_MESSAGE_LENGTH]
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush())
+
+    async def finish(self, text: str, reply_markup: Any = None) -> None:
+        """
+        Останавливает промежуточные правки и показывает итоговый текст.
+
+        Args:
+            text: Итоговый текст сообщения
+            reply_markup: Клавиатура итогового сообщения
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+        if self.message_id is not None:
+            try:
+                await self._edit(text[:MAX_MESSAGE_LENGTH], reply_markup)
+                return
+            except TelegramAPIError as e:
+                logger.warning(f"Не удалось обновить сообщение в чате {self.chat_id}, отправляем новое: {e}")
+
+        await self.bot.send_message(chat_id=self.chat_id, text=text[:MAX_MESSAGE_LENGTH], reply_markup=reply_markup)
+
+    async def _flush(self) -> None:
+        """
+        Отправляет последнюю версию текста, выдерживая интервал между правками.
+        """
+        while self._pending is not None and self._pending != self._shown:
+            wait = self._last_edit + self.interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+            text, self._pending = self._pending, None
+            try:
+                if self.message_id is None:
+                    await self.limiter.acquire()
+                    message = await self.bot.send_message(chat_id=self.chat_id, text=text)
+                    self.message_id = message.message_id
+                    self._shown = text
+                    self._last_edit = time.monotonic()
+                else:
+                    await self._edit(text)
+            except TelegramRetryAfter as e:
+                # Слишком частые правки: ждем и отправим последнюю версию текста
+                self.limiter.pause(e.retry_after)
+                self._pending = self._pending or text
+                self._last_edit = time.monotonic() + e.retry_after
+            except TelegramAPIError as e:
+                logger.warning(f"Не удалось обновить сообщение в чате {self.chat_id}: {e}")
+                return
+
+    async def _edit(self, text: str, reply_markup: Any = None) -> None:
+        """
+        Редактирует сообщение; повторная отправка того же текста не считается ошибкой.
+        """
+        await self.limiter.acquire()
+        try:
+            await self.bot.edit_message_text(
+                text=text, chat_id=self.chat_id, message_id=self.message_id, reply_markup=reply_markup
+            )
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                raise
+        self.edits += 1
+        self._shown = text
+        self._last_edit = time.monotonic()
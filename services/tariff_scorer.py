@@ -0,0 +1,241 @@
+"""
+Локальный подбор тарифа по ответам онбординга на основе правил.
+"""
+import re
+import logging
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from config import ONBOARDING_QUESTIONS
+from database.models import DEFAULT_TARIFFS
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+
+# Предпочтительный уровень тарифа (индекс в DEFAULT_TARIFFS) для каждого варианта ответа.
+# Ключ - ID вопроса, значения идут в порядке вариантов из ONBOARDING_QUESTIONS.
+OPTION_TIERS: Dict[int, List[int]] = {
+    2: [0, 1, 2],     # Объем использования
+    3: [0, 1, 2, 2],  # Бюджет: максимальный уровень, который укладывается в бюджет
+    4: [0, 1, 2, 2],  # Размер команды
+}
+
+# Вопросы со свободным ответом: сфера бизнеса и текущие инструменты
+FREE_TEXT_QUESTIONS = (1, 5)
+
+# Веса факторов в оценке тарифа
+USAGE_WEIGHT = 1.0
+BUDGET_WEIGHT = 1.0
+TEAM_WEIGHT = 1.0
+FREE_TEXT_WEIGHT = 1.5
+# Дополнительный штраф за каждый уровень сверх бюджета
+OVER_BUDGET_PENALTY = 1.5
+
+# Признаки крупного бизнеса и сложной инфраструктуры в свободных ответах (начала слов)
+UPSCALE_STEMS = (
+    "сеть", "филиал", "холдинг", "корпорац", "enterprise", "завод", "производств",
+    "банк", "маркетплейс", "франшиз", "федеральн", "salesforce", "sap", "1с",
+    "битрикс", "bitrix", "amocrm", "crm", "срм", "api", "интеграц", "erp"
+)
+# Признаки небольшого бизнеса и простых инструментов (начала слов)
+DOWNSCALE_STEMS = (
+    "фриланс", "самозанят", "частн", "репетитор", "блог", "excel", "эксель",
+    "таблиц", "блокнот", "тетрад", "ничего", "вручную"
+)
+# Короткие признаки сравниваются со словом целиком
+DOWNSCALE_WORDS = ("ип", "нет")
+
+_WORD_RE = re.compile(r"[\w+]+")
+
+# Счетчики решений
+_metrics: Counter = Counter()
+
+
+def _option_tier(question_id: int, answer: str) -> Optional[int]:
+    """
+    Возвращает предпочтительный уровень тарифа для варианта ответа.
+
+    Returns:
+        Индекс тарифа или None, если ответ не совпадает ни с одним вариантом
+    """
+    for question in ONBOARDING_QUESTIONS:
+        if question["id"] == question_id:
+            options = [option.lower() for option in question.get("options", [])]
+            answer = answer.strip().lower()
+            if answer in options:
+                return OPTION_TIERS[question_id][options.index(answer)]
+    return None
+
+
+def _free_text_shift(texts: List[str]) -> int:
+    """
+    Оценивает по свободным ответам, смещают ли они выбор к старшему или младшему тарифу.
+
+    Returns:
+        +1 (крупнее), -1 (проще) или 0 (нейтрально или противоречиво)
+    """
+    upscale = downscale = 0
+    for text in texts:
+        for word in _WORD_RE.findall(text.lower().replace("ё", "е")):
+            if word.startswith(UPSCALE_STEMS):
+                upscale += 1
+            elif word.startswith(DOWNSCALE_STEMS) or word in DOWNSCALE_WORDS:
+                downscale += 1
+    if upscale > downscale:
+        return 1
+    if downscale > upscale:
+        return -1
+    return 0
+
+
+def _best_tier(usage: int, budget: int, team: int, text_tier: Optional[int]) -> int:
+    """
+    Выбирает тариф с максимальной оценкой; при равенстве побеждает более дешевый.
+    """
+    best_tier, best_score = 0, float("-inf")
+    for tier in range(len(DEFAULT_TARIFFS)):
+        score = (
+            -USAGE_WEIGHT * abs(tier - usage)
+            - TEAM_WEIGHT * abs(tier - team)
+            - BUDGET_WEIGHT * abs(tier - budget)
+            - OVER_BUDGET_PENALTY * max(0, tier - budget)
+        )
+        if text_tier is not None:
+            score -= FREE_TEXT_WEIGHT * abs(tier - text_tier)
+        if score > best_score:
+            best_tier, best_score = tier, score
+    return best_tier
+
+
+def _explanation(tier: int, usage: int, budget: int, team: int) -> str:
+    """
+    Формирует объяснение выбора по совпавшим факторам.
+    """
+    tariff = DEFAULT_TARIFFS[tier]
+    reasons = []
+    if usage == tier:
+        reasons.append("ожидаемый объем запросов")
+    if team == tier:
+        reasons.append("размер вашей команды")
+    if budget >= tier:
+        reasons.append("ваш бюджет")
+
+    if reasons:
+        text = f"Тариф «{tariff['name']}» лучше всего соответствует вашим ответам: учтены {', '.join(reasons)}. "
+    else:
+        text = f"Тариф «{tariff['name']}» - лучший компромисс между вашими потребностями и бюджетом. "
+    return text + tariff["description"]
+
+
+def score_answers(answers: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Подбирает тариф по ответам онбординга без обращения к OpenAI.
+
+    Тариф выбирается по объему использования, бюджету и размеру команды.
+    Свободные ответы (сфера бизнеса и инструменты) оцениваются по ключевым
+    словам: если они меняют выбор, результат помечается как требующий
+    анализа через OpenAI.
+
+    Args:
+        answers: Ответы пользователя из db.get_user_answers
+
+    Returns:
+        Словарь с ключами:
+        - tariff_data: рекомендация в формате analyze_onboarding_answers
+        - needs_llm: True, если без OpenAI рекомендация ненадежна
+        - reason: причина обращения к OpenAI (или пустая строка)
+    """
+    by_question = {answer["id"]: str(answer["answer"]) for answer in answers}
+
+    tiers = {question_id: _option_tier(question_id, by_question.get(question_id, ""))
+             for question_id in OPTION_TIERS}
+    missing = [question_id for question_id, tier in tiers.items() if tier is None]
+    # Неизвестные ответы считаем средним уровнем, чтобы было что вернуть при недоступности OpenAI
+    usage, budget, team = (tiers[question_id] if tiers[question_id] is not None else 1 for question_id in (2, 3, 4))
+
+    base_tier = _best_tier(usage, budget, team, None)
+    shift = _free_text_shift([by_question.get(question_id, "") for question_id in FREE_TEXT_QUESTIONS])
+    text_tier = min(max(base_tier + shift, 0), len(DEFAULT_TARIFFS) - 1) if shift else None
+    tier = _best_tier(usage, budget, team, text_tier)
+
+    if missing:
+        reason = f"ответы не совпадают с вариантами (вопросы {missing})"
+    elif tier != base_tier:
+        reason = "свободные ответы меняют выбор тарифа"
+    else:
+        reason = ""
+
+    tariff_data = _tariff_data(tier, _explanation(tier, usage, budget, team))
+    return {"tariff_data": tariff_data, "needs_llm": bool(reason), "reason": reason}
+
+
+def tariff_data_for(name: str) -> Optional[Dict[str, Any]]:
+    """
+    Формирует рекомендацию тарифа по его названию с объяснением по шаблону.
+
+    Используется, когда известен только выбранный тариф (например, его
+    предсказала локальная модель), а объяснения для этого пользователя нет.
+
+    Args:
+        name: Название тарифа
+
+    Returns:
+        Рекомендация в формате analyze_onboarding_answers или None, если такого тарифа нет
+    """
+    key = name.strip().lower()
+    for tier, tariff in enumerate(DEFAULT_TARIFFS):
+        if tariff["name"].lower() == key:
+            explanation = (
+                f"Тариф «{tariff['name']}» чаще всего подходит компаниям с похожими ответами. "
+                + tariff["description"]
+            )
+            return _tariff_data(tier, explanation)
+    return None
+
+
+def _tariff_data(tier: int, explanation: str) -> Dict[str, Any]:
+    """
+    Формирует рекомендацию со всеми тарифами и выбранным уровнем.
+    """
+    return {
+        "tariffs": [
+            {
+                "name": tariff["name"],
+                "description": tariff["description"],
+                "price": tariff["price"],
+                "features": list(tariff["features"])
+            }
+            for tariff in DEFAULT_TARIFFS
+        ],
+        "recommendation": DEFAULT_TARIFFS[tier]["name"],
+        "explanation": explanation
+    }
+
+
+def record_decision(decision: str) -> None:
+    """
+    Учитывает, каким способом получена рекомендация.
+
+    Args:
+        decision: "local" (локальный подбор), "cache" (кэш рекомендаций), "semantic"
+            (кэш похожих ответов), "distilled" (локальная модель), "llm" (OpenAI)
+            или "fallback" (локальный подбор при сбое OpenAI)
+    """
+    _metrics[decision] += 1
+
+
+def get_scorer_metrics() -> Dict[str, int]:
+    """
+    Возвращает счетчики решений локального подбора.
+
+    Returns:
+        Словарь с количеством рекомендаций по способу получения
+    """
+    return {
+        "local": _metrics["local"],
+        "cache": _metrics["cache"],
+        "semantic": _metrics["semantic"],
+        "distilled": _metrics["distilled"],
+        "llm": _metrics["llm"],
+        "fallback": _metrics["fallback"]
+    }
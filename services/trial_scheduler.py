@@ -0,0 +1,261 @@
+"""
+Планировщик событий триал-периода (напоминание и окончание триала).
+"""
+import time
+import heapq
+import asyncio
+import logging
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from database import db
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+
+# Типы событий триала
+REMINDER = "reminder"
+EXPIRY = "expiry"
+
+# Максимальное время сна планировщика: страхует от переводов системных часов
+MAX_SLEEP_SECONDS = 60.0
+
+# Обработчик пачки сработавших событий: получает список пользователей
+TrialCallback = Callable[[List[Dict[str, Any]]], Awaitable[None]]
+
+
+class TrialScheduler:
+    """
+    Планировщик точных по времени событий триала на основе min-кучи.
+
+    В куче лежат ближайшие сроки (напоминание и окончание триала) только
+    для пользователей, чей триал заканчивается в пределах окна horizon.
+    Окно подгружается страницами из индекса idx_users_active_trial_end и
+    сдвигается по мере течения времени. Новые пользователи и смена тарифа
+    учитываются через слушателя изменений в database.db.
+
+    Перед срабатыванием событие отмечается в таблице trial_notifications,
+    поэтому после перезапуска уже сработавшие события не повторяются,
+    а пропущенные во время простоя срабатывают сразу после старта.
+    """
+
+    def __init__(
+        self,
+        on_reminder: TrialCallback,
+        on_expiry: TrialCallback,
+        reminder_offset: float,
+        horizon: float = 6 * 3600,
+        page_size: int = 1000,
+        batch_size: int = 500
+    ) -> None:
+        """
+        Args:
+            on_reminder: Обработчик пачки напоминаний о скором окончании триала
+            on_expiry: Обработчик пачки закончившихся триалов
+            reminder_offset: За сколько секунд до окончания триала отправлять напоминание
+            horizon: Ширина окна подгрузки сроков в секундах
+            page_size: Размер страницы при подгрузке сроков из базы
+            batch_size: Максимальное количество событий за одно срабатывание
+        """
+        self.on_reminder = on_reminder
+        self.on_expiry = on_expiry
+        self.reminder_offset = reminder_offset
+        self.horizon = horizon
+        self.page_size = page_size
+        self.batch_size = batch_size
+
+        # Куча: (время срабатывания, user_id, тип события, trial_end_ts)
+        self._heap: List[Tuple[float, int, str, int]] = []
+        # Актуальный trial_end_ts для (user_id, тип); записи кучи с другим значением устарели
+        self._entries: Dict[Tuple[int, str], int] = {}
+        # Сроки с trial_end_ts меньше этой границы уже подгружены из базы
+        self._loaded_until = 0
+        self._next_load_at = 0.0
+        self._wakeup = asyncio.Event()
+
+        # Метрики
+        self._fired: Counter = Counter()
+        self._skipped = 0
+        self._loads = 0
+
+    def schedule(self, user_id: int, trial_end_ts: int, reminder_sent: bool = False) -> None:
+        """
+        Ставит в очередь события триала пользователя.
+
+        Если срок лежит за пределами уже подгруженного окна, старые события
+        пользователя снимаются, а новые подгрузит очередной проход по индексу.
+
+        Args:
+            user_id: ID пользователя
+            trial_end_ts: Время окончания триала (epoch)
+            reminder_sent: Напоминание уже было отправлено
+        """
+        self.unschedule(user_id)
+        if trial_end_ts >= self._loaded_until:
+            return
+
+        now = time.time()
+        if not reminder_sent and trial_end_ts > now:
+            self._push(trial_end_ts - self.reminder_offset, user_id, REMINDER, trial_end_ts)
+        self._push(trial_end_ts, user_id, EXPIRY, trial_end_ts)
+
+    def unschedule(self, user_id: int) -> None:
+        """
+        Снимает все события пользователя (записи в куче удаляются лениво).
+
+        Args:
+            user_id: ID пользователя
+        """
+        self._entries.pop((user_id, REMINDER), None)
+        self._entries.pop((user_id, EXPIRY), None)
+
+    def on_user_changed(self, user_id: int, fields: Dict[str, Any]) -> None:
+        """
+        Слушатель изменений пользователей из database.db.
+
+        Args:
+            user_id: ID пользователя
+            fields: Измененные поля записи
+        """
+        if fields.get("tariff_id") is not None or fields.get("is_active") == 0:
+            # Выбран тариф или пользователь деактивирован: события больше не нужны
+            self.unschedule(user_id)
+        elif fields.get("trial_end_ts") is not None:
+            self.schedule(user_id, fields["trial_end_ts"])
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Возвращает метрики планировщика.
+
+        Returns:
+            Словарь с количеством запланированных и сработавших событий
+        """
+        return {
+            "scheduled": len(self._entries),
+            "heap_size": len(self._heap),
+            "fired_reminders": self._fired[REMINDER],
+            "fired_expiries": self._fired[EXPIRY],
+            "skipped": self._skipped,
+            "loads": self._loads,
+            "loaded_until": self._loaded_until
+        }
+
+    async def run(self) -> None:
+        """
+        Основной цикл: спит до ближайшего события и запускает обработчики.
+        """
+        while True:
+            try:
+                now = time.time()
+                if now >= self._next_load_at:
+                    await self.load()
+
+                if self._heap and self._heap[0][0] <= now:
+                    await self._fire_due(now)
+                    continue
+
+                next_event_at = self._heap[0][0] if self._heap else float("inf")
+                timeout = min(next_event_at, self._next_load_at) - now
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), min(max(timeout, 0), MAX_SLEEP_SECONDS))
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка в планировщике событий триала: {e}")
+                await asyncio.sleep(5)
+
+    async def load(self) -> None:
+        """
+        Подгружает сроки триалов до конца нового окна страницами по индексу.
+
+        При ошибке чтения граница окна не сдвигается: run() повторит подгрузку
+        того же окна, уже поставленные события не задваиваются.
+        """
+        now = time.time()
+        # Напоминание срабатывает раньше окончания, поэтому окно расширяется на reminder_offset
+        load_until = int(now + self.horizon + self.reminder_offset)
+        after = (self._loaded_until - 1, 0)
+        loaded = 0
+
+        while True:
+            rows = await db.get_trial_deadlines(self._loaded_until, load_until, after, self.page_size)
+            for row in rows:
+                self._schedule_loaded(row, now)
+            loaded += len(rows)
+            if len(rows) < self.page_size:
+                break
+            after = (rows[-1]["trial_end_ts"], rows[-1]["user_id"])
+
+        self._loaded_until = load_until
+        self._next_load_at = now + self.horizon / 2
+        self._loads += 1
+        if loaded:
+            logger.info(f"Планировщик триалов подгрузил {loaded} сроков окончания триала.")
+
+    def _schedule_loaded(self, row: Dict[str, Any], now: float) -> None:
+        """
+        Ставит в очередь события пользователя, подгруженного из базы.
+        """
+        user_id = row["user_id"]
+        trial_end_ts = row["trial_end_ts"]
+        if not row["reminder_sent"] and trial_end_ts > now:
+            self._push(trial_end_ts - self.reminder_offset, user_id, REMINDER, trial_end_ts)
+        self._push(trial_end_ts, user_id, EXPIRY, trial_end_ts)
+
+    def _push(self, fire_at: float, user_id: int, kind: str, trial_end_ts: int) -> None:
+        """
+        Добавляет событие в кучу и будит цикл, если оно стало ближайшим.
+        """
+        self._entries[(user_id, kind)] = trial_end_ts
+        heapq.heappush(self._heap, (fire_at, user_id, kind, trial_end_ts))
+        if self._heap[0][1] == user_id and self._heap[0][2] == kind:
+            self._wakeup.set()
+
+    async def _fire_due(self, now: float) -> None:
+        """
+        Запускает обработчики для наступивших событий пачками по типу.
+        """
+        due: Dict[str, List[Dict[str, Any]]] = {REMINDER: [], EXPIRY: []}
+        count = 0
+
+        while self._heap and self._heap[0][0] <= now and count < self.batch_size:
+            _, user_id, kind, trial_end_ts = heapq.heappop(self._heap)
+            if self._entries.get((user_id, kind)) != trial_end_ts:
+                # Событие снято или перепланировано
+                continue
+            del self._entries[(user_id, kind)]
+            count += 1
+
+            user = await self._get_eligible_user(user_id, trial_end_ts)
+            if user is None or not await db.claim_trial_notification(user_id, kind, trial_end_ts):
+                self._skipped += 1
+                continue
+            due[kind].append(user)
+
+        if due[REMINDER]:
+            self._fired[REMINDER] += len(due[REMINDER])
+            await self.on_reminder(due[REMINDER])
+        if due[EXPIRY]:
+            self._fired[EXPIRY] += len(due[EXPIRY])
+            await self.on_expiry(due[EXPIRY])
+
+    @staticmethod
+    async def _get_eligible_user(user_id: int, trial_end_ts: int) -> Optional[Dict[str, Any]]:
+        """
+        Перечитывает пользователя и проверяет, что событие все еще актуально.
+
+        Returns:
+            Запись пользователя или None, если событие больше не нужно
+        """
+        user = await db.get_user(user_id)
+        if (
+            not user
+            or not user.get("is_active", True)
+            or user.get("tariff_id")
+            or user.get("trial_end_ts") != trial_end_ts
+        ):
+            return None
+        return user
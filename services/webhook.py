@@ -0,0 +1,294 @@
+"""
+Прием апдейтов Telegram через webhook: встроенный HTTP-сервер aiohttp с очередью.
+"""
+import hmac
+import time
+import signal
+import asyncio
+import logging
+import secrets
+from contextlib import suppress
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+
+from config import (
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET,
+    WEBHOOK_QUEUE_SIZE, WEBHOOK_WORKERS, WEBHOOK_MAX_CONNECTIONS
+)
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+
+# Заголовок, в котором Telegram передает секрет, указанный в setWebhook
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Сколько секунд при остановке ждать обработки апдейтов, уже принятых в очередь
+DRAIN_TIMEOUT = 10.0
+
+# Обработчик апдейта: получает апдейт в виде словаря из тела запроса
+UpdateHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class WebhookServer:
+    """
+    HTTP-сервер, принимающий апдейты от Telegram.
+
+    Запрос с верным секретом сразу получает ответ 200, а апдейт попадает
+    в ограниченную очередь, которую разбирают workers обработчиков. Если
+    очередь заполнена, сервер отвечает 503: Telegram повторит доставку
+    позже, поэтому при всплеске нагрузки апдейты не теряются и память
+    не растет. Апдейты, принятые в очередь, но не обработанные до
+    аварийного завершения процесса, теряются; при штатной остановке
+    очередь дорабатывается (до DRAIN_TIMEOUT секунд).
+    """
+
+    def __init__(
+        self,
+        handler: UpdateHandler,
+        path: str = WEBHOOK_PATH,
+        secret: str = WEBHOOK_SECRET,
+        queue_size: int = WEBHOOK_QUEUE_SIZE,
+        workers: int = WEBHOOK_WORKERS
+    ) -> None:
+        """
+        Args:
+            handler: Обработчик апдейта
+            path: Путь, на который приходят апдейты
+            secret: Секрет заголовка X-Telegram-Bot-Api-Secret-Token (пусто - сгенерировать)
+            queue_size: Максимум апдейтов в очереди
+            workers: Количество параллельных обработчиков
+        """
+        self.handler = handler
+        self.path = path
+        self.secret = secret or secrets.token_urlsafe(32)
+        self._secret_bytes = self.secret.encode()
+        self.workers = max(1, workers)
+        self._queue: asyncio.Queue = asyncio.Queue(max(1, queue_size))
+        self._tasks: List[asyncio.Task] = []
+        self._runner: Optional[web.AppRunner] = None
+
+        # Счетчики
+        self.accepted = 0
+        self.processed = 0
+        self.failed = 0
+        self.unauthorized = 0
+        self.bad_requests = 0
+        self.overflowed = 0
+        self.in_progress = 0
+        self._total_ack = 0.0
+        self._total_latency = 0.0
+        self._max_latency = 0.0
+
+    def create_app(self) -> web.Application:
+        """
+        Создает приложение aiohttp с маршрутом для апдейтов.
+
+        Returns:
+            Приложение aiohttp
+        """
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def start(self, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT) -> None:
+        """
+        Запускает обработчики и начинает принимать запросы.
+
+        Args:
+            host: Адрес, на котором слушает сервер
+            port: Порт сервера
+        """
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._runner = web.AppRunner(self.create_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Webhook-сервер слушает {host}:{port}{self.path}, обработчиков: {self.workers}.")
+
+    async def stop(self, timeout: float = DRAIN_TIMEOUT) -> None:
+        """
+        Перестает принимать запросы, дорабатывает очередь и останавливает обработчики.
+
+        Args:
+            timeout: Сколько секунд ждать обработки апдейтов из очереди
+        """
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Webhook-сервер остановлен, не обработано апдейтов: {self._queue.qsize()}.")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """
+        Принимает апдейт: проверяет секрет, ставит апдейт в очередь и сразу отвечает.
+
+        Args:
+            request: HTTP-запрос от Telegram
+
+        Returns:
+            200 - апдейт принят, 401 - неверный секрет, 400 - тело не апдейт,
+            503 - очередь заполнена (Telegram повторит доставку)
+        """
+        started = time.perf_counter()
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, "").encode(), self._secret_bytes):
+            self.unauthorized += 1
+            return web.Response(status=401)
+
+        try:
+            update = await request.json()
+        except ValueError:
+            update = None
+        if not isinstance(update, dict) or "update_id" not in update:
+            self.bad_requests += 1
+            return web.Response(status=400)
+
+        try:
+            self._queue.put_nowait((update, time.monotonic()))
+        except asyncio.QueueFull:
+            self.overflowed += 1
+            return web.Response(status=503, headers={"Retry-After": "1"})
+
+        self.accepted += 1
+        self._total_ack += time.perf_counter() - started
+        return web.Response()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Возвращает метрики сервера.
+
+        Returns:
+            Словарь с глубиной очереди, счетчиками запросов и апдейтов, средним
+            временем ответа Telegram и временем от приема апдейта до конца обработки
+        """
+        return {
+            "depth": self._queue.qsize(),
+            "max_depth": self._queue.maxsize,
+            "in_progress": self.in_progress,
+            "workers": self.workers,
+            "accepted": self.accepted,
+            "processed": self.processed,
+            "failed": self.failed,
+            "unauthorized": self.unauthorized,
+            "bad_requests": self.bad_requests,
+            "overflowed": self.overflowed,
+            "avg_ack_ms": self._total_ack / self.accepted * 1000 if self.accepted else 0.0,
+            "avg_latency": self._total_latency / (self.processed + self.failed) if self.processed + self.failed else 0.0,
+            "max_latency": self._max_latency
+        }
+
+    async def _worker(self) -> None:
+        """
+        Обработчик: берет апдейты из очереди и передает их в handler.
+        """
+        while True:
+            update, accepted_at = await self._queue.get()
+            self.in_progress += 1
+            try:
+                await self.handler(update)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Ошибка при обработке апдейта {update.get('update_id')}: {e}")
+            finally:
+                latency = time.monotonic() - accepted_at
+                self._total_latency += latency
+                self._max_latency = max(self._max_latency, latency)
+                self.in_progress -= 1
+                self._queue.task_done()
+
+
+# Сервер создается при запуске бота в режиме webhook в run_webhook()
+_webhook_server: Optional[WebhookServer] = None
+
+
+def stop_on_signals() -> asyncio.Event:
+    """
+    Создает событие, которое устанавливается по SIGINT/SIGTERM.
+
+    Returns:
+        Событие остановки
+    """
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        # На Windows обработчики сигналов не поддерживаются, там остановка - по KeyboardInterrupt
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop_event.set)
+    return stop_event
+
+
+async def register_webhook(bot: Bot, secret: str, allowed_updates: List[str]) -> None:
+    """
+    Регистрирует webhook в Telegram, если задан WEBHOOK_URL.
+
+    Args:
+        bot: Экземпляр бота
+        secret: Секрет, который Telegram будет передавать в заголовке
+        allowed_updates: Типы апдейтов, которые нужно получать
+    """
+    if not WEBHOOK_URL:
+        logger.warning(
+            "WEBHOOK_URL не задан: webhook не зарегистрирован в Telegram, "
+            "сервер принимает только локальные запросы (scripts/replay_updates.py с WEBHOOK_SECRET)."
+        )
+        return
+
+    await bot.set_webhook(
+        url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=secret,
+        allowed_updates=allowed_updates,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        drop_pending_updates=True
+    )
+    logger.info(f"Webhook зарегистрирован: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher) -> None:
+    """
+    Запускает бота в режиме webhook и работает до SIGINT/SIGTERM.
+
+    Регистрирует webhook в Telegram (если задан WEBHOOK_URL), вызывает
+    обработчики запуска и остановки диспетчера, как это делает поллинг,
+    и закрывает сессию бота.
+
+    Args:
+        bot: Экземпляр бота
+        dp: Диспетчер с зарегистрированными роутерами
+    """
+    global _webhook_server
+
+    workflow_data = {"dispatcher": dp, "bots": [bot], **dp.workflow_data}
+    _webhook_server = WebhookServer(lambda update: dp.feed_raw_update(bot, update, **workflow_data))
+    stop_event = stop_on_signals()
+
+    await dp.emit_startup(bot=bot, **workflow_data)
+    try:
+        await _webhook_server.start()
+        await register_webhook(bot, _webhook_server.secret, dp.resolve_used_update_types())
+        await stop_event.wait()
+    finally:
+        await _webhook_server.stop()
+        try:
+            await dp.emit_shutdown(bot=bot, **workflow_data)
+        finally:
+            await bot.session.close()
+        logger.info("Webhook-сервер остановлен")
+
+
+def get_webhook_metrics() -> Optional[Dict[str, Any]]:
+    """
+    Возвращает метрики webhook-сервера.
+
+    Returns:
+        Словарь с метриками или None, если бот работает в режиме поллинга
+    """
+    return _webhook_server.get_metrics() if _webhook_server is not None else None
@@ -0,0 +1,197 @@
+"""
+Запуск бота "Нейропродажник" в нескольких процессах.
+
+Супервизор один раз принимает апдейты (поллингом или через webhook, по
+BOT_MODE) и передает каждый в процесс-обработчик его пользователя
+(services/sharding.py). Процессы обрабатывают пользователей параллельно на
+разных ядрах, апдейты одного пользователя - по порядку. Фоновые задачи
+(проверка триалов, сверка статистики, рассылки) работают только в шарде 0.
+"""
+import sys
+import signal
+import asyncio
+import logging
+from multiprocessing.connection import Connection
+from typing import Any, Awaitable, Callable, Dict, List
+
+from aiogram import Bot
+
+from config import BOT_MODE, SHARDS
+from bot import create_bot, create_dispatcher, start_background_tasks
+from database.db import init_db, close_db, invalidate_cached_users, register_user_listener
+from database.models import init_models
+from handlers.onboarding import deliver_recommendation, fail_recommendation
+from services.analysis_queue import start_analysis_queue, stop_analysis_queue
+from services.sharding import ShardSupervisor, publish_user_changed, serve_shard, shard_for_user
+from services.webhook import WebhookServer, register_webhook, stop_on_signals
+
+# Инициализация логгера (логирование настраивается при импорте bot.py)
+logger = logging.getLogger(__name__)
+
+# Время долгого опроса getUpdates в секундах
+POLLING_TIMEOUT = 30
+
+# Максимальная задержка повтора getUpdates после ошибки в секундах
+POLLING_MAX_BACKOFF = 30.0
+
+
+def run_worker(shard: int, shards: int, updates_conn: Connection, status_conn: Connection) -> None:
+    """
+    Точка входа процесса-обработчика.
+
+    Args:
+        shard: Номер шарда
+        shards: Количество шардов
+        updates_conn: Канал от супервизора
+        status_conn: Канал к супервизору
+    """
+    # Ctrl+C и SIGTERM от systemd получает вся группа процессов: обработчики останавливает
+    # супервизор после передачи им оставшихся апдейтов (без супервизора процесс остановится сам)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f'%(asctime)s - shard {shard} - %(name)s - %(levelname)s - %(message)s',
+        handlers=[logging.StreamHandler(sys.stdout)],
+        force=True
+    )
+    try:
+        asyncio.run(worker_main(shard, shards, updates_conn, status_conn))
+    except Exception as e:
+        logger.error(f"Критическая ошибка в шарде {shard}: {e}")
+        sys.exit(1)
+
+
+async def worker_main(shard: int, shards: int, updates_conn: Connection, status_conn: Connection) -> None:
+    """
+    Инициализирует бота в процессе-обработчике и обрабатывает апдейты шарда.
+
+    Args:
+        shard: Номер шарда
+        shards: Количество шардов
+        updates_conn: Канал от супервизора
+        status_conn: Канал к супервизору
+    """
+    bot = create_bot()
+    dp = create_dispatcher()
+
+    # Миграции уже применены супервизором, здесь открывается только пул соединений
+    try:
+        await init_db()
+    except Exception as e:
+        logger.error(f"Ошибка при инициализации базы данных: {e}")
+        await close_db()
+        raise
+
+    # Записи пользователей меняют и другие шарды (например, окончание триала в шарде 0):
+    # об изменениях сообщаем супервизору, чтобы остальные шарды сбросили их из кэша
+    if shards > 1:
+        register_user_listener(publish_user_changed)
+
+    if shard == 0:
+        await start_background_tasks(bot)
+
+    # Задачи анализа, оставшиеся после перезапуска, выполняет шард их пользователя
+    await start_analysis_queue(
+        lambda job: deliver_recommendation(bot, dp.storage, job),
+        owns=lambda user_id: shard_for_user(user_id, shards) == shard,
+        on_failure=lambda job: fail_recommendation(bot, dp.storage, job)
+    )
+
+    workflow_data = {"dispatcher": dp, "bots": [bot], **dp.workflow_data}
+    await dp.emit_startup(bot=bot, **workflow_data)
+    try:
+        await serve_shard(
+            shard, updates_conn, status_conn,
+            lambda update: dp.feed_raw_update(bot, update, **workflow_data),
+            on_invalidate=invalidate_cached_users
+        )
+    finally:
+        try:
+            await dp.emit_shutdown(bot=bot, **workflow_data)
+        finally:
+            await stop_analysis_queue()
+            await dp.storage.close()
+            await close_db()
+            await bot.session.close()
+
+
+async def poll_updates(bot: Bot, allowed_updates: List[str],
+                       handler: Callable[[Dict[str, Any]], Awaitable[None]]) -> None:
+    """
+    Получает апдейты поллингом и передает их в handler в исходном виде.
+
+    Args:
+        bot: Экземпляр бота
+        allowed_updates: Типы апдейтов, которые нужно получать
+        handler: Получатель апдейта в виде словаря
+    """
+    offset = None
+    delay = 1.0
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=POLLING_TIMEOUT, allowed_updates=allowed_updates)
+        except Exception as e:
+            logger.error(f"Ошибка при получении апдейтов, повтор через {delay:.0f} с: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, POLLING_MAX_BACKOFF)
+            continue
+
+        delay = 1.0
+        for update in updates:
+            await handler(update.model_dump(mode="json", exclude_unset=True, by_alias=True))
+            offset = update.update_id + 1
+
+
+async def main() -> None:
+    """
+    Главная функция супервизора.
+    """
+    # Миграции и начальные данные - один раз, до запуска процессов
+    try:
+        await init_db()
+        await init_models()
+        logger.info("База данных инициализирована успешно")
+    except Exception as e:
+        logger.error(f"Ошибка при инициализации базы данных: {e}")
+        return
+    finally:
+        await close_db()
+
+    bot = create_bot()
+    # Диспетчер супервизора нужен только для списка используемых типов апдейтов
+    allowed_updates = create_dispatcher().resolve_used_update_types()
+    supervisor = ShardSupervisor(run_worker, shards=SHARDS)
+    stop_event = stop_on_signals()
+
+    await supervisor.start()
+    try:
+        if BOT_MODE == "webhook":
+            # Один обработчик очереди сервера сохраняет порядок апдейтов при передаче шардам
+            server = WebhookServer(supervisor.route, workers=1)
+            supervisor.ingest_metrics = server.get_metrics
+            await server.start()
+            try:
+                await register_webhook(bot, server.secret, allowed_updates)
+                await stop_event.wait()
+            finally:
+                await server.stop()
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            polling = asyncio.create_task(poll_updates(bot, allowed_updates, supervisor.route))
+            await stop_event.wait()
+            polling.cancel()
+            await asyncio.gather(polling, return_exceptions=True)
+    finally:
+        await supervisor.stop()
+        await bot.session.close()
+        logger.info("Супервизор остановлен")
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except (KeyboardInterrupt, SystemExit):
+        logger.info("Бот остановлен")
+    except Exception as e:
+        logger.error(f"Критическая ошибка: {e}")
@@ -0,0 +1,57 @@
+"""
+Извлечение значений из неполного (потокового) JSON.
+"""
+import re
+from typing import Optional
+
+# Простые escape-последовательности JSON
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+def partial_json_string(buffer: str, key: str) -> Optional[str]:
+    """
+    Возвращает уже полученную часть строкового значения ключа из неполного JSON.
+
+    Разбирается только первое вхождение "key": "...". Незавершенная
+    escape-последовательность в конце буфера отбрасывается до прихода
+    следующей части.
+
+    Args:
+        buffer: Начало JSON-документа
+        key: Имя ключа верхнего уровня со строковым значением
+
+    Returns:
+        Полученная часть значения или None, если значение еще не началось
+    """
+    match = re.search(r'"' + re.escape(key) + r'"\s*:\s*"', buffer)
+    if match is None:
+        return None
+
+    chars = []
+    i = match.end()
+    while i < len(buffer):
+        char = buffer[i]
+        if char == '"':
+            break
+        if char != "\\":
+            chars.append(char)
+            i += 1
+            continue
+
+        if i + 1 >= len(buffer):
+            break
+        escape = buffer[i + 1]
+        if escape == "u":
+            code = buffer[i + 2:i + 6]
+            if len(code) < 4:
+                break
+            try:
+                chars.append(chr(int(code, 16)))
+            except ValueError:
+                break
+            i += 6
+        else:
+            chars.append(_ESCAPES.get(escape, escape))
+            i += 2
+
+    return "".join(chars)
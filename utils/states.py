@@ -19,6 +19,7 @@ class OnboardingStates(StatesGroup):
     current_tools = State()
     
     # Подбор тарифа
+    analyzing = State()
     tariff_selection = State()
     
     # Дополнительные действия